@@ -1,83 +1,67 @@
+import asyncio
 import csv
-import io
 
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
 
+from app import metrics
+from app.csv_store import get_record_store, iter_csv_records, iter_export_bytes
+
 router = APIRouter(prefix="/api", tags=["csv"])
 
-# --- MOCK DATA (sostituirai con storage reale)
-CATALOGHI = [
-    {"id": "CAT-001", "nome": "Imbracature"},
-    {"id": "CAT-002", "nome": "Cordini"},
-]
-SCHEDE = [{"id": "SCH-001", "catalogo_id": "CAT-001", "titolo": "Imbracatura X"}]
-PERCORSI = [{"id": "PER-001", "nome": "Linea vita tetto A", "stato": "attivo"}]
-
-
-def _csv_response(rows, filename):
-    buf = io.StringIO(newline="")
-    w = (
-        csv.DictWriter(buf, fieldnames=rows[0].keys())
-        if rows
-        else csv.DictWriter(buf, fieldnames=["vuoto"])
-    )
-    w.writeheader()
-    for r in rows:
-        w.writerow(r)
-    data = buf.getvalue().encode("utf-8-sig")  # BOM
+# Cataloghi, schede e percorsi: SQLite persistente (app/csv_store.py),
+# upsert per `id`, import riga per riga, export in streaming con BOM
+
+
+def _csv_response(collection, filename):
     return StreamingResponse(
-        io.BytesIO(data),
+        iter_export_bytes(get_record_store(), collection),
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
+async def _import_csv(collection, file):
+    # UploadFile è già su file temporaneo: parse + upsert fuori dall'event loop
+    try:
+        imported, skipped = await asyncio.to_thread(
+            get_record_store().upsert, collection, iter_csv_records(file.file)
+        )
+    except UnicodeDecodeError:
+        raise HTTPException(400, "CSV non in UTF-8")
+    except csv.Error as exc:
+        raise HTTPException(400, f"CSV non valido: {exc}")
+    metrics.record_import(collection, imported, file.size or 0)
+    return {"imported": imported, "skipped": skipped}
+
+
 @router.get("/cataloghi/export")
 def export_cataloghi():
-    return _csv_response(CATALOGHI, "cataloghi.csv")
+    return _csv_response("cataloghi", "cataloghi.csv")
 
 
 @router.get("/schede/export")
 def export_schede():
-    return _csv_response(SCHEDE, "schede.csv")
+    return _csv_response("schede", "schede.csv")
 
 
 @router.get("/percorsi/export")
 def export_percorsi():
-    return _csv_response(PERCORSI, "percorsi.csv")
+    return _csv_response("percorsi", "percorsi.csv")
 
 
 @router.post("/cataloghi/import")
 async def import_cataloghi(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(400, "Carica un CSV")
-    text = (await file.read()).decode("utf-8-sig")
-    rdr = csv.DictReader(io.StringIO(text))
-    rows = list(rdr)
-    if rows:  # replace mock for now
-        global CATALOGHI
-        CATALOGHI = rows
-    return {"imported": len(rows)}
+    return await _import_csv("cataloghi", file)
 
 
 @router.post("/schede/import")
 async def import_schede(file: UploadFile = File(...)):
-    text = (await file.read()).decode("utf-8-sig")
-    rdr = csv.DictReader(io.StringIO(text))
-    rows = list(rdr)
-    if rows:
-        global SCHEDE
-        SCHEDE = rows
-    return {"imported": len(rows)}
+    return await _import_csv("schede", file)
 
 
 @router.post("/percorsi/import")
 async def import_percorsi(file: UploadFile = File(...)):
-    text = (await file.read()).decode("utf-8-sig")
-    rdr = csv.DictReader(io.StringIO(text))
-    rows = list(rdr)
-    if rows:
-        global PERCORSI
-        PERCORSI = rows
-    return {"imported": len(rows)}
+    return await _import_csv("percorsi", file)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# ============================================================
+# Storage CSV cataloghi / schede / percorsi
+# - SQLite locale (journal WAL): un record per (collezione, id), upsert
+# - Colonne per collezione in ordine di prima comparsa (header export)
+# - Import riga per riga a batch, in una transazione per file
+# - Lettura a batch per rowid: l'export non tiene in memoria la collezione
+# ============================================================
+
+Record = Dict[str, str]
+
+# colonne di base per collezione (header anche a collezione vuota)
+COLLECTIONS: Dict[str, Tuple[str, ...]] = {
+    "cataloghi": ("id", "nome"),
+    "schede": ("id", "catalogo_id", "titolo"),
+    "percorsi": ("id", "nome", "stato"),
+}
+
+BATCH_ROWS = 1000
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def _db_path() -> Path:
+    env = (os.getenv("CSV_STORE_DB") or "").strip()
+    return Path(env).expanduser() if env else Path("data") / "csv_store.sqlite3"
+
+
+def iter_csv_records(fh: IO[bytes]) -> Iterator[Record]:
+    """
+    Righe di un CSV UTF-8 (BOM opzionale) lette a chunk: in memoria c'è
+    una riga alla volta. Byte non UTF-8 → UnicodeDecodeError.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def lines() -> Iterator[str]:
+        pending = ""
+        while True:
+            chunk = fh.read(READ_CHUNK_BYTES)
+            pending += decoder.decode(chunk, final=not chunk)
+            start = 0
+            while True:
+                nl = pending.find("\n", start)
+                if nl < 0:
+                    break
+                yield pending[start : nl + 1]
+                start = nl + 1
+            pending = pending[start:]
+            if not chunk:
+                break
+        if pending:
+            yield pending
+
+    for row in csv.DictReader(lines()):
+        # colonne senza nome / valori oltre l'header: scartati
+        yield {k: (v or "").strip() for k, v in row.items() if k}
+
+
+class RecordStore:
+    """
+    Collezioni di record con chiave `id`.
+    - upsert(): import a batch, un record con lo stesso id viene sostituito
+      (mantiene la posizione originale)
+    - iter_batches(): record in ordine di inserimento, a pagine per rowid
+      (ogni pagina è una query a sé: sicuro anche se i batch vengono letti
+      da thread diversi, come fa StreamingResponse)
+    Una connessione per thread.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+            -- (collection, rowid): export a pagine in ordine di inserimento
+            CREATE INDEX IF NOT EXISTS ix_records_collection ON records(collection);
+            CREATE TABLE IF NOT EXISTS columns (
+                collection TEXT NOT NULL,
+                name TEXT NOT NULL,
+                pos INTEGER NOT NULL,
+                PRIMARY KEY (collection, name)
+            );
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def columns(self, collection: str) -> List[str]:
+        """Header: colonne di base + quelle viste negli import, in ordine."""
+        cur = self._conn().execute(
+            "SELECT name FROM columns WHERE collection = ? ORDER BY pos", (collection,)
+        )
+        names = list(COLLECTIONS.get(collection, ("id",)))
+        names += [name for (name,) in cur if name not in names]
+        return names
+
+    def upsert(self, collection: str, records: Iterable[Record]) -> Tuple[int, int]:
+        """
+        Upsert per id in un'unica transazione (un errore annulla il file).
+        Ritorna (importati, scartati senza id).
+        """
+        conn = self._conn()
+        imported = skipped = 0
+        seen: Dict[str, None] = {}
+        with self._write_lock, conn:
+            known = {
+                name
+                for (name,) in conn.execute(
+                    "SELECT name FROM columns WHERE collection = ?", (collection,)
+                )
+            }
+            batch: List[Tuple[str, str, str]] = []
+            for rec in records:
+                rid = rec.get("id", "")
+                if not rid:
+                    skipped += 1
+                    continue
+                for name in rec:
+                    if name not in known:
+                        seen[name] = None
+                        known.add(name)
+                batch.append((collection, rid, json.dumps(rec, ensure_ascii=False)))
+                if len(batch) >= BATCH_ROWS:
+                    imported += self._write_batch(conn, batch)
+                    batch = []
+            imported += self._write_batch(conn, batch)
+            if seen:
+                (start,) = conn.execute(
+                    "SELECT COALESCE(MAX(pos), -1) + 1 FROM columns "
+                    "WHERE collection = ?",
+                    (collection,),
+                ).fetchone()
+                conn.executemany(
+                    "INSERT INTO columns(collection, name, pos) VALUES (?, ?, ?)",
+                    [(collection, name, start + i) for i, name in enumerate(seen)],
+                )
+        return imported, skipped
+
+    @staticmethod
+    def _write_batch(
+        conn: sqlite3.Connection, batch: List[Tuple[str, str, str]]
+    ) -> int:
+        conn.executemany(
+            "INSERT INTO records(collection, id, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(collection, id) DO UPDATE SET data = excluded.data",
+            batch,
+        )
+        return len(batch)
+
+    def iter_batches(
+        self, collection: str, size: int = BATCH_ROWS
+    ) -> Iterator[List[Record]]:
+        last = 0
+        while True:
+            rows = (
+                self._conn()
+                .execute(
+                    "SELECT rowid, data FROM records "
+                    "WHERE collection = ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (collection, last, size),
+                )
+                .fetchall()
+            )
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [json.loads(data) for _, data in rows]
+
+    def count(self, collection: str) -> int:
+        (n,) = (
+            self._conn()
+            .execute("SELECT COUNT(*) FROM records WHERE collection = ?", (collection,))
+            .fetchone()
+        )
+        return int(n)
+
+
+_stores: Dict[Path, RecordStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_record_store(db_path: Optional[Path] = None) -> RecordStore:
+    """RecordStore condiviso per file (CSV_STORE_DB, default data/csv_store.sqlite3)."""
+    key = (db_path or _db_path()).resolve()
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = RecordStore(key)
+        return store
+
+
+def iter_export_bytes(store: RecordStore, collection: str) -> Iterator[bytes]:
+    """CSV in streaming: BOM, header, poi un blocco di byte per batch di record."""
+    yield codecs.BOM_UTF8
+    buf = io.StringIO()
+    writer = csv.DictWriter(
+        buf, fieldnames=store.columns(collection), restval="", extrasaction="ignore"
+    )
+    writer.writeheader()
+    for batch in store.iter_batches(collection):
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")  # solo header: collezione vuota
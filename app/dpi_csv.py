@@ -1,27 +1,165 @@
 from __future__ import annotations
 
+import asyncio
+import codecs
 import csv
+import hashlib
+import html
 import io
 import json
+import logging
 import os
-from datetime import datetime
+import re
+import threading
+import time
+import uuid
+import warnings
+import weakref
+import zlib
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, List, Tuple
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from fastapi import APIRouter, UploadFile, File, Body, Query, FastAPI
-from fastapi.responses import PlainTextResponse, HTMLResponse, JSONResponse
+from fastapi import (
+    APIRouter,
+    UploadFile,
+    File,
+    Body,
+    Depends,
+    Header,
+    Query,
+    FastAPI,
+    HTTPException,
+    Request,
+)
+from fastapi.responses import (
+    PlainTextResponse,
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
+
+from app import dpi_manifest, dpi_store
+from app import metrics as prom_metrics
+from app.dpi_index import parse_prezzo_cents
+
+log = logging.getLogger("tpi.dpi_csv")
 
 # ============================================================
 # Router Catalogo DPI
 # - Template CSV stabile
-# - Import CSV (raw + file)
+# - Import CSV (raw + file); CSV grandi via parser colonnare (pandas)
 # - Merge idempotente su "codice"
-# - Export CSV
-# - Catalogo JSON
-# - Metrics + mini report HTML
+# - Persistenza pluggable: json | wal | sqlite (CATALOGHI_STORAGE)
+# - Cache in memoria condivisa per gli endpoint di lettura
+# - Writer unico per catalogo: import concorrenti coalescenti
+# - Job di import in background (?job=true → 202 + /jobs/{id})
+# - Archivio import per contenuto (sha256): file già visti → "duplicate"
+# - Manifest dell'archivio (totali import) → /metrics in O(1)
+# - Pulizia archivio in background: gzip + retention, lettura trasparente
+# - Export CSV / NDJSON / Parquet / Arrow IPC (pyarrow opzionale)
+# - Catalogo JSON + ricerca per frammenti (/search)
+# - ETag sulla revisione del catalogo: If-None-Match → 304 senza leggere
+# - Metrics + mini report HTML (a pagine, in cache per revisione)
+# - Serie Prometheus (app/metrics.py): righe/byte importati, dimensione
+#   catalogo, hit/miss di cache catalogo e report
+# - Multi-tenant (header X-Tenant-Id): dati, cache, indici, writer e
+#   archivio separati per tenant; il tenant di default usa la base storica
 # ============================================================
 
-router = APIRouter(prefix="/api/dpi/csv", tags=["csv"])
+# ---------- Tenant ----------
+
+DEFAULT_TENANT = "default"
+TENANT_HEADER = "X-Tenant-Id"
+_TENANT_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+
+# tenant della richiesta corrente: i task e i thread avviati dalla
+# richiesta (job, to_thread) ne ereditano il valore
+_tenant: ContextVar[str] = ContextVar("dpi_tenant", default=DEFAULT_TENANT)
+
+
+def _allowed_tenants() -> Optional[set[str]]:
+    raw = (os.getenv("CATALOGHI_TENANTS") or "").strip()
+    if not raw:
+        return None
+    return {t.strip() for t in raw.split(",") if t.strip()} | {DEFAULT_TENANT}
+
+
+def _tenant_provisioned(tenant: str) -> bool:
+    """
+    Tenant ammesso.
+    - default: sempre
+    - CATALOGHI_TENANTS impostata: solo gli id elencati (albero creato
+      al primo uso)
+    - altrimenti: solo i tenant con l'albero già presente su disco
+      (<radice>/tenants/<id>/, creato dall'amministratore)
+    Un id inventato dal client non crea directory, store né serie di metriche.
+    """
+    if tenant == DEFAULT_TENANT:
+        return True
+    allowed = _allowed_tenants()
+    if allowed is not None:
+        return tenant in allowed
+    return (_data_root() / "tenants" / tenant).is_dir()
+
+
+async def _bind_tenant(
+    x_tenant_id: Optional[str] = Header(None, alias=TENANT_HEADER),
+) -> str:
+    """
+    Tenant dall'header X-Tenant-Id (assente → default).
+    - id non valido → 400 (diventa un nome di directory)
+    - tenant non abilitato (vedi _tenant_provisioned) → 403
+    Dipendenza async: il valore resta nel contesto della richiesta anche
+    per gli endpoint sincroni eseguiti nel threadpool.
+    """
+    tenant = (x_tenant_id or "").strip() or DEFAULT_TENANT
+    if not _TENANT_RE.fullmatch(tenant):
+        raise HTTPException(status_code=400, detail=f"{TENANT_HEADER} non valido")
+    if not _tenant_provisioned(tenant):
+        raise HTTPException(status_code=403, detail="Tenant non abilitato")
+    _tenant.set(tenant)
+    return tenant
+
+
+router = APIRouter(
+    prefix="/api/dpi/csv", tags=["csv"], dependencies=[Depends(_bind_tenant)]
+)
+
+# Import in streaming: dimensione chunk di lettura e batch di merge
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MERGE_BATCH_ROWS = 5000
+
+# Parser colonnare (pandas) per CSV da almeno questi byte; righe per blocco
+BULK_PARSE_MIN_BYTES = int(
+    os.getenv("CATALOGHI_BULK_PARSE_BYTES", str(4 * 1024 * 1024))
+)
+BULK_CHUNK_ROWS = 50_000
+
+# Export in streaming: righe per flush
+EXPORT_BATCH_ROWS = 1000
+TEMPLATE_COLUMNS = ["codice", "descrizione", "prezzo", "gruppo"]
+
+# Finestra di coalescenza del writer: import arrivati entro la finestra
+# finiscono in un solo merge + un solo salvataggio
+COALESCE_WINDOW_SEC = float(os.getenv("CATALOGHI_COALESCE_MS", "25")) / 1000.0
+
+# Job di import conservati in memoria (i più vecchi conclusi vengono scartati)
+MAX_IMPORT_JOBS = 500
 
 # App FastAPI + health -------------------------------------------------
 
@@ -39,9 +177,9 @@ def health() -> dict[str, str]:
 # ---------- Helpers filesystem / dati ----------
 
 
-def _base_dir() -> Path:
+def _data_root() -> Path:
     """
-    Directory base per i dati del catalogo.
+    Radice dei dati del catalogo.
     - Usa CATALOGHI_BASE_DIR se presente
     - Altrimenti: data/cataloghi
     """
@@ -51,8 +189,27 @@ def _base_dir() -> Path:
     return Path("data") / "cataloghi"
 
 
+def _base_dir() -> Path:
+    """
+    Directory base del tenant corrente.
+    - default: la radice (layout storico, dati esistenti invariati)
+    - altri: <radice>/tenants/<id>, con file, cache e writer propri
+    """
+    tenant = _tenant.get()
+    root = _data_root()
+    return root if tenant == DEFAULT_TENANT else root / "tenants" / tenant
+
+
+_trees: Dict[Path, Tuple[Path, Path, Path, Path]] = {}
+
+
 def _ensure_tree() -> Tuple[Path, Path, Path, Path]:
+    """Directory del catalogo; i mkdir avvengono una sola volta per base."""
     base = _base_dir()
+    tree = _trees.get(base)
+    if tree is not None:
+        return tree
+
     inbox_dir = base / "inbox"
     clean_dir = base / "clean"
     imports_dir = base / "imports"
@@ -63,40 +220,63 @@ def _ensure_tree() -> Tuple[Path, Path, Path, Path]:
 
     # File JSON "canonico" del catalogo
     items_path = clean_dir / "dpi_items.json"
-    return base, imports_dir, items_path, reports_dir
+    # manifest pronto prima di ogni nuovo file in archivio (e pulizia avviata)
+    dpi_manifest.get_manifest(imports_dir)
+    tree = _trees[base] = (base, imports_dir, items_path, reports_dir)
+    return tree
 
 
-def _load_json() -> List[dict[str, Any]]:
+def _catalog_store() -> dpi_store.CatalogStore:
     _, _, items_path, _ = _ensure_tree()
-    if not items_path.exists():
-        return []
-    try:
-        return json.loads(items_path.read_text(encoding="utf-8"))
-    except Exception:
-        return []
+    return dpi_store.get_store(items_path)
 
 
-def _save_json(items: List[dict[str, Any]]) -> None:
-    _, _, items_path, _ = _ensure_tree()
-    items_path.write_text(
-        json.dumps(items, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+def _load_for_update(store: dpi_store.CatalogStore) -> List[dict[str, Any]]:
+    # copia superficiale: _merge_items non muta mai gli item esistenti
+    return list(store.read())
+
+
+def _commit_items(
+    store: dpi_store.CatalogStore,
+    items: List[dict[str, Any]],
+    changed: List[dict[str, Any]],
+) -> None:
+    """
+    Persiste l'esito di un merge.
+    - json: riscrive lo snapshot completo
+    - wal / sqlite: scrive solo gli item inseriti/aggiornati (costo ∝ delta)
+    """
+    store.commit(items, changed)
 
 
 def _normalize_row(row: dict[str, Any]) -> dict[str, str]:
-    return {
+    out = {
         "codice": (row.get("codice") or "").strip(),
         "descrizione": (row.get("descrizione") or "").strip(),
         "prezzo": (row.get("prezzo") or "").strip(),
         "gruppo": (row.get("gruppo") or "").strip(),
     }
+    # colonna opzionale: presente solo se il CSV la porta
+    if "stato" in row:
+        out["stato"] = (row.get("stato") or "").strip()
+    return out
 
 
 def _merge_items(
-    items: List[dict[str, Any]], rows: List[dict[str, Any]]
+    items: List[dict[str, Any]],
+    rows: List[dict[str, Any]],
+    changed: Optional[List[dict[str, Any]]] = None,
+    idx: Optional[Dict[str, int]] = None,
 ) -> Tuple[int, int]:
-    idx = {(it.get("codice") or "").strip(): i for i, it in enumerate(items)}
+    """
+    Merge idempotente su "codice".
+    Se passato, `changed` raccoglie gli item inseriti/aggiornati (il delta).
+    `idx` (codice → posizione) può essere riusato tra batch successivi.
+    Copy-on-write: un item aggiornato viene sostituito, mai mutato, così
+    la lista in cache resta valida per i lettori concorrenti.
+    """
+    if idx is None:
+        idx = _index_items(items)
     updated = 0
     for r in rows:
         k = (r.get("codice") or "").strip()
@@ -104,17 +284,26 @@ def _merge_items(
             continue
         if k in idx:
             i = idx[k]
-            before = items[i].copy()
+            before = items[i]
             # aggiorna solo campi valorizzati
-            items[i].update({k2: v for k2, v in r.items() if v != ""})
-            if items[i] != before:
+            after = {**before, **{k2: v for k2, v in r.items() if v != ""}}
+            if after != before:
+                items[i] = after
                 updated += 1
+                if changed is not None:
+                    changed.append(after)
         else:
             items.append(r)
             idx[k] = len(items) - 1
+            if changed is not None:
+                changed.append(r)
     return updated, len(rows)
 
 
+def _index_items(items: List[dict[str, Any]]) -> Dict[str, int]:
+    return {(it.get("codice") or "").strip(): i for i, it in enumerate(items)}
+
+
 def _parse_csv_bytes(raw: bytes) -> Tuple[list[dict[str, Any]], int]:
     text = raw.decode("utf-8-sig", errors="replace")
     reader = csv.DictReader(io.StringIO(text))
@@ -122,6 +311,599 @@ def _parse_csv_bytes(raw: bytes) -> Tuple[list[dict[str, Any]], int]:
     return rows, len(rows)
 
 
+# ---------- Import in streaming (memoria costante) ----------
+
+
+def _iter_file_chunks(fh: BinaryIO, size: int = UPLOAD_CHUNK_BYTES) -> Iterator[bytes]:
+    while True:
+        chunk = fh.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_closing(fh: BinaryIO) -> Iterator[bytes]:
+    with fh:
+        yield from _iter_file_chunks(fh)
+
+
+def _iter_text_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """
+    Decodifica incrementale (utf-8-sig: BOM rimosso anche se spezzato tra
+    chunk) e split per righe con terminatore incluso, come serve a csv.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        start = 0
+        while True:
+            nl = pending.find("\n", start)
+            if nl < 0:
+                break
+            yield pending[start : nl + 1]
+            start = nl + 1
+        pending = pending[start:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _iter_row_batches(
+    lines: Iterable[str], size: int = MERGE_BATCH_ROWS
+) -> Iterator[List[dict[str, Any]]]:
+    batch: List[dict[str, Any]] = []
+    for row in csv.DictReader(lines):
+        batch.append(_normalize_row(row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---------- Archivio import per contenuto (sha256) ----------
+#
+# Un import viene scritto in un temporaneo (imports/.upload-*.part) e
+# pubblicato come imports/<sha256>.csv solo dopo il commit del merge,
+# insieme alla voce nel manifest. "duplicate" = sha256 già registrato nel
+# manifest: un import fallito, annullato o ancora in corso non lo è mai.
+
+
+def _archive_path(imports_dir: Path, sha256: str) -> Path:
+    return imports_dir / f"{sha256}.csv"
+
+
+def _staging_path(imports_dir: Path) -> Path:
+    return imports_dir / f".upload-{uuid.uuid4().hex}.part"
+
+
+def _find_archived(imports_dir: Path, name: str) -> Optional[Path]:
+    """Import archiviato per sha256 o nome file, anche se già compresso."""
+    for candidate in (f"{name}.csv", f"{name}.csv.gz", name, f"{name}.gz"):
+        path = imports_dir / candidate
+        if path.name.endswith((".csv", ".csv.gz")) and path.is_file():
+            return path
+    return None
+
+
+def _write_chunk(fh: BinaryIO, digest: Any, chunk: bytes) -> None:
+    fh.write(chunk)
+    digest.update(chunk)
+
+
+def _committed(imports_dir: Path, sha256: str) -> bool:
+    return dpi_manifest.get_manifest(imports_dir).has(sha256)
+
+
+def _stage_bytes(raw: bytes, imports_dir: Path) -> Tuple[Optional[Path], str]:
+    """
+    Temporaneo con il CSV ricevuto in memoria. Ritorna (temporaneo, sha256);
+    contenuto già importato → (None, sha256), niente scrittura.
+    """
+    sha256 = hashlib.sha256(raw).hexdigest()
+    if _committed(imports_dir, sha256):
+        return None, sha256
+    tmp = _staging_path(imports_dir)
+    try:
+        tmp.write_bytes(raw)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return tmp, sha256
+
+
+async def _stage_upload(
+    file: UploadFile, imports_dir: Path
+) -> Tuple[Optional[Path], str]:
+    """
+    Copia l'upload su disco a chunk (senza caricarlo tutto in RAM)
+    calcolando lo sha256. Ritorna (temporaneo, sha256); contenuto già
+    importato → (None, sha256), temporaneo rimosso.
+    Scrittura e hash di ogni chunk nel threadpool: l'event loop resta
+    libero anche per upload di centinaia di MB.
+    """
+    digest = hashlib.sha256()
+    tmp = _staging_path(imports_dir)
+    try:
+        with tmp.open("wb") as fh:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                await asyncio.to_thread(_write_chunk, fh, digest, chunk)
+        sha256 = digest.hexdigest()
+        duplicate = await asyncio.to_thread(_committed, imports_dir, sha256)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if duplicate:
+        tmp.unlink(missing_ok=True)
+        return None, sha256
+    return tmp, sha256
+
+
+Opener = Callable[[], BinaryIO]
+
+
+def _iter_stream_batches(open_source: Opener) -> Iterator[List[dict[str, Any]]]:
+    with open_source() as fh:
+        yield from _iter_row_batches(_iter_text_lines(_iter_file_chunks(fh)))
+
+
+def _iter_source_batches(
+    open_source: Opener, size_bytes: int
+) -> Iterator[List[dict[str, Any]]]:
+    """Sceglie il parser: colonnare sopra BULK_PARSE_MIN_BYTES, csv altrimenti."""
+    if (
+        size_bytes >= BULK_PARSE_MIN_BYTES
+        and _pandas() is not None
+        and _bulk_compatible(open_source)
+    ):
+        return _iter_bulk_batches(open_source)
+    return _iter_stream_batches(open_source)
+
+
+def _iter_csv_file_batches(path: Path) -> Iterator[List[dict[str, Any]]]:
+    """
+    Batch di righe normalizzate da un CSV archiviato: in memoria c'è al
+    più un batch di righe (o un blocco del parser colonnare) oltre al
+    catalogo.
+    """
+    yield from _iter_source_batches(lambda: path.open("rb"), path.stat().st_size)
+
+
+def _iter_raw_batches(raw: bytes) -> Iterator[List[dict[str, Any]]]:
+    """Righe di un CSV ricevuto in memoria (/save)."""
+    if len(raw) >= BULK_PARSE_MIN_BYTES:
+        yield from _iter_source_batches(lambda: io.BytesIO(raw), len(raw))
+    else:
+        yield _parse_csv_bytes(raw)[0]
+
+
+# ---------- Parser colonnare (pandas) ----------
+#
+# csv.DictReader + _normalize_row costruiscono e ripuliscono una riga alla
+# volta; pandas tokenizza in C e restituisce colonne intere, ripulite con
+# un solo map(str.strip) per colonna. L'output deve restare identico:
+# - prescan dei byte per i casi in cui i due parser divergono
+# - header confrontato con quello letto da csv
+# - qualunque errore di pandas → si prosegue con csv saltando le righe
+#   già prodotte
+
+# CR isolato (csv lo rifiuta) / riga di soli spazi (csv la conta, pandas no)
+_BULK_BARE_CR = re.compile(rb"\r(?!\n)")
+_BULK_BLANK_LINE = re.compile(rb"\n[ \t\f\v]+\r?\n")
+# file vuoto o prima riga vuota (per csv diventa l'header)
+_BULK_UNSAFE_HEAD = re.compile(rb"(?:\xef\xbb\xbf)?[ \t\f\v]*(?:\r?\n|\Z)")
+_BULK_UNSAFE_TAIL = re.compile(rb"\n?[ \t\f\v]+")
+
+
+class _BulkMismatch(ValueError):
+    """Input che il parser colonnare non leggerebbe come csv.DictReader."""
+
+
+def _pandas() -> Any:
+    try:
+        import pandas
+    except ImportError:
+        return None
+    return pandas
+
+
+def _bulk_compatible(open_source: Opener) -> bool:
+    """
+    Prescan dei byte (regex in C, a chunk). Falsi positivi possibili, es.
+    righe di spazi dentro un campo quotato: in quel caso si usa csv.
+    """
+    with open_source() as fh:
+        chunk = fh.read(UPLOAD_CHUNK_BYTES)
+        if _BULK_UNSAFE_HEAD.match(chunk):
+            return False
+        carry = b""
+        while chunk:
+            data = carry + chunk
+            # la riga incompleta in coda viene riesaminata col chunk successivo
+            cut = data.rfind(b"\n")
+            body, carry = (data[: cut + 1], data[cut:]) if cut >= 0 else (b"", data)
+            if b"\x00" in body or _BULK_BLANK_LINE.search(body):
+                return False
+            if b"\r" in body and _BULK_BARE_CR.search(body):
+                return False
+            chunk = fh.read(UPLOAD_CHUNK_BYTES)
+    return not (
+        b"\x00" in carry or b"\r" in carry or _BULK_UNSAFE_TAIL.fullmatch(carry)
+    )
+
+
+def _csv_header(open_source: Opener) -> List[str]:
+    with open_source() as fh:
+        return next(csv.reader(_iter_text_lines(_iter_file_chunks(fh))), [])
+
+
+def _check_bulk_header(columns: List[str], header: List[str]) -> None:
+    # colonne senza nome o duplicate: pandas le rinomina, csv no
+    named = [h for h in header if h]
+    if len(columns) != len(header) or len(set(named)) != len(named):
+        raise _BulkMismatch("header")
+    if any(h and c != h for c, h in zip(columns, header)):
+        raise _BulkMismatch("header")
+
+
+def _bulk_frame_rows(df: Any, with_stato: bool) -> List[dict[str, Any]]:
+    limit = csv.field_size_limit()
+    n = len(df)
+    cols = []
+    for k in TEMPLATE_COLUMNS + (["stato"] if with_stato else []):
+        if k not in df.columns:
+            cols.append([""] * n)
+            continue
+        col = df[k].tolist()
+        if col and max(map(len, col)) > limit:
+            raise _BulkMismatch("field larger than field limit")
+        cols.append(list(map(str.strip, col)))
+    rows = [
+        {"codice": c, "descrizione": d, "prezzo": p, "gruppo": g}
+        for c, d, p, g in zip(*cols[:4])
+    ]
+    if with_stato:
+        for row, stato in zip(rows, cols[4]):
+            row["stato"] = stato
+    return rows
+
+
+def _skip_rows(
+    batches: Iterable[List[dict[str, Any]]], n: int
+) -> Iterator[List[dict[str, Any]]]:
+    for batch in batches:
+        if n >= len(batch):
+            n -= len(batch)
+            continue
+        yield batch[n:]
+        n = 0
+
+
+def _iter_bulk_batches(
+    open_source: Opener, size: int = MERGE_BATCH_ROWS
+) -> Iterator[List[dict[str, Any]]]:
+    """
+    Parser colonnare: pandas legge blocchi di BULK_CHUNK_ROWS righe come
+    colonne di stringhe, consegnati al merge in batch di `size` righe.
+    """
+    pd = _pandas()
+    header = _csv_header(open_source)
+    done = 0
+    try:
+        with open_source() as fh, warnings.catch_warnings():
+            # righe più lunghe dell'header: csv ignora l'eccedenza, pandas avvisa
+            warnings.simplefilter("ignore", pd.errors.ParserWarning)
+            reader = pd.read_csv(
+                fh,
+                dtype=object,
+                na_filter=False,
+                keep_default_na=False,
+                index_col=False,
+                encoding="utf-8-sig",
+                encoding_errors="replace",
+                chunksize=BULK_CHUNK_ROWS,
+            )
+            with reader:
+                for df in reader:
+                    _check_bulk_header(list(df.columns), header)
+                    rows = _bulk_frame_rows(df, "stato" in header)
+                    for start in range(0, len(rows), size):
+                        batch = rows[start : start + size]
+                        done += len(batch)
+                        yield batch
+    except ValueError as exc:
+        # ParserError / EmptyDataError / UnicodeError / _BulkMismatch
+        log.info("Parser colonnare non applicabile (%s): prosegue csv", exc)
+        yield from _skip_rows(_iter_stream_batches(open_source), done)
+
+
+# ---------- Writer unico (coalescenza import concorrenti) ----------
+
+# Sorgente di un import: ritorna un iterabile *nuovo* di batch di righe,
+# così il writer può ripeterla se un altro import dello stesso gruppo fallisce
+RowSource = Callable[[], Iterable[List[dict[str, Any]]]]
+MergeOutcome = Union[Tuple[int, int, int], BaseException]
+
+
+def _merge_sources(
+    store: dpi_store.CatalogStore, sources: List[RowSource]
+) -> List[MergeOutcome]:
+    """
+    Un solo merge + un solo salvataggio per tutti gli import del gruppo.
+    Esito per import: (rows_parsed, updated, total_items) oppure l'eccezione.
+    Se una sorgente fallisce si riparte dalla base senza di essa.
+    """
+    outcomes: Dict[int, MergeOutcome] = {}
+    while True:
+        items = _load_for_update(store)
+        idx = _index_items(items)
+        changed: List[dict[str, Any]] = []
+        counts: Dict[int, Tuple[int, int]] = {}
+        failed = False
+        for i, source in enumerate(sources):
+            if i in outcomes:
+                continue
+            parsed = updated = 0
+            mark = (len(items), len(changed))
+            try:
+                for batch in source():
+                    upd, n = _merge_items(items, batch, changed, idx)
+                    parsed += n
+                    updated += upd
+            except Exception as exc:  # noqa: BLE001
+                outcomes[i] = exc
+                failed = mark != (len(items), len(changed))
+                if failed:
+                    break  # merge parziale: si ricomincia dalla base
+                continue
+            counts[i] = (parsed, updated)
+        if failed:
+            continue
+        _commit_items(store, items, changed)
+        for i, (parsed, updated) in counts.items():
+            outcomes[i] = (parsed, updated, len(items))
+        return [outcomes[i] for i in range(len(sources))]
+
+
+class CatalogWriter:
+    """
+    Unico writer di un catalogo (per event loop).
+    Gli import accodano una sorgente di righe e attendono il proprio esito;
+    il task writer raccoglie quanto arriva entro COALESCE_WINDOW_SEC e lo
+    applica con un solo merge + salvataggio, fuori dall'event loop.
+    """
+
+    def __init__(self, store: dpi_store.CatalogStore) -> None:
+        self.store = store
+        self._queue: asyncio.Queue[Tuple[RowSource, asyncio.Future[Any]]] = (
+            asyncio.Queue()
+        )
+        self._task: Optional[asyncio.Task[None]] = None
+        self.submitted = 0
+        self.commits = 0
+
+    async def submit(self, source: RowSource) -> Tuple[int, int, int]:
+        fut: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((source, fut))
+        self.submitted += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            pending = [await self._queue.get()]
+            await asyncio.sleep(COALESCE_WINDOW_SEC)
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            sources = [src for src, _ in pending]
+            try:
+                outcomes = await asyncio.to_thread(_merge_sources, self.store, sources)
+            except Exception as exc:  # noqa: BLE001
+                outcomes = [exc] * len(pending)
+            else:
+                self.commits += 1
+            for (_, fut), outcome in zip(pending, outcomes):
+                if fut.done():
+                    continue
+                if isinstance(outcome, BaseException):
+                    fut.set_exception(outcome)
+                else:
+                    fut.set_result(outcome)
+
+
+# un writer per (event loop, catalogo): i task asyncio sono legati al loop
+_writers: weakref.WeakKeyDictionary[
+    Any, Dict[dpi_store.CatalogStore, CatalogWriter]
+] = weakref.WeakKeyDictionary()
+
+
+def _catalog_writer() -> CatalogWriter:
+    store = _catalog_store()
+    per_loop = _writers.setdefault(asyncio.get_running_loop(), {})
+    writer = per_loop.get(store)
+    if writer is None:
+        writer = per_loop[store] = CatalogWriter(store)
+    return writer
+
+
+# ---------- Job di import in background ----------
+
+
+def _utc_iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+class ImportJob:
+    """
+    Import eseguito in background: parse + merge avvengono nel thread del
+    writer, il client interroga /jobs/{id} per avanzamento ed esito.
+    """
+
+    def __init__(self, meta: dict[str, Any]) -> None:
+        self.id = uuid.uuid4().hex
+        self.tenant = _tenant.get()
+        self.meta = meta
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.rows_parsed = 0
+        self.rows_merged = 0
+        self.result: Optional[dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def track(self, source: RowSource) -> RowSource:
+        """Sorgente che aggiorna i contatori batch per batch."""
+
+        def tracked() -> Iterator[List[dict[str, Any]]]:
+            # ripartenza dopo un retry del writer: contatori da zero
+            self.rows_parsed = self.rows_merged = 0
+            if self.started_at is None:
+                self.started_at = time.time()
+                self.status = "running"
+            for batch in source():
+                self.rows_parsed += len(batch)
+                yield batch
+                self.rows_merged += len(batch)
+
+        return tracked
+
+    async def run(
+        self, writer: "CatalogWriter", source: RowSource, staged: Path
+    ) -> None:
+        try:
+            try:
+                parsed, updated, total = await writer.submit(self.track(source))
+            except Exception as exc:  # noqa: BLE001
+                self.status = "error"
+                self.error = f"{type(exc).__name__}: {exc}"
+                return
+            await _record_import(staged, self.meta, parsed)
+            self.status = "done"
+            self.result = {
+                **self.meta,
+                "rows_parsed": parsed,
+                "updated_existing": updated,
+                "total_items": total,
+            }
+        except asyncio.CancelledError:
+            # shutdown: esito non registrato, archivio rimosso nel finally
+            self.status = "cancelled"
+            self.error = "CancelledError: import annullato"
+            raise
+        finally:
+            # pubblicato da _record_import; altrimenti l'import non è valido
+            staged.unlink(missing_ok=True)
+            self.finished_at = time.time()
+
+    def to_dict(self) -> dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "status_url": f"{router.prefix}/jobs/{self.id}",
+            "created_at": _utc_iso(self.created_at),
+            "started_at": _utc_iso(self.started_at),
+            "finished_at": _utc_iso(self.finished_at),
+            "duration_ms": (
+                int((end - self.started_at) * 1000) if self.started_at else None
+            ),
+            "rows_parsed": self.rows_parsed,
+            "rows_merged": self.rows_merged,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+
+
+def _register_job(job: ImportJob) -> None:
+    _jobs[job.id] = job
+    while len(_jobs) > MAX_IMPORT_JOBS:
+        oldest = next(iter(_jobs.values()))
+        if oldest.finished_at is None:
+            break
+        _jobs.popitem(last=False)
+
+
+async def _record_import(staged: Path, meta: dict[str, Any], rows: int) -> None:
+    """
+    Dopo il commit: pubblica l'archivio e aggiorna il manifest (del tenant
+    dell'import). Un errore qui non annulla l'import.
+    """
+    imports_dir = staged.parent
+    try:
+        entry = await asyncio.to_thread(
+            dpi_manifest.get_manifest(imports_dir).publish,
+            staged,
+            _archive_path(imports_dir, meta["sha256"]),
+            sha256=meta["sha256"],
+            filename=meta.get("filename"),
+            rows=rows,
+        )
+    except OSError:
+        log.exception("Manifest import non aggiornato: %s", staged)
+        return
+    if entry is None:
+        return  # stesso contenuto già registrato da un import concorrente
+    prom_metrics.record_import("catalogo_dpi", rows, entry["bytes"])
+
+
+def _duplicate_response(meta: dict[str, Any]) -> JSONResponse:
+    """Contenuto già importato: nessun parse né merge."""
+    payload = {
+        **meta,
+        "status": "duplicate",
+        "rows_parsed": 0,
+        "updated_existing": 0,
+        "total_items": _catalog_store().count(),
+    }
+    return JSONResponse(payload)
+
+
+async def _submit_import(
+    source: RowSource,
+    meta: dict[str, Any],
+    as_job: bool,
+    staged: Path,
+) -> JSONResponse:
+    """
+    Consegna un import al writer.
+    - sincrono: attende l'esito e lo restituisce
+    - job: risponde subito 202 con l'id del job
+    Il temporaneo `staged` diventa l'archivio solo se il merge va a buon
+    fine; in ogni altro caso (errore, annullamento) viene rimosso.
+    """
+    if as_job:
+        job = ImportJob(meta)
+        _register_job(job)
+        job._task = asyncio.create_task(job.run(_catalog_writer(), source, staged))
+        body = job.to_dict()
+        return JSONResponse(
+            body, status_code=202, headers={"Location": body["status_url"]}
+        )
+
+    try:
+        parsed, updated, total = await _catalog_writer().submit(source)
+        await _record_import(staged, meta, parsed)
+    finally:
+        staged.unlink(missing_ok=True)
+    payload = {
+        **meta,
+        "rows_parsed": parsed,
+        "updated_existing": updated,
+        "total_items": total,
+    }
+    return JSONResponse(payload)
+
+
 # ---------- Routes principali ----------
 
 
@@ -130,146 +912,578 @@ def template_csv() -> PlainTextResponse:
     """
     Template CSV v1 — header stabile.
     """
-    header = "codice,descrizione,prezzo,gruppo\n"
+    header = ",".join(TEMPLATE_COLUMNS) + "\n"
     return PlainTextResponse(header, media_type="text/csv")
 
 
 @router.post("/save")
 async def import_and_save_csv(
-    raw: bytes = Body(..., media_type="text/csv")
+    raw: bytes = Body(..., media_type="text/csv"),
+    job: bool = Query(False, description="true → 202 + job in background"),
 ) -> JSONResponse:
     """
     Import CSV da raw text/csv (es. pipeline CI, automazioni).
-    - Salva il file in data/cataloghi/imports
+    - Salva il file in data/cataloghi/imports/<sha256>.csv
+    - Contenuto già importato → status "duplicate", nessun merge
     - Merge idempotente su JSON canonico in data/cataloghi/clean/dpi_items.json
+    - job=true: risposta immediata 202, esito su /jobs/{id}
     """
     _, imports_dir, _, _ = _ensure_tree()
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    dest = imports_dir / f"catalogo_{ts}.csv"
-    dest.write_bytes(raw)
-
-    rows, parsed = _parse_csv_bytes(raw)
-    items = _load_json()
-    updated, _ = _merge_items(items, rows)
-    _save_json(items)
+    # hash + scrittura del body fuori dall'event loop
+    staged, sha256 = await asyncio.to_thread(_stage_bytes, raw, imports_dir)
 
-    payload = {
+    meta = {
         "status": "ok",
         "mode": "raw-save",
-        "csv_path": str(dest),
-        "rows_parsed": parsed,
-        "updated_existing": updated,
-        "total_items": len(items),
+        "csv_path": str(_archive_path(imports_dir, sha256)),
+        "sha256": sha256,
     }
-    return JSONResponse(payload)
+    if staged is None:
+        archived = _find_archived(imports_dir, sha256)
+        if archived is not None:
+            meta["csv_path"] = str(archived)
+        return _duplicate_response(meta)
+    return await _submit_import(lambda: _iter_raw_batches(raw), meta, job, staged)
+
+
+# ---------- GET condizionali (ETag = revisione catalogo) ----------
+
 
+def _catalog_etag(store: dpi_store.CatalogStore) -> str:
+    # debole: la stessa revisione può essere servita gzip o in chiaro
+    return f'W/"{store.backend.name}-{store.revision()}"'
 
-@router.get("/catalogo")
-def get_catalogo() -> dict[str, Any]:
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    wanted = opaque(etag)
+    return any(t.strip() == "*" or opaque(t) == wanted for t in header.split(","))
+
+
+def _not_modified(etag: str, **headers: str) -> Response:
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": "no-cache", **headers},
+    )
+
+
+def _prezzo_param(name: str, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    cents = parse_prezzo_cents(value)
+    if cents is None:
+        raise HTTPException(status_code=422, detail=f"{name} non valido: {value!r}")
+    return cents
+
+
+@router.get("/catalogo", response_model=None)
+def get_catalogo(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Righe per pagina"),
+    after: Optional[str] = Query(None, description="Cursore: ultimo codice letto"),
+    gruppo: Optional[str] = Query(None, description="Filtro esatto su gruppo"),
+    stato: Optional[str] = Query(None, description="Filtro esatto su stato"),
+    codice_prefix: Optional[str] = Query(None, description="Prefisso codice"),
+    prezzo_min: Optional[str] = Query(None, description="Prezzo minimo (es. 12,50)"),
+    prezzo_max: Optional[str] = Query(None, description="Prezzo massimo (es. 99,90)"),
+    fields: Optional[str] = Query(None, description="Proiezione: campo1,campo2"),
+) -> Union[dict[str, Any], Response]:
     """
     Catalogo DPI corrente in JSON.
+    - Senza parametri: tutto il catalogo (compatibile con la v1)
+    - Con parametri: pagina ordinata per codice, servita dagli indici
+      secondari o dal backend (limit, after=codice, gruppo, stato,
+      codice_prefix, prezzo_min/prezzo_max, fields)
+    - prezzo_min/prezzo_max: estremi inclusi, virgola decimale ammessa;
+      esclude gli item senza prezzo valido
+    - ETag sulla revisione: If-None-Match uguale → 304, nessuna lettura
     """
-    items = _load_json()
-    return {"count": len(items), "items": items}
+    store = _catalog_store()
+    # letto prima degli item: se un merge arriva nel mezzo l'ETag resta
+    # quello vecchio e il client rilegge al giro successivo
+    etag = _catalog_etag(store)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
 
+    params = (limit, after, gruppo, stato, codice_prefix, prezzo_min, prezzo_max)
+    if all(p is None for p in params) and fields is None:
+        items = store.read()
+        return {"count": len(items), "items": items}
 
-@router.get("/export", response_class=PlainTextResponse)
-def export_catalogo_csv(
-    columns: str = Query("short", description="short|full (placeholder)"),
-) -> PlainTextResponse:
+    eq = {f: v for f, v in (("gruppo", gruppo), ("stato", stato)) if v is not None}
+    page, next_after = store.query(
+        eq=eq,
+        prefix=codice_prefix or "",
+        after=after or "",
+        limit=limit,
+        prezzo_min=_prezzo_param("prezzo_min", prezzo_min),
+        prezzo_max=_prezzo_param("prezzo_max", prezzo_max),
+    )
+    if fields:
+        keep = [f.strip() for f in fields.split(",") if f.strip()]
+        page = [{k: it.get(k, "") for k in keep} for it in page]
+    return {
+        "count": len(page),
+        "items": page,
+        "next_after": next_after,
+        "total_items": store.count(),
+    }
+
+
+@router.get("/search")
+def search_catalogo(
+    q: str = Query(..., min_length=1, description="Frammenti di codice/descrizione"),
+    limit: int = Query(20, ge=1, le=200, description="Numero massimo di risultati"),
+    fields: Optional[str] = Query(None, description="Proiezione: campo1,campo2"),
+) -> dict[str, Any]:
+    """
+    Ricerca nel catalogo per frammenti ("imbrac", "cordino 2m").
+    - un item corrisponde se contiene tutti i frammenti (maiuscole e
+      accenti ignorati) in codice o descrizione
+    - ordinamento per rilevanza: codice esatto, prefisso di codice,
+      frase intera, frammenti a inizio parola
+    - indice a trigrammi in memoria, aggiornato col delta dei merge
+    - truncated=true: query troppo generica, classifica calcolata sulle
+      prime corrispondenze trovate
+    - frammenti di 1-2 caratteri cercati a inizio parola
     """
-    Export CSV del catalogo corrente.
-    - columns=short|full (per ora identici, ma l'API è stabile).
+    hits, truncated = _catalog_store().search(q, limit)
+    keep = [f.strip() for f in (fields or "").split(",") if f.strip()]
+    items = [
+        {**({k: it.get(k, "") for k in keep} if keep else it), "_score": score}
+        for it, score in hits
+    ]
+    return {"q": q, "count": len(items), "truncated": truncated, "items": items}
+
+
+def _export_columns(store: dpi_store.CatalogStore, columns: str) -> List[str]:
     """
-    items = _load_json()
-    fieldnames = ["codice", "descrizione", "prezzo", "gruppo"]
+    Proiezione colonne per l'export.
+    - short: colonne del template v1
+    - full: template + eventuali campi extra presenti negli item (tenuti
+      dallo store, nessuna scansione del catalogo per richiesta)
+    - "a,b,c": elenco esplicito di campi
+    """
+    mode = (columns or "short").strip()
+    if mode == "short":
+        return list(TEMPLATE_COLUMNS)
+    if mode == "full":
+        return list(dict.fromkeys(TEMPLATE_COLUMNS + store.fields()))
+    picked = [c.strip() for c in mode.split(",") if c.strip()]
+    return list(dict.fromkeys(picked)) or list(TEMPLATE_COLUMNS)
+
+
+def _iter_csv_chunks(
+    items: List[dict[str, Any]],
+    fieldnames: List[str],
+    batch: int = EXPORT_BATCH_ROWS,
+) -> Iterator[str]:
     buf = io.StringIO()
-    writer = csv.DictWriter(buf, fieldnames=fieldnames)
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction="ignore")
     writer.writeheader()
-    for it in items:
+    for i, it in enumerate(items, 1):
         writer.writerow({k: (it.get(k) or "") for k in fieldnames})
-    return PlainTextResponse(buf.getvalue(), media_type="text/csv")
+        if i % batch == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _iter_encoded(chunks: Iterable[str], gzip_enabled: bool) -> Iterator[bytes]:
+    if not gzip_enabled:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+    # wbits 16+ → header/trailer gzip, compressione incrementale per batch
+    comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = comp.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield comp.flush()
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            return not (q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00"))
+    return False
+
+
+# ---------- Export tipizzati (NDJSON, Parquet, Arrow IPC) ----------
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet", "arrow")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+# righe per row group / record batch nei formati binari
+ARROW_BATCH_ROWS = 50_000
+NUMERIC_COLUMNS = ("prezzo",)
+
+
+def _parse_prezzo(value: Any) -> Optional[float]:
+    """
+    Prezzo come numero, dagli stessi centesimi di indici e filtri:
+    accetta "12.50", "12,50", "1.234,56", "€ 3". Vuoto o non numerico → None.
+    """
+    cents = parse_prezzo_cents(value)
+    return None if cents is None else cents / 100
+
+
+def _typed_row(it: dict[str, Any], fieldnames: List[str]) -> dict[str, Any]:
+    return {
+        k: _parse_prezzo(it.get(k)) if k in NUMERIC_COLUMNS else (it.get(k) or "")
+        for k in fieldnames
+    }
+
+
+def _iter_ndjson_chunks(
+    items: List[dict[str, Any]],
+    fieldnames: List[str],
+    batch: int = EXPORT_BATCH_ROWS,
+) -> Iterator[str]:
+    for start in range(0, len(items), batch):
+        yield "".join(
+            json.dumps(_typed_row(it, fieldnames), ensure_ascii=False) + "\n"
+            for it in items[start : start + batch]
+        )
+
+
+def _require_pyarrow(fmt: str) -> Any:
+    try:
+        import pyarrow
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail=f"format={fmt} richiede pyarrow (pip install pyarrow)",
+        )
+    return pyarrow
+
+
+class _ChunkSink:
+    """File-like in sola scrittura: i byte scritti da pyarrow si raccolgono
+    e vengono ceduti al client dopo ogni batch."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _iter_arrow_bytes(
+    pa: Any,
+    items: List[dict[str, Any]],
+    fieldnames: List[str],
+    fmt: str,
+    batch: int = ARROW_BATCH_ROWS,
+) -> Iterator[bytes]:
+    """Parquet (un row group per batch) o Arrow IPC stream, a batch."""
+    schema = pa.schema(
+        [(k, pa.float64() if k in NUMERIC_COLUMNS else pa.string()) for k in fieldnames]
+    )
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    with writer:
+        for start in range(0, len(items), batch):
+            rows = [_typed_row(it, fieldnames) for it in items[start : start + batch]]
+            cols = {k: [r[k] for r in rows] for k in fieldnames}
+            writer.write_batch(pa.RecordBatch.from_pydict(cols, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+@router.get("/export", response_class=StreamingResponse)
+def export_catalogo_csv(
+    request: Request,
+    columns: str = Query("short", description="short|full|campo1,campo2,..."),
+    fmt: str = Query(
+        "csv",
+        alias="format",
+        pattern=f"^({'|'.join(EXPORT_FORMATS)})$",
+        description="csv|ndjson|parquet|arrow",
+    ),
+) -> Response:
+    """
+    Export del catalogo corrente, in streaming a batch di righe.
+    - columns=short (template v1) | full (tutti i campi) | elenco campi
+    - format=csv (default) | ndjson | parquet | arrow (Arrow IPC stream);
+      nei formati tipizzati prezzo è numerico. parquet/arrow richiedono
+      pyarrow (501 se assente)
+    - Accept-Encoding: gzip → compressione in streaming (csv, ndjson)
+    - ETag sulla revisione: If-None-Match uguale → 304, nessuna lettura
+    """
+    pa = _require_pyarrow(fmt) if fmt in ("parquet", "arrow") else None
+    store = _catalog_store()
+    etag = _catalog_etag(store)
+    if _etag_matches(request, etag):
+        return _not_modified(etag, Vary="Accept-Encoding")
+    items = store.read()
+    fieldnames = _export_columns(store, columns)
+    headers = {"Vary": "Accept-Encoding", "ETag": etag, "Cache-Control": "no-cache"}
+    if pa is not None:
+        # già compressi internamente (parquet) o binari: niente gzip
+        body: Iterator[bytes] = _iter_arrow_bytes(pa, items, fieldnames, fmt)
+    else:
+        use_gzip = _accepts_gzip(request)
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+        chunks = (
+            _iter_ndjson_chunks(items, fieldnames)
+            if fmt == "ndjson"
+            else _iter_csv_chunks(items, fieldnames)
+        )
+        body = _iter_encoded(chunks, use_gzip)
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[fmt], headers=headers)
 
 
 @router.post("/import-file")
-async def import_file(file: UploadFile = File(...)) -> JSONResponse:
+async def import_file(
+    file: UploadFile = File(...),
+    job: bool = Query(False, description="true → 202 + job in background"),
+) -> JSONResponse:
     """
     Import CSV via multipart/form-data (upload file).
-    - Salva il file in data/cataloghi/imports con timestamp
-    - Merge su JSON canonico come /save
+    - Salva il file in data/cataloghi/imports/<sha256>.csv (a chunk)
+    - Contenuto già importato → status "duplicate", nessun merge
+    - Merge su JSON canonico come /save, a batch di MERGE_BATCH_ROWS righe
+    - job=true: risposta immediata 202, esito su /jobs/{id}
     """
-    raw = await file.read()
     _, imports_dir, _, _ = _ensure_tree()
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_name = Path(file.filename or f"upload_{ts}.csv").name
-    dest = imports_dir / f"{ts}_{safe_name}"
-    dest.write_bytes(raw)
-
-    rows, parsed = _parse_csv_bytes(raw)
-    items = _load_json()
-    updated, _ = _merge_items(items, rows)
-    _save_json(items)
+    staged, sha256 = await _stage_upload(file, imports_dir)
 
-    payload = {
+    meta = {
         "status": "ok",
         "mode": "upload",
         "filename": safe_name,
-        "csv_path": str(dest),
-        "rows_parsed": parsed,
-        "updated_existing": updated,
-        "total_items": len(items),
+        "csv_path": str(_archive_path(imports_dir, sha256)),
+        "sha256": sha256,
     }
-    return JSONResponse(payload)
+    if staged is None:
+        archived = _find_archived(imports_dir, sha256)
+        if archived is not None:
+            meta["csv_path"] = str(archived)
+        return _duplicate_response(meta)
+    return await _submit_import(
+        lambda: _iter_csv_file_batches(staged), meta, job, staged
+    )
 
 
 @router.post("/import")
-async def import_alias(file: UploadFile = File(...)) -> JSONResponse:
+async def import_alias(
+    file: UploadFile = File(...),
+    job: bool = Query(False, description="true → 202 + job in background"),
+) -> JSONResponse:
     """
     Alias backwards-compatible per /import-file.
     """
-    return await import_file(file)
+    return await import_file(file, job)
+
+
+@router.get("/imports/{ref}", response_class=StreamingResponse)
+def get_archived_import(request: Request, ref: str) -> StreamingResponse:
+    """
+    CSV originale di un import archiviato (audit), per sha256 o nome file.
+    Gli import già compressi dalla pulizia si leggono in modo trasparente:
+    inviati gzip così come sono se il client lo accetta, altrimenti
+    decompressi in streaming.
+    """
+    name = Path(ref).name
+    if name != ref or name.startswith("."):
+        raise HTTPException(status_code=404, detail="Import non trovato")
+    _, imports_dir, _, _ = _ensure_tree()
+    path = _find_archived(imports_dir, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Import non trovato")
+
+    headers = {"Vary": "Accept-Encoding"}
+    if path.name.endswith(".gz") and _accepts_gzip(request):
+        headers["Content-Encoding"] = "gzip"
+        fh = path.open("rb")
+    else:
+        fh = dpi_manifest.open_archived(path)
+    return StreamingResponse(
+        _iter_closing(fh), media_type="text/csv; charset=utf-8", headers=headers
+    )
+
+
+@router.get("/jobs/{job_id}")
+def get_import_job(job_id: str) -> dict[str, Any]:
+    """
+    Stato di un job di import: avanzamento (righe lette/mergiate),
+    tempi ed esito finale.
+    """
+    job = _jobs.get(job_id)
+    # job di un altro tenant: come inesistente
+    if job is None or job.tenant != _tenant.get():
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job.to_dict()
 
 
 # ---------- Metrics + Report ----------
 
 
+def _writer_stats(store: dpi_store.CatalogStore) -> dict[str, int]:
+    writers = [
+        w
+        for per_loop in list(_writers.values())
+        for w in per_loop.values()
+        if w.store is store
+    ]
+    return {
+        "imports": sum(w.submitted for w in writers),
+        "commits": sum(w.commits for w in writers),
+    }
+
+
 @router.get("/metrics")
 def catalogo_metrics() -> dict[str, Any]:
     """
     Metriche di base del Catalogo DPI (per smoke/monitoring).
+    O(1): totali dal manifest import e conteggio item dal backend,
+    senza scandire l'archivio né caricare il catalogo.
+    prezzi_per_gruppo (count, min/max/sum in centesimi): mantenuti col
+    merge; con json/wal vengono dagli indici in memoria, null finché una
+    query (/catalogo filtrato, /search) non li ha costruiti.
     """
-    _, imports_dir, _, reports_dir = _ensure_tree()
-    items = _load_json()
-    imports = sorted(imports_dir.glob("*.csv"))
-    last_import = imports[-1].stat().st_mtime if imports else None
+    _, imports_dir, items_path, reports_dir = _ensure_tree()
+    store = dpi_store.get_store(items_path)
+    imports = dpi_manifest.get_manifest(imports_dir).summary()
+    last_import = imports["last_import_at"]
 
     return {
-        "total_items": len(items),
-        "imports_count": len(imports),
+        "tenant": _tenant.get(),
+        "total_items": store.count(),
+        "imports_count": imports["count"],
+        "imports_bytes": imports["bytes"],
+        "imports_rows": imports["rows"],
+        "imports_compressed": imports["compressed"],
+        "imports_revision": imports["revision"],
         "last_import_at": (
             datetime.fromtimestamp(last_import).isoformat() if last_import else None
         ),
         "reports_dir": str(reports_dir),
+        "prezzi_per_gruppo": store.prezzo_stats(),
+        "cache": store.cache_stats(),
+        "writer": _writer_stats(store),
     }
 
 
-@router.get("/report.html", response_class=HTMLResponse)
-def catalogo_report_html() -> HTMLResponse:
+# ---------- Metriche Prometheus (app/metrics.py) ----------
+
+CATALOG_ITEMS = prom_metrics.gauge(
+    "tpi_catalog_items", "Item nel Catalogo DPI per tenant", ("tenant",)
+)
+
+
+def _collect_metrics() -> Iterator[prom_metrics.Sample]:
     """
-    Mini report HTML — pensato per ispezione veloce in browser.
+    Allo scrape: dimensione del catalogo e letture della cache in memoria
+    (hit / miss) per i tenant già aperti da questo processo.
     """
-    metrics = catalogo_metrics()
-    items = _load_json()
-    preview = items[:50]
-
-    rows_html = "\n".join(
-        f"<tr><td>{i+1}</td><td>{it.get('codice','')}</td>"
-        f"<td>{it.get('descrizione','')}</td><td>{it.get('prezzo','')}</td>"
-        f"<td>{it.get('gruppo','')}</td></tr>"
-        for i, it in enumerate(preview)
+    root = _data_root()
+    for base, (_, _, items_path, _) in list(_trees.items()):
+        tenant = DEFAULT_TENANT if base == root else base.name
+        store = dpi_store.get_store(items_path)
+        stats = store.cache_stats()
+        yield CATALOG_ITEMS, (tenant,), float(store.count())
+        cache = prom_metrics.CACHE_REQUESTS
+        yield cache, ("catalog", tenant, "hit"), float(stats["hits"])
+        yield cache, ("catalog", tenant, "miss"), float(stats["misses"])
+
+
+prom_metrics.register_collector(_collect_metrics)
+
+
+# ---------- Report HTML (pagine in cache per revisione) ----------
+
+REPORT_PAGE_SIZE = 50
+REPORT_CACHE_PAGES = 64
+
+_report_cache: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
+_report_cache_lock = threading.Lock()
+
+
+def _report_row(n: int, it: dict[str, Any]) -> str:
+    cells = "".join(
+        f"<td>{html.escape(str(it.get(k) or ''))}</td>"
+        for k in ("codice", "descrizione", "prezzo", "gruppo")
     )
+    return f"<tr><td>{n}</td>{cells}</tr>"
+
 
-    html = f"""
+def _report_nav(page: int, pages: int, size: int) -> str:
+    links = []
+    if page > 1:
+        links.append(
+            f'<a href="?page={page - 1}&amp;size={size}">&larr; precedente</a>'
+        )
+    links.append(f"Pagina {page} di {pages}")
+    if page < pages:
+        links.append(
+            f'<a href="?page={page + 1}&amp;size={size}">successiva &rarr;</a>'
+        )
+    return " | ".join(links)
+
+
+def _render_report(
+    metrics: dict[str, Any],
+    rows: List[dict[str, Any]],
+    page: int,
+    size: int,
+    total: int,
+) -> str:
+    pages = max((total + size - 1) // size, 1)
+    offset = (page - 1) * size
+    rows_html = "\n".join(_report_row(offset + i, it) for i, it in enumerate(rows, 1))
+    first, last = (offset + 1, offset + len(rows)) if rows else (0, 0)
+    nav = _report_nav(page, pages, size)
+
+    return f"""
 <!DOCTYPE html>
 <html lang="it">
 <head>
@@ -283,6 +1497,7 @@ def catalogo_report_html() -> HTMLResponse:
     th {{ background: #f5f5f5; text-align: left; }}
     caption {{ text-align: left; font-weight: bold; margin-bottom: 0.5rem; }}
     .metrics {{ margin-top: 0.5rem; font-size: 0.85rem; color: #555; }}
+    .nav {{ margin-top: 1rem; font-size: 0.85rem; }}
   </style>
 </head>
 <body>
@@ -292,8 +1507,9 @@ def catalogo_report_html() -> HTMLResponse:
     <div><strong>Import CSV:</strong> {metrics["imports_count"]}</div>
     <div><strong>Ultimo import:</strong> {metrics["last_import_at"] or "-"} </div>
   </div>
+  <div class="nav">{nav}</div>
   <table>
-    <caption>Preview (max 50 righe)</caption>
+    <caption>Righe {first}–{last} di {total}</caption>
     <thead>
       <tr>
         <th>#</th>
@@ -307,10 +1523,52 @@ def catalogo_report_html() -> HTMLResponse:
       {rows_html}
     </tbody>
   </table>
+  <div class="nav">{nav}</div>
 </body>
 </html>
 """
-    return HTMLResponse(html)
+
+
+@router.get("/report.html", response_class=HTMLResponse)
+def catalogo_report_html(
+    request: Request,
+    page: int = Query(1, ge=1, description="Pagina (da 1)"),
+    size: int = Query(REPORT_PAGE_SIZE, ge=1, le=1000, description="Righe per pagina"),
+) -> Response:
+    """
+    Mini report HTML — pensato per ispezione veloce in browser.
+    - page/size: tutto il catalogo a pagine, in ordine di inserimento;
+      in memoria solo la pagina richiesta
+    - pagine renderizzate in cache per (revisione catalogo, revisione
+      manifest import): anche la pulizia dell'archivio invalida
+    - ETag: If-None-Match uguale → 304
+    """
+    _, _, items_path, _ = _ensure_tree()
+    store = dpi_store.get_store(items_path)
+    metrics = catalogo_metrics()
+    revision = metrics["cache"]["revision"]
+    imports_rev = metrics["imports_revision"]
+    etag = f'W/"report-{store.backend.name}-{revision}-{imports_rev}"'
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
+    key = (str(items_path), etag, page, size)
+    with _report_cache_lock:
+        body = _report_cache.get(key)
+        if body is not None:
+            _report_cache.move_to_end(key)
+    prom_metrics.inc(
+        prom_metrics.CACHE_REQUESTS,
+        ("report", _tenant.get(), "miss" if body is None else "hit"),
+    )
+    if body is None:
+        rows = store.items_range((page - 1) * size, size)
+        body = _render_report(metrics, rows, page, size, metrics["total_items"])
+        with _report_cache_lock:
+            _report_cache[key] = body
+            while len(_report_cache) > REPORT_CACHE_PAGES:
+                _report_cache.popitem(last=False)
+    return HTMLResponse(body, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 
 # Monta il router sull'app FastAPI
@@ -0,0 +1,513 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# ============================================================
+# Indici secondari Catalogo DPI (in memoria)
+# - codice → item
+# - elenco codici ordinato (cursore `after`, prefisso su codice)
+# - uguaglianza su gruppo / stato (valore → set di codici)
+# - prezzo in centesimi: intervallo prezzo_min/prezzo_max e aggregati
+#   per gruppo (count, min, max, somma)
+# - trigrammi su codice + descrizione per la ricerca (costruiti alla
+#   prima ricerca)
+# Aggiornati in modo incrementale con il delta prodotto dal merge.
+# ============================================================
+
+INDEXED_FIELDS = ("gruppo", "stato")
+
+
+def _key(item: dict[str, Any]) -> str:
+    return (item.get("codice") or "").strip()
+
+
+def _prefix_end(prefix: str) -> str:
+    # limite superiore esclusivo per i codici che iniziano con `prefix`
+    return prefix + "\U0010ffff"
+
+
+class CatalogIndex:
+    """
+    Indici sul catalogo in cache. Thread-safe: i lettori interrogano sotto
+    lock, i writer applicano il delta del merge con apply().
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.by_codice: Dict[str, dict[str, Any]] = {}
+        self.sorted_codici: List[str] = []
+        self.by_field: Dict[str, Dict[str, Set[str]]] = {f: {} for f in INDEXED_FIELDS}
+        self.size = 0
+        self.prices = PriceIndex()
+        self.text: Optional[TextIndex] = None
+
+    @classmethod
+    def build(cls, items: List[dict[str, Any]]) -> "CatalogIndex":
+        index = cls()
+        index.size = len(items)
+        for it in items:
+            k = _key(it)
+            if not k:
+                continue
+            index.by_codice[k] = it
+            for f in INDEXED_FIELDS:
+                index.by_field[f].setdefault(it.get(f) or "", set()).add(k)
+        index.sorted_codici = sorted(index.by_codice)
+        index.prices = PriceIndex.build(items)
+        return index
+
+    def apply(self, changed: Iterable[dict[str, Any]]) -> None:
+        """Applica item inseriti/aggiornati (costo ∝ delta)."""
+        changed = list(changed)
+        with self._lock:
+            self.prices.apply(changed)
+            new_keys: List[str] = []
+            for it in changed:
+                k = _key(it)
+                if not k:
+                    continue
+                old = self.by_codice.get(k)
+                if old is None:
+                    new_keys.append(k)
+                    self.size += 1
+                for f in INDEXED_FIELDS:
+                    before = (old.get(f) or "") if old is not None else None
+                    after = it.get(f) or ""
+                    if before == after:
+                        continue
+                    if before is not None:
+                        bucket = self.by_field[f].get(before)
+                        if bucket is not None:
+                            bucket.discard(k)
+                            if not bucket:
+                                del self.by_field[f][before]
+                    self.by_field[f].setdefault(after, set()).add(k)
+                self.by_codice[k] = it
+                if self.text is not None:
+                    self.text.put(it)
+            if len(new_keys) > len(self.sorted_codici) // 8:
+                # molti inserimenti: un sort unico costa meno di N insort
+                self.sorted_codici = sorted(self.by_codice)
+            else:
+                for k in new_keys:
+                    bisect.insort(self.sorted_codici, k)
+
+    def query(
+        self,
+        *,
+        eq: Optional[Dict[str, str]] = None,
+        prefix: str = "",
+        after: str = "",
+        limit: Optional[int] = None,
+        prezzo_min: Optional[int] = None,
+        prezzo_max: Optional[int] = None,
+    ) -> Tuple[List[dict[str, Any]], Optional[str]]:
+        """
+        Pagina di item ordinati per codice.
+        prezzo_min/prezzo_max in centesimi, estremi inclusi: esclude gli
+        item senza prezzo valido.
+        Ritorna (items, next_after); next_after è None sull'ultima pagina.
+        """
+        ranged = prezzo_min is not None or prezzo_max is not None
+        eq = {f: v for f, v in (eq or {}).items() if f in INDEXED_FIELDS}
+        with self._lock:
+            codici = self.sorted_codici
+            lo = bisect.bisect_left(codici, prefix) if prefix else 0
+            hi = (
+                bisect.bisect_left(codici, _prefix_end(prefix))
+                if prefix
+                else len(codici)
+            )
+            if after:
+                lo = max(lo, bisect.bisect_right(codici, after))
+            want = None if limit is None else limit + 1
+
+            sets = sorted(
+                (self.by_field[f].get(v, set()) for f, v in eq.items()), key=len
+            )
+            prices = self.prices
+
+            def in_range(k: str) -> bool:
+                return not ranged or prices.within(k, prezzo_min, prezzo_max)
+
+            driver: Optional[Iterable[str]] = None
+            others = sets
+            if sets and len(sets[0]) < hi - lo:
+                driver, others = sets[0], sets[1:]
+            if ranged:
+                p_lo, p_hi = prices.span(prezzo_min, prezzo_max)
+                if p_hi - p_lo < (hi - lo if driver is None else len(sets[0])):
+                    driver, others = prices.keys(p_lo, p_hi), sets
+            if driver is not None:
+                # il filtro più selettivo guida la scansione
+                matches: Iterable[str] = (
+                    k
+                    for k in driver
+                    if k > after
+                    and k.startswith(prefix)
+                    and all(k in s for s in others)
+                    and in_range(k)
+                )
+                keys = (
+                    sorted(matches) if want is None else heapq.nsmallest(want, matches)
+                )
+            else:
+                keys = []
+                for k in _islice(codici, lo, hi):
+                    if all(k in s for s in sets) and in_range(k):
+                        keys.append(k)
+                        if want is not None and len(keys) >= want:
+                            break
+
+            next_after = None
+            if limit is not None and len(keys) > limit:
+                keys = keys[:limit]
+                next_after = keys[-1]
+            return [self.by_codice[k] for k in keys], next_after
+
+    def prezzo_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return self.prices.stats()
+
+    def search(
+        self, q: str, limit: int = 20
+    ) -> Tuple[List[Tuple[dict[str, Any], int]], bool]:
+        """
+        Item che contengono tutti i frammenti di `q`, ordinati per score.
+        Ritorna (risultati, truncated).
+        """
+        with self._lock:
+            if self.text is None:
+                self.text = TextIndex.build(
+                    self.by_codice[k] for k in self.sorted_codici
+                )
+            hits, truncated = self.text.search(q, limit)
+            return [(self.by_codice[k], score) for k, score in hits], truncated
+
+
+def _islice(seq: List[str], lo: int, hi: int) -> Iterable[str]:
+    for i in range(lo, hi):
+        yield seq[i]
+
+
+# ---------- Prezzo tipizzato (centesimi) ----------
+
+_PREZZO_NOISE = str.maketrans("", "", "€ \u00a0\u202f'")
+_PREZZO_SIMPLE = re.compile(r"(\d+)(?:[.,](\d{1,2}))?")
+# segno, parte intera (a gruppi di 3 cifre con un unico separatore, o
+# cifre semplici), parte decimale. Nient'altro: "1e3", "1_000" → None
+_PREZZO_NUMBER = re.compile(
+    r"([-+]?)([1-9]\d{0,2}(?:([.,])\d{3})(?:\3\d{3})*|\d+)(?:([.,])(\d+))?"
+)
+
+# versione delle regole di parse: i prezzi_cents persistiti con una
+# versione diversa vanno ricalcolati
+PREZZO_PARSER_VERSION = 2
+
+
+def parse_prezzo_cents(value: Any) -> Optional[int]:
+    """
+    Prezzo in centesimi (intero). Virgola decimale all'italiana ("12,50",
+    "1.234,56"), anche "12.50", "1,234.56", "€ 3", "-1,5".
+    Un solo separatore: "." seguito da gruppi di 3 cifre è delle migliaia
+    ("1.234" → 1234,00, "3.000.000"), altrimenti è decimale ("12.5",
+    "1,234" → 1,234). Oltre i centesimi si arrotonda (half-up).
+    Vuoto o non numerico → None.
+    """
+    text = "" if value is None else str(value).translate(_PREZZO_NOISE)
+    if not text:
+        return None
+    m = _PREZZO_SIMPLE.fullmatch(text)
+    if m:  # caso comune, senza Decimal
+        return int(m[1]) * 100 + int((m[2] or "0").ljust(2, "0"))
+    m = _PREZZO_NUMBER.fullmatch(text)
+    if m is None:
+        return None
+    sign, whole, group_sep, dec_sep, frac = m.groups()
+    if group_sep and dec_sep == group_sep:
+        return None  # "1.234.5"
+    if group_sep == "," and not dec_sep and whole.count(",") == 1:
+        # "1,234": virgola decimale
+        whole, frac = whole.split(",")
+    elif group_sep:
+        whole = whole.replace(group_sep, "")
+    amount = Decimal(f"{sign}{whole}.{frac or '0'}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+PriceEntry = Tuple[int, str]  # (centesimi, gruppo)
+
+
+def _price_entry(item: dict[str, Any]) -> Optional[PriceEntry]:
+    cents = parse_prezzo_cents(item.get("prezzo"))
+    return None if cents is None else (cents, item.get("gruppo") or "")
+
+
+class PriceIndex:
+    """
+    Prezzi in centesimi, calcolati una volta quando l'item entra
+    nell'indice (build o delta del merge). Item senza prezzo: assenti.
+    - ordered: (centesimi, codice) ordinati → intervallo con bisect
+    - per gruppo: centesimi ordinati (min/max esatti anche quando un
+      prezzo cambia o esce dal gruppo) + somma
+    Non thread-safe: protetto dal lock di CatalogIndex.
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[str, PriceEntry] = {}
+        self.ordered: List[Tuple[int, str]] = []
+        self.groups: Dict[str, List[int]] = {}
+        self.sums: Dict[str, int] = {}
+
+    @classmethod
+    def build(cls, items: Iterable[dict[str, Any]]) -> "PriceIndex":
+        index = cls()
+        for it in items:
+            k = _key(it)
+            entry = _price_entry(it) if k else None
+            if entry is not None:
+                index.entries[k] = entry
+        index._rebuild()
+        return index
+
+    def _rebuild(self) -> None:
+        self.ordered = sorted((c, k) for k, (c, _) in self.entries.items())
+        groups: Dict[str, List[int]] = {}
+        for c, g in self.entries.values():
+            groups.setdefault(g, []).append(c)
+        for prices in groups.values():
+            prices.sort()
+        self.groups = groups
+        self.sums = {g: sum(prices) for g, prices in groups.items()}
+
+    def apply(self, changed: List[dict[str, Any]]) -> None:
+        moves: List[Tuple[str, Optional[PriceEntry], Optional[PriceEntry]]] = []
+        for it in changed:
+            k = _key(it)
+            if not k:
+                continue
+            new = _price_entry(it)
+            old = self.entries.get(k)
+            if new == old:
+                continue
+            moves.append((k, old, new))
+            if new is None:
+                del self.entries[k]
+            else:
+                self.entries[k] = new
+        if len(moves) > len(self.ordered) // 8:
+            # molte variazioni: un sort unico costa meno di N insort
+            self._rebuild()
+            return
+        for k, old, new in moves:
+            if old is not None:
+                c, g = old
+                del self.ordered[bisect.bisect_left(self.ordered, (c, k))]
+                prices = self.groups[g]
+                del prices[bisect.bisect_left(prices, c)]
+                self.sums[g] -= c
+                if not prices:
+                    del self.groups[g], self.sums[g]
+            if new is not None:
+                c, g = new
+                bisect.insort(self.ordered, (c, k))
+                bisect.insort(self.groups.setdefault(g, []), c)
+                self.sums[g] = self.sums.get(g, 0) + c
+
+    def span(self, lo: Optional[int], hi: Optional[int]) -> Tuple[int, int]:
+        """Posizioni [start, stop) in `ordered` dei prezzi in [lo, hi]."""
+        start = bisect.bisect_left(self.ordered, (lo,)) if lo is not None else 0
+        stop = (
+            bisect.bisect_left(self.ordered, (hi + 1,))
+            if hi is not None
+            else len(self.ordered)
+        )
+        return start, max(start, stop)
+
+    def keys(self, start: int, stop: int) -> Iterable[str]:
+        ordered = self.ordered
+        for i in range(start, stop):
+            yield ordered[i][1]
+
+    def within(self, k: str, lo: Optional[int], hi: Optional[int]) -> bool:
+        entry = self.entries.get(k)
+        if entry is None:
+            return False
+        return (lo is None or entry[0] >= lo) and (hi is None or entry[0] <= hi)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per gruppo: count, min_cents, max_cents, sum_cents."""
+        return {
+            g: {
+                "count": len(prices),
+                "min_cents": prices[0],
+                "max_cents": prices[-1],
+                "sum_cents": self.sums[g],
+            }
+            for g, prices in sorted(self.groups.items())
+        }
+
+
+# ---------- Ricerca testuale (trigrammi su codice + descrizione) ----------
+
+SEARCH_FIELDS = ("codice", "descrizione")
+# oltre questo numero di corrispondenze la scansione si ferma: le query
+# molto generiche restano veloci, la risposta segnala "truncated"
+SEARCH_MAX_MATCHES = 5000
+
+
+def _fold(text: str) -> str:
+    """Minuscolo, senza accenti, spazi compattati."""
+    text = text.casefold()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    # testo con spazi ai bordi: " 2m" indicizza l'inizio delle parole;
+    # " x" (2 caratteri) la prima lettera di ogni parola
+    padded = f" {text} "
+    grams = {padded[i : i + 3] for i in range(len(padded) - 2)}
+    grams.update(f" {word[0]}" for word in text.split())
+    return grams
+
+
+def _query_grams(token: str) -> Set[str]:
+    """Trigrammi di un token; i token di 1-2 caratteri cercano a inizio parola."""
+    if len(token) >= 3:
+        return {token[i : i + 3] for i in range(len(token) - 2)}
+    return {f" {token}"}
+
+
+def _find_token(text: str, token: str) -> int:
+    """Posizione di `token` in `text`; i token corti solo a inizio parola."""
+    if len(token) >= 3:
+        return text.find(token)
+    # nel testo con lo spazio davanti, l'indice dello spazio è quello del token
+    return f" {text}".find(f" {token}")
+
+
+class TextIndex:
+    """
+    Indice a trigrammi per la ricerca per frammenti.
+    - ogni item ha un id interno; le posting list sono array di id
+      (append-only, 4 byte per voce)
+    - un item la cui descrizione cambia riceve un id nuovo, quello vecchio
+      resta "morto" nelle posting list e viene scartato in lettura;
+      oltre metà di id morti l'indice si ricompatta
+    - query: la posting list più corta dà i candidati, verificati poi con
+      una ricerca di sottostringa sul testo (risultato esatto)
+    Non thread-safe: protetto dal lock di CatalogIndex.
+    """
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.docs: List[Optional[Tuple[str, str]]] = []
+        self.postings: Dict[str, array] = {}
+        self.dead = 0
+
+    @classmethod
+    def build(cls, items: Iterable[dict[str, Any]]) -> "TextIndex":
+        index = cls()
+        for it in items:
+            index.put(it)
+        return index
+
+    def put(self, item: dict[str, Any]) -> None:
+        k = _key(item)
+        if not k:
+            return
+        text = _fold(" ".join(str(item.get(f) or "") for f in SEARCH_FIELDS))
+        old = self.ids.get(k)
+        if old is not None:
+            doc = self.docs[old]
+            if doc is not None and doc[1] == text:
+                return  # testo invariato (es. cambia solo il prezzo)
+            self.docs[old] = None
+            self.dead += 1
+        self._add(k, text)
+        if self.dead > len(self.ids):
+            self._compact()
+
+    def _add(self, k: str, text: str) -> None:
+        doc_id = len(self.docs)
+        self.ids[k] = doc_id
+        self.docs.append((k, text))
+        postings = self.postings
+        for tri in _trigrams(text):
+            posting = postings.get(tri)
+            if posting is None:
+                posting = postings[tri] = array("I")
+            posting.append(doc_id)
+
+    def _compact(self) -> None:
+        live = [doc for doc in self.docs if doc is not None]
+        self.ids, self.docs, self.postings, self.dead = {}, [], {}, 0
+        for k, text in live:
+            self._add(k, text)
+
+    def search(
+        self, q: str, limit: int, max_matches: int = SEARCH_MAX_MATCHES
+    ) -> Tuple[List[Tuple[str, int]], bool]:
+        """
+        (codice, score) dei migliori `limit` risultati e flag `truncated`
+        (scansione fermata dopo `max_matches` corrispondenze).
+        """
+        query = _fold(q)
+        tokens = query.split()
+        if not tokens:
+            return [], False
+        # per token la posting list più corta, poi dalla più selettiva
+        lists: List[array] = []
+        for t in tokens:
+            postings = [self.postings.get(g) for g in _query_grams(t)]
+            if any(p is None for p in postings):
+                return [], False
+            lists.append(min(postings, key=len))  # type: ignore[arg-type]
+        lists.sort(key=len)
+        candidates: Iterable[int] = lists[0]
+        if len(lists) > 1 and len(lists[0]) > max_matches:
+            # candidati numerosi: intersezione in C prima della verifica
+            candidates = sorted(set(lists[0]).intersection(lists[1]))
+
+        docs = self.docs
+        phrase = query if len(tokens) > 1 else None
+        scored: List[Tuple[int, int, str]] = []
+        truncated = False
+        for doc_id in candidates:
+            doc = docs[doc_id]
+            if doc is None:
+                continue
+            codice, text = doc
+            score = 0
+            for t in tokens:
+                pos = _find_token(text, t)
+                if pos < 0:
+                    break
+                score += 2 if pos == 0 or text[pos - 1] == " " else 1
+            else:
+                if phrase is not None and phrase in text:
+                    score += 10
+                if text.startswith(query):
+                    score += 50  # prefisso di codice
+                scored.append((-score, len(text), codice))
+                if len(scored) >= max_matches:
+                    truncated = True
+                    break
+
+        # codice esatto: sempre primo, anche se la scansione è troncata
+        exact = next((k for k in (q.strip(), q.strip().upper()) if k in self.ids), None)
+        top = heapq.nsmallest(limit, (r for r in scored if r[2] != exact))
+        hits = [(c, -s) for s, _, c in top]
+        if exact is not None:
+            hits = [(exact, 100)] + hits[: limit - 1]
+        return hits, truncated
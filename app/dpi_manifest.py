@@ -0,0 +1,426 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from app.dpi_store import atomic_write_text
+
+# ============================================================
+# Manifest archivio import Catalogo DPI
+# - imports/manifest.jsonl: una riga per import registrato (append-only
+#   tra una pulizia e l'altra)
+# - imports/manifest.json: totali (count, bytes, rows, ultimo import)
+#   riscritti in modo atomico ad ogni import
+# - Totali serviti dalla memoria: /metrics non scandisce l'archivio
+# - Pulizia in background: gzip degli import più vecchi di N giorni,
+#   retention configurabile, manifest riscritto in modo coerente; un
+#   solo thread per processo passa su tutti gli archivi (tutti i tenant)
+# ============================================================
+
+log = logging.getLogger("tpi.dpi_manifest")
+
+LOG_NAME = "manifest.jsonl"
+SUMMARY_NAME = "manifest.json"
+DAY_SEC = 86400
+
+# file archiviati prima che il manifest registrasse lo sha256
+_SHA_NAME = re.compile(r"([0-9a-f]{64})\.csv(?:\.gz)?")
+
+
+def _env_int(key: str, default: int) -> int:
+    raw = (os.getenv(key) or "").strip()
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        return default
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {
+        "count": 0,
+        "bytes": 0,
+        "rows": 0,
+        "compressed": 0,
+        "last_import_at": None,
+        "log_bytes": 0,
+        # cresce ad ogni modifica del manifest (import, pulizia), mai indietro
+        "revision": 0,
+    }
+
+
+def _gzip_file(path: Path) -> Optional[Path]:
+    """
+    Comprime `path` in `path.gz` (temporaneo + rename) e rimuove l'originale.
+    Se l'originale manca ma il .gz esiste (pulizia interrotta) lo riusa.
+    """
+    gz = path.with_name(path.name + ".gz")
+    if not path.exists():
+        return gz if gz.exists() else None
+    tmp = gz.with_name(f".{gz.name}.tmp")
+    with path.open("rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, gz)
+    path.unlink(missing_ok=True)
+    return gz
+
+
+def _entry_sha256(entry: Dict[str, Any]) -> Optional[str]:
+    sha = entry.get("sha256")
+    if sha:
+        return str(sha)
+    m = _SHA_NAME.fullmatch(entry["file"])
+    return m.group(1) if m else None
+
+
+def _hashes_of(entries: Iterable[Dict[str, Any]]) -> Set[str]:
+    return {sha for sha in map(_entry_sha256, entries) if sha}
+
+
+def open_archived(path: Path) -> Any:
+    """Apre in lettura binaria un import archiviato, compresso o no."""
+    if path.name.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return path.open("rb")
+
+
+class ImportsManifest:
+    """
+    Indice dell'archivio import.
+    - record(): registra un import andato a buon fine
+    - publish(): sposta un import committato nell'archivio e lo registra
+    - has(): contenuto (sha256) già importato con successo
+    - summary(): totali correnti e revisione del manifest, O(1)
+    - sweep(): compressione + retention, riscrive il log con le sole voci vive
+    All'avvio i totali si leggono da manifest.json; se non corrispondono
+    al log (crash tra le due scritture) si ricalcolano dal log. Un archivio
+    senza manifest viene scandito una sola volta (righe non note: 0).
+    """
+
+    def __init__(self, imports_dir: Path) -> None:
+        self.imports_dir = imports_dir
+        self.log_path = imports_dir / LOG_NAME
+        self.summary_path = imports_dir / SUMMARY_NAME
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._totals = self._load()
+        # sha256 degli import registrati, letti dal log al primo has()
+        self._hashes: Optional[Set[str]] = None
+        # 0 = disattivato
+        self.compress_after_days = _env_int("CATALOGHI_IMPORTS_COMPRESS_DAYS", 7)
+        self.retention_days = _env_int("CATALOGHI_IMPORTS_RETENTION_DAYS", 0)
+
+    # ---------- avvio ----------
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            log_size = self.log_path.stat().st_size
+        except FileNotFoundError:
+            return self._bootstrap()
+        try:
+            summary = json.loads(self.summary_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            summary = None
+        if isinstance(summary, dict) and summary.get("log_bytes") == log_size:
+            return {**_empty_totals(), **summary}
+        previous = summary.get("revision") if isinstance(summary, dict) else None
+        return self._replay(previous if isinstance(previous, int) else 0)
+
+    def _entries(self) -> Iterator[Dict[str, Any]]:
+        try:
+            fh = self.log_path.open("rb")
+        except FileNotFoundError:
+            return
+        with fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # riga troncata
+                if isinstance(entry, dict) and entry.get("file"):
+                    yield entry
+
+    def _replay(self, revision: int) -> Dict[str, Any]:
+        totals = _empty_totals()
+        for entry in self._entries():
+            self._add(totals, entry)
+        totals["log_bytes"] = self.log_path.stat().st_size
+        # revisione nuova anche se il log è tornato uguale a uno già visto
+        totals["revision"] = revision + 1
+        self._write_summary(totals)
+        return totals
+
+    def _bootstrap(self) -> Dict[str, Any]:
+        totals = _empty_totals()
+        legacy = sorted(
+            (
+                p
+                for p in self.imports_dir.iterdir()
+                if p.name.endswith((".csv", ".csv.gz"))
+            ),
+            key=lambda p: p.stat().st_mtime,
+        )
+        if not legacy:
+            return totals
+        lines = []
+        for path in legacy:
+            st = path.stat()
+            entry = {
+                "file": path.name,
+                "sha256": None,
+                "filename": path.name,
+                "bytes": st.st_size,
+                "rows": None,
+                "imported_at": st.st_mtime,
+            }
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._add(totals, entry)
+        payload = "".join(lines).encode("utf-8")
+        with self.log_path.open("ab") as fh:
+            fh.write(payload)
+            fh.flush()
+            os.fsync(fh.fileno())
+        totals["log_bytes"] = len(payload)
+        totals["revision"] = 1
+        self._write_summary(totals)
+        log.info("Manifest import creato: %d file esistenti", len(legacy))
+        return totals
+
+    # ---------- aggiornamento ----------
+
+    @staticmethod
+    def _add(totals: Dict[str, Any], entry: Dict[str, Any]) -> None:
+        totals["count"] += 1
+        totals["bytes"] += int(entry.get("bytes") or 0)
+        totals["rows"] += int(entry.get("rows") or 0)
+        if entry["file"].endswith(".gz"):
+            totals["compressed"] += 1
+        ts = entry.get("imported_at")
+        if ts is not None and (
+            totals["last_import_at"] is None or ts > totals["last_import_at"]
+        ):
+            totals["last_import_at"] = ts
+
+    def _write_summary(self, totals: Dict[str, Any]) -> None:
+        atomic_write_text(self.summary_path, json.dumps(totals))
+
+    @staticmethod
+    def _entry(
+        path: Path,
+        sha256: Optional[str],
+        filename: Optional[str],
+        rows: int,
+        imported_at: Optional[float],
+    ) -> Dict[str, Any]:
+        return {
+            "file": path.name,
+            "sha256": sha256,
+            "filename": filename or path.name,
+            "bytes": path.stat().st_size,
+            "rows": rows,
+            "imported_at": imported_at if imported_at is not None else time.time(),
+        }
+
+    def _known_hashes(self) -> Set[str]:
+        # chiamare con self._lock acquisito
+        if self._hashes is None:
+            self._hashes = _hashes_of(self._entries())
+        return self._hashes
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        # chiamare con self._lock acquisito
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.log_path.open("ab") as fh:
+            fh.write(line)
+            fh.flush()
+            os.fsync(fh.fileno())
+        totals = dict(self._totals)
+        self._add(totals, entry)
+        totals["log_bytes"] += len(line)
+        totals["revision"] += 1
+        self._write_summary(totals)
+        self._totals = totals
+        sha = _entry_sha256(entry)
+        if sha and self._hashes is not None:
+            self._hashes.add(sha)
+
+    def record(
+        self,
+        path: Path,
+        *,
+        sha256: Optional[str],
+        filename: Optional[str],
+        rows: int,
+        imported_at: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Registra un import committato (append + totali)."""
+        entry = self._entry(path, sha256, filename, rows, imported_at)
+        with self._lock:
+            self._append(entry)
+        self._ensure_sweeper()
+        return entry
+
+    def publish(
+        self,
+        staged: Path,
+        dest: Path,
+        *,
+        sha256: str,
+        filename: Optional[str],
+        rows: int,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Import committato: rinomina il file temporaneo in `dest` e lo
+        registra. Se lo stesso contenuto è stato registrato nel frattempo
+        (import identici concorrenti) il temporaneo viene scartato → None.
+        """
+        with self._lock:
+            if sha256 in self._known_hashes():
+                staged.unlink(missing_ok=True)
+                return None
+            os.replace(staged, dest)
+            entry = self._entry(dest, sha256, filename, rows, None)
+            self._append(entry)
+        self._ensure_sweeper()
+        return entry
+
+    def has(self, sha256: str) -> bool:
+        """True se un import con questo contenuto è già stato committato."""
+        with self._lock:
+            return sha256 in self._known_hashes()
+
+    def summary(self) -> Dict[str, Any]:
+        totals = self._totals
+        return {k: v for k, v in totals.items() if k != "log_bytes"}
+
+    # ---------- compressione + retention ----------
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Comprime gli import più vecchi di compress_after_days e rimuove
+        quelli oltre retention_days. Il lavoro sui file avviene fuori dal
+        lock; poi il log viene riscritto (atomico) con le sole voci vive,
+        conservando quelle registrate nel frattempo.
+        """
+        now = time.time() if now is None else now
+        stats = {"compressed": 0, "expired": 0}
+        with self._sweep_lock:
+            changes: Dict[str, Optional[Dict[str, Any]]] = {}
+            for entry in self._entries():
+                name = entry["file"]
+                age = now - float(entry.get("imported_at") or now)
+                path = self.imports_dir / name
+                if self.retention_days and age > self.retention_days * DAY_SEC:
+                    path.unlink(missing_ok=True)
+                    changes[name] = None
+                    stats["expired"] += 1
+                elif (
+                    self.compress_after_days
+                    and age > self.compress_after_days * DAY_SEC
+                    and not name.endswith(".gz")
+                ):
+                    gz = _gzip_file(path)
+                    if gz is None:
+                        changes[name] = None  # file sparito dall'archivio
+                        continue
+                    changes[name] = {
+                        **entry,
+                        "file": gz.name,
+                        "bytes": gz.stat().st_size,
+                        "raw_bytes": entry.get("bytes"),
+                    }
+                    stats["compressed"] += 1
+            if changes:
+                self._rewrite(changes)
+        if changes:
+            log.info("Archivio import %s: %s", self.imports_dir, stats)
+        return stats
+
+    def _rewrite(self, changes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        with self._lock:
+            kept: List[Dict[str, Any]] = []
+            for entry in self._entries():
+                if entry["file"] in changes:
+                    replacement = changes[entry["file"]]
+                    if replacement is not None:
+                        kept.append(replacement)
+                else:
+                    kept.append(entry)
+            text = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in kept)
+            atomic_write_text(self.log_path, text)
+            totals = _empty_totals()
+            for entry in kept:
+                self._add(totals, entry)
+            # l'ultimo import resta tale anche se scaduto
+            totals["last_import_at"] = self._totals["last_import_at"]
+            totals["log_bytes"] = len(text.encode("utf-8"))
+            totals["revision"] = self._totals["revision"] + 1
+            self._write_summary(totals)
+            self._totals = totals
+            # import scaduti: lo stesso contenuto può essere reimportato
+            self._hashes = _hashes_of(kept)
+
+    @property
+    def sweeps(self) -> bool:
+        return bool(self.compress_after_days or self.retention_days)
+
+    def _ensure_sweeper(self) -> None:
+        if self.sweeps:
+            _start_sweeper()
+
+
+_manifests: Dict[Path, ImportsManifest] = {}
+_manifests_lock = threading.Lock()
+
+# pulizia condivisa: un thread per processo, qualunque sia il numero di tenant
+_sweeper: Optional[threading.Thread] = None
+_sweeper_lock = threading.Lock()
+
+
+def _sweep_interval() -> float:
+    return float(max(_env_int("CATALOGHI_IMPORTS_SWEEP_SEC", 3600), 1))
+
+
+def _start_sweeper() -> None:
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return
+        _sweeper = threading.Thread(
+            target=_sweeper_loop, name="dpi-imports-sweeper", daemon=True
+        )
+        _sweeper.start()
+
+
+def _sweeper_loop() -> None:
+    while True:
+        with _manifests_lock:
+            manifests = list(_manifests.values())
+        for manifest in manifests:
+            if not manifest.sweeps:
+                continue
+            try:
+                manifest.sweep()
+            except Exception:  # pragma: no cover
+                log.exception(
+                    "Pulizia archivio import fallita: %s", manifest.imports_dir
+                )
+        time.sleep(_sweep_interval())
+
+
+def get_manifest(imports_dir: Path) -> ImportsManifest:
+    """ImportsManifest condiviso per directory di archivio (avvia la pulizia)."""
+    key = imports_dir.resolve()
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+        if manifest is None:
+            manifest = _manifests[key] = ImportsManifest(imports_dir)
+            manifest._ensure_sweeper()
+        return manifest
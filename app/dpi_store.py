@@ -0,0 +1,859 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.dpi_index import PREZZO_PARSER_VERSION, CatalogIndex, parse_prezzo_cents
+
+# ============================================================
+# Storage Catalogo DPI
+# - Backend intercambiabili (CATALOGHI_STORAGE):
+#   * json: snapshot JSON canonico (clean/dpi_items.json)
+#   * wal: snapshot + log append-only a segmenti (clean/wal/*.log)
+#     → ogni merge scrive solo le righe cambiate, compattatore in
+#       background con rename atomico
+#   * sqlite: clean/dpi_items.sqlite3 in WAL mode, upsert su codice a
+#     batch, indici su gruppo/stato/prezzo, lettura a pagine
+# - CatalogStore: cache in memoria per versione (+ fallback sulla firma
+#   del backend) con indici secondari aggiornati dal delta dei merge
+# - Revisione persistita del catalogo: cresce solo con merge effettivi
+#   (base per ETag / GET condizionali), insieme al numero di item
+# - Prezzo in centesimi + aggregati per gruppo aggiornati col delta
+# ============================================================
+
+log = logging.getLogger("tpi.dpi_store")
+
+STORAGE_MODES = ("json", "wal", "sqlite")
+
+Item = dict[str, Any]
+
+
+def _env_int(key: str, default: int) -> int:
+    raw = (os.getenv(key) or "").strip()
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        return default
+
+
+def storage_mode() -> str:
+    """
+    Backend di persistenza del catalogo (CATALOGHI_STORAGE).
+    - json (default): riscrittura completa dello snapshot ad ogni merge
+    - wal: append delle sole modifiche + compattazione in background
+    - sqlite: database locale, upsert delle sole modifiche
+    """
+    mode = (os.getenv("CATALOGHI_STORAGE") or "json").strip().lower()
+    return mode if mode in STORAGE_MODES else "json"
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """
+    Scrive su file temporaneo nella stessa directory e poi os.replace:
+    i lettori vedono sempre il file vecchio o quello nuovo, mai a metà.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        fh.write(text)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def _dump_snapshot(items: List[Item]) -> str:
+    return json.dumps(items, ensure_ascii=False, indent=2)
+
+
+def _read_snapshot(items_path: Path) -> List[Item]:
+    if not items_path.exists():
+        return []
+    try:
+        data = json.loads(items_path.read_text(encoding="utf-8"))
+    except Exception:
+        return []
+    return data if isinstance(data, list) else []
+
+
+def _key(item: Item) -> str:
+    return (item.get("codice") or "").strip()
+
+
+def _replay(items: List[Item], segments: Iterable[Path]) -> None:
+    """
+    Riapplica i record del log sullo snapshot (in-place).
+    I record contengono l'item completo post-merge: il replay è idempotente.
+    """
+    idx = {_key(it): i for i, it in enumerate(items)}
+    for seg in segments:
+        try:
+            fh = seg.open("r", encoding="utf-8")
+        except FileNotFoundError:
+            continue
+        with fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # riga troncata (crash durante append): si ignora
+                    continue
+                item = rec.get("item") if isinstance(rec, dict) else None
+                if rec.get("op") != "put" or not isinstance(item, dict):
+                    continue
+                k = _key(item)
+                if k in idx:
+                    items[idx[k]] = item
+                else:
+                    items.append(item)
+                    idx[k] = len(items) - 1
+
+
+# ---------- Backend ----------
+
+
+class CatalogBackend:
+    """
+    Interfaccia minima di un backend catalogo.
+    - load(): tutti gli item, in ordine di inserimento
+    - write(items, changed): persiste un merge; `changed` è il delta
+      (None = riscrittura completa di `items`)
+    - signature(): firma economica dello stato persistito, cambia se un
+      altro processo scrive
+    - revision(): versione persistita del contenuto, monotona; cresce ad
+      ogni write() e non con la compattazione
+    - count(): numero di item persistito col merge (None = non noto)
+    - fetch_page()/fetch_range(): opzionali, lettura a pagine lato backend
+    - prezzo_stats(): aggregati prezzo per gruppo mantenuti dal backend
+      (None = calcolati dagli indici in memoria)
+    """
+
+    name = "base"
+    supports_paging = False
+
+    def load(self) -> List[Item]:
+        raise NotImplementedError
+
+    def write(self, items: List[Item], changed: Optional[List[Item]]) -> None:
+        raise NotImplementedError
+
+    def signature(self) -> Tuple[Any, ...]:
+        raise NotImplementedError
+
+    def revision(self) -> int:
+        raise NotImplementedError
+
+    def fetch_page(
+        self,
+        *,
+        eq: Optional[Dict[str, str]] = None,
+        prefix: str = "",
+        after: str = "",
+        limit: Optional[int] = None,
+        prezzo_min: Optional[int] = None,
+        prezzo_max: Optional[int] = None,
+    ) -> Tuple[List[Item], Optional[str]]:
+        raise NotImplementedError
+
+    def fetch_range(self, offset: int, limit: int) -> List[Item]:
+        raise NotImplementedError
+
+    def count(self) -> Optional[int]:
+        return None
+
+    def prezzo_stats(self) -> Optional[Dict[str, Dict[str, int]]]:
+        return None
+
+
+class JsonBackend(CatalogBackend):
+    """
+    Snapshot JSON riscritto per intero (atomico). Eventuali segmenti di
+    log rimasti da una sessione in modalità wal vengono riapplicati in
+    lettura e assorbiti alla prima scrittura.
+    Revisione e numero di item sono in clean/dpi_items.meta.json,
+    riscritto in modo atomico.
+    """
+
+    name = "json"
+
+    def __init__(self, items_path: Path) -> None:
+        self.items_path = items_path
+        self.wal_dir = items_path.parent / "wal"
+        self.meta_path = items_path.with_name(f"{items_path.stem}.meta.json")
+        self._lock = threading.RLock()
+        self._meta_memo: Tuple[Any, Dict[str, Any]] = (None, {})
+
+    @staticmethod
+    def _seq(segment: Path) -> int:
+        try:
+            return int(segment.stem.split("-", 1)[1])
+        except (IndexError, ValueError):
+            return 0
+
+    def _segments(self) -> List[Path]:
+        if not self.wal_dir.exists():
+            return []
+        return sorted(self.wal_dir.glob("segment-*.log"), key=self._seq)
+
+    def load(self) -> List[Item]:
+        with self._lock:
+            items = _read_snapshot(self.items_path)
+            _replay(items, self._segments())
+            return items
+
+    def write(self, items: List[Item], changed: Optional[List[Item]]) -> None:
+        with self._lock:
+            atomic_write_text(self.items_path, _dump_snapshot(items))
+            for seg in self._segments():
+                seg.unlink(missing_ok=True)
+            self._bump_revision(len(items))
+
+    def signature(self) -> Tuple[Any, ...]:
+        try:
+            st = self.items_path.stat()
+            snap: Tuple[Any, ...] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            snap = (None, None)
+        segs = []
+        for seg in self._segments():
+            try:
+                segs.append((seg.name, seg.stat().st_size))
+            except FileNotFoundError:
+                continue  # rimosso dal compattatore dopo il glob
+        return snap + tuple(segs)
+
+    def _meta(self) -> Dict[str, Any]:
+        # un solo stat() se il file non è cambiato (il rename cambia inode)
+        try:
+            st = self.meta_path.stat()
+        except FileNotFoundError:
+            return {}
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._meta_memo[0] == stamp:
+            return self._meta_memo[1]
+        try:
+            data = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        meta = data if isinstance(data, dict) else {}
+        self._meta_memo = (stamp, meta)
+        return meta
+
+    def revision(self) -> int:
+        try:
+            return int(self._meta().get("version", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    def count(self) -> Optional[int]:
+        n = self._meta().get("count")
+        return n if isinstance(n, int) else None
+
+    def _bump_revision(self, count: int) -> None:
+        meta = {"version": self.revision() + 1, "count": count}
+        atomic_write_text(self.meta_path, json.dumps(meta))
+        st = self.meta_path.stat()
+        self._meta_memo = ((st.st_ino, st.st_mtime_ns, st.st_size), meta)
+
+
+class WalBackend(JsonBackend):
+    """
+    Snapshot + log a segmenti.
+    - write(): accoda i soli item modificati al segmento attivo
+    - compact(): sigilla il segmento attivo, riscrive lo snapshot con
+      rename atomico ed elimina i segmenti già inclusi
+    """
+
+    name = "wal"
+
+    def __init__(self, items_path: Path) -> None:
+        super().__init__(items_path)
+        self.compact_bytes = _env_int("CATALOGHI_WAL_COMPACT_BYTES", 4 * 1024 * 1024)
+        self.compact_interval = float(max(_env_int("CATALOGHI_WAL_COMPACT_SEC", 60), 1))
+        self._generation = 0
+        segs = self._segments()
+        self._wal_bytes = sum(s.stat().st_size for s in segs)
+        self._active_seq = self._seq(segs[-1]) if segs else 1
+        self._wake = threading.Event()
+        self._compactor: Optional[threading.Thread] = None
+        # notifica al CatalogStore: forma su disco cambiata, contenuto no
+        self.on_compacted: Optional[Callable[[], None]] = None
+
+    def _segment_path(self, seq: int) -> Path:
+        return self.wal_dir / f"segment-{seq:08d}.log"
+
+    def write(self, items: List[Item], changed: Optional[List[Item]]) -> None:
+        if changed is None:
+            with self._lock:
+                super().write(items, None)
+                self._wal_bytes = 0
+                self._generation += 1
+            return
+        if not changed:
+            return
+        payload = "".join(
+            json.dumps({"op": "put", "item": it}, ensure_ascii=False) + "\n"
+            for it in changed
+        ).encode("utf-8")
+        with self._lock:
+            self.wal_dir.mkdir(parents=True, exist_ok=True)
+            with self._segment_path(self._active_seq).open("ab") as fh:
+                fh.write(payload)
+                fh.flush()
+                os.fsync(fh.fileno())
+            self._bump_revision(len(items))
+            self._wal_bytes += len(payload)
+            big = self._wal_bytes >= self.compact_bytes
+        self._ensure_compactor()
+        if big:
+            self._wake.set()
+
+    def compact(self) -> bool:
+        """
+        Compattazione: il lavoro pesante (lettura + serializzazione) avviene
+        fuori dal lock, così gli append non restano bloccati.
+        """
+        with self._lock:
+            sealed = [s for s in self._segments() if self._seq(s) <= self._active_seq]
+            if not sealed:
+                return False
+            self._active_seq += 1
+            generation = self._generation
+
+        items = _read_snapshot(self.items_path)
+        _replay(items, sealed)
+        text = _dump_snapshot(items)
+
+        with self._lock:
+            if generation != self._generation:
+                # snapshot completo scritto nel frattempo: già più recente
+                return False
+            atomic_write_text(self.items_path, text)
+            for seg in sealed:
+                self._wal_bytes -= seg.stat().st_size if seg.exists() else 0
+                seg.unlink(missing_ok=True)
+            self._wal_bytes = max(self._wal_bytes, 0)
+            self._generation += 1
+        if self.on_compacted is not None:
+            self.on_compacted()
+        log.info("Catalogo compattato: %s (%d items)", self.items_path, len(items))
+        return True
+
+    def _ensure_compactor(self) -> None:
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(
+                target=self._compactor_loop,
+                name=f"dpi-compactor:{self.items_path.parent}",
+                daemon=True,
+            )
+            self._compactor.start()
+
+    def _compactor_loop(self) -> None:
+        while True:
+            self._wake.wait(self.compact_interval)
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception:  # pragma: no cover
+                log.exception("Compattazione catalogo fallita: %s", self.items_path)
+
+
+class SqliteBackend(CatalogBackend):
+    """
+    SQLite locale (journal WAL): una riga per codice, item serializzato in
+    `data`, colonne gruppo/stato/prezzo_cents indicizzate. L'ordine di
+    inserimento è il rowid, preservato dall'upsert. Una connessione per
+    thread. Al primo avvio su DB vuoto importa lo snapshot JSON esistente.
+    Aggregati prezzo per gruppo in `prezzi_gruppo`: count/sum aggiornati
+    col delta, min/max riletti dall'indice (gruppo, prezzo_cents).
+    """
+
+    name = "sqlite"
+    supports_paging = True
+    BATCH = 1000
+
+    def __init__(self, items_path: Path) -> None:
+        self.items_path = items_path
+        self.db_path = items_path.with_suffix(".sqlite3")
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS items (
+                codice TEXT PRIMARY KEY,
+                gruppo TEXT NOT NULL DEFAULT '',
+                stato TEXT NOT NULL DEFAULT '',
+                data TEXT NOT NULL,
+                prezzo_cents INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS ix_items_gruppo ON items(gruppo, codice);
+            CREATE INDEX IF NOT EXISTS ix_items_stato ON items(stato, codice);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta(key, value) VALUES ('version', 0);
+            INSERT OR IGNORE INTO meta(key, value)
+                SELECT 'count', COUNT(*) FROM items;
+            """
+        )
+        self._ensure_prezzi(conn)
+        if self.count() == 0:
+            legacy = JsonBackend(items_path).load()
+            if legacy:
+                self.write(legacy, None)
+                log.info("Catalogo migrato in SQLite: %d items", len(legacy))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_prezzi(self, conn: sqlite3.Connection) -> None:
+        """
+        Colonna prezzo_cents + aggregati. Su DB esistenti (o calcolati con
+        regole di parse diverse, meta.prezzo_parser) li ripopola una volta.
+        """
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+        parser = conn.execute(
+            "SELECT value FROM meta WHERE key = 'prezzo_parser'"
+        ).fetchone()
+        stale = parser is None or parser[0] != PREZZO_PARSER_VERSION
+        if "prezzo_cents" not in columns or stale:
+            with self._write_lock, conn:
+                if "prezzo_cents" not in columns:
+                    conn.execute("ALTER TABLE items ADD COLUMN prezzo_cents INTEGER")
+                rows = [
+                    (parse_prezzo_cents(json.loads(data).get("prezzo")), codice)
+                    for codice, data in conn.execute("SELECT codice, data FROM items")
+                ]
+                conn.executemany(
+                    "UPDATE items SET prezzo_cents = ? WHERE codice = ?", rows
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta(key, value) "
+                    "VALUES ('prezzo_parser', ?)",
+                    (PREZZO_PARSER_VERSION,),
+                )
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'prezzi_gruppo'"
+        ).fetchone()
+        conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS ix_items_prezzo ON items(prezzo_cents, codice);
+            CREATE INDEX IF NOT EXISTS ix_items_gruppo_prezzo
+                ON items(gruppo, prezzo_cents);
+            CREATE TABLE IF NOT EXISTS prezzi_gruppo (
+                gruppo TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                sum INTEGER NOT NULL,
+                min INTEGER,
+                max INTEGER
+            );
+            """
+        )
+        if not has_stats or stale:
+            with self._write_lock, conn:
+                self._rebuild_prezzi(conn)
+
+    @staticmethod
+    def _row(item: Item) -> Tuple[str, str, str, Optional[int], str]:
+        return (
+            _key(item),
+            item.get("gruppo") or "",
+            item.get("stato") or "",
+            parse_prezzo_cents(item.get("prezzo")),
+            json.dumps(item, ensure_ascii=False),
+        )
+
+    def load(self) -> List[Item]:
+        cur = self._conn().execute("SELECT data FROM items ORDER BY rowid")
+        return [json.loads(data) for (data,) in cur]
+
+    def write(self, items: List[Item], changed: Optional[List[Item]]) -> None:
+        if changed is not None and not changed:
+            return
+        rows = [self._row(it) for it in (items if changed is None else changed)]
+        rows = [r for r in rows if r[0]]
+        conn = self._conn()
+        with self._write_lock, conn:
+            if changed is None:
+                conn.execute("DELETE FROM items")
+            else:
+                before = self._prezzi_before(conn, [r[0] for r in rows])
+            for start in range(0, len(rows), self.BATCH):
+                conn.executemany(
+                    "INSERT INTO items(codice, gruppo, stato, prezzo_cents, data) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(codice) DO UPDATE SET "
+                    "gruppo = excluded.gruppo, stato = excluded.stato, "
+                    "prezzo_cents = excluded.prezzo_cents, data = excluded.data",
+                    rows[start : start + self.BATCH],
+                )
+            if changed is None:
+                self._rebuild_prezzi(conn)
+            else:
+                self._update_prezzi(conn, before, {r[0]: (r[1], r[3]) for r in rows})
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            if changed is None:
+                count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+            else:
+                # `items` è il catalogo completo post-merge: niente COUNT(*)
+                count = sum(1 for it in items if _key(it))
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'count'", (count,))
+
+    # ---------- aggregati prezzo ----------
+
+    def _prezzi_before(
+        self, conn: sqlite3.Connection, keys: List[str]
+    ) -> Dict[str, Tuple[str, Optional[int]]]:
+        before: Dict[str, Tuple[str, Optional[int]]] = {}
+        step = 500  # sotto il limite di parametri SQLite
+        for start in range(0, len(keys), step):
+            chunk = keys[start : start + step]
+            marks = ",".join("?" * len(chunk))
+            cur = conn.execute(
+                "SELECT codice, gruppo, prezzo_cents FROM items "
+                f"WHERE codice IN ({marks})",  # nosec B608
+                chunk,
+            )
+            for codice, gruppo, cents in cur:
+                before[codice] = (gruppo, cents)
+        return before
+
+    @staticmethod
+    def _rebuild_prezzi(conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM prezzi_gruppo")
+        conn.execute(
+            "INSERT INTO prezzi_gruppo(gruppo, count, sum, min, max) "
+            "SELECT gruppo, COUNT(*), SUM(prezzo_cents), MIN(prezzo_cents), "
+            "MAX(prezzo_cents) FROM items WHERE prezzo_cents IS NOT NULL "
+            "GROUP BY gruppo"
+        )
+
+    @staticmethod
+    def _update_prezzi(
+        conn: sqlite3.Connection,
+        before: Dict[str, Tuple[str, Optional[int]]],
+        after: Dict[str, Tuple[str, Optional[int]]],
+    ) -> None:
+        deltas: Dict[str, List[int]] = {}
+        for codice, new in after.items():
+            old = before.get(codice)
+            if old == new:
+                continue
+            for entry, sign in ((old, -1), (new, 1)):
+                if entry is not None and entry[1] is not None:
+                    delta = deltas.setdefault(entry[0], [0, 0])
+                    delta[0] += sign
+                    delta[1] += sign * entry[1]
+        for gruppo, (count, total) in deltas.items():
+            conn.execute(
+                "INSERT INTO prezzi_gruppo(gruppo, count, sum) VALUES (?, ?, ?) "
+                "ON CONFLICT(gruppo) DO UPDATE SET "
+                "count = count + excluded.count, sum = sum + excluded.sum",
+                (gruppo, count, total),
+            )
+            # min e max con due letture separate: ognuna è un accesso all'indice
+            lo = conn.execute(
+                "SELECT prezzo_cents FROM items WHERE gruppo = ? "
+                "AND prezzo_cents IS NOT NULL ORDER BY prezzo_cents LIMIT 1",
+                (gruppo,),
+            ).fetchone()
+            if lo is None:
+                conn.execute("DELETE FROM prezzi_gruppo WHERE gruppo = ?", (gruppo,))
+                continue
+            hi = conn.execute(
+                "SELECT prezzo_cents FROM items WHERE gruppo = ? "
+                "ORDER BY prezzo_cents DESC LIMIT 1",
+                (gruppo,),
+            ).fetchone()
+            conn.execute(
+                "UPDATE prezzi_gruppo SET min = ?, max = ? WHERE gruppo = ?",
+                (lo[0], hi[0], gruppo),
+            )
+
+    def prezzo_stats(self) -> Optional[Dict[str, Dict[str, int]]]:
+        cur = self._conn().execute(
+            "SELECT gruppo, count, min, max, sum FROM prezzi_gruppo ORDER BY gruppo"
+        )
+        return {
+            gruppo: {
+                "count": count,
+                "min_cents": lo,
+                "max_cents": hi,
+                "sum_cents": total,
+            }
+            for gruppo, count, lo, hi, total in cur
+        }
+
+    def signature(self) -> Tuple[Any, ...]:
+        return (self.revision(),)
+
+    def revision(self) -> int:
+        row = (
+            self._conn()
+            .execute("SELECT value FROM meta WHERE key = 'version'")
+            .fetchone()
+        )
+        return int(row[0]) if row else 0
+
+    def count(self) -> Optional[int]:
+        row = (
+            self._conn()
+            .execute("SELECT value FROM meta WHERE key = 'count'")
+            .fetchone()
+        )
+        return int(row[0]) if row else None
+
+    def fetch_page(
+        self,
+        *,
+        eq: Optional[Dict[str, str]] = None,
+        prefix: str = "",
+        after: str = "",
+        limit: Optional[int] = None,
+        prezzo_min: Optional[int] = None,
+        prezzo_max: Optional[int] = None,
+    ) -> Tuple[List[Item], Optional[str]]:
+        where = ["codice > ?"]
+        params: List[Any] = [after]
+        if prefix:
+            where.append("codice >= ? AND codice < ?")
+            params += [prefix, prefix + "\U0010ffff"]
+        for field, value in (eq or {}).items():
+            if field in ("gruppo", "stato"):
+                where.append(f"{field} = ?")
+                params.append(value)
+        if prezzo_min is not None:
+            where.append("prezzo_cents >= ?")
+            params.append(prezzo_min)
+        if prezzo_max is not None:
+            where.append("prezzo_cents <= ?")
+            params.append(prezzo_max)
+        sql = (
+            "SELECT codice, data FROM items "
+            f"WHERE {' AND '.join(where)} ORDER BY codice"  # nosec B608
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        rows = self._conn().execute(sql, params).fetchall()
+        next_after = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_after = rows[-1][0]
+        return [json.loads(data) for _, data in rows], next_after
+
+    def fetch_range(self, offset: int, limit: int) -> List[Item]:
+        cur = self._conn().execute(
+            "SELECT data FROM items ORDER BY rowid LIMIT ? OFFSET ?", (limit, offset)
+        )
+        return [json.loads(data) for (data,) in cur]
+
+
+_BACKENDS: Dict[str, Callable[[Path], CatalogBackend]] = {
+    "json": JsonBackend,
+    "wal": WalBackend,
+    "sqlite": SqliteBackend,
+}
+
+
+# ---------- Cache + indici ----------
+
+
+class CatalogStore:
+    """
+    Catalogo servito dalla memoria sopra un backend.
+    - read(): lista condivisa, valida finché `version` e la firma del
+      backend non cambiano (scritture di altri processi)
+    - commit(items, changed): persiste il merge e pubblica `items`
+    - index(): indici secondari, aggiornati col delta dei commit
+    - fields(): campi degli item, aggiornati col delta dei commit
+    - query(): pagina/filtri (in SQL se il backend lo supporta)
+    - search(): ricerca testuale sugli indici in memoria
+    - prezzo_stats(): aggregati prezzo per gruppo (json/wal: None finché
+      gli indici non sono costruiti)
+    - revision(): versione persistita, senza caricare gli item
+    """
+
+    def __init__(self, backend: CatalogBackend) -> None:
+        self.backend = backend
+        self._lock = threading.RLock()
+        # cache: lista condivisa tra i lettori, sostituita (mai mutata) dai writer
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache: Optional[List[Item]] = None
+        self._cache_version = -1
+        self._cache_sig: Tuple[Any, ...] = ()
+        self._index: Optional[CatalogIndex] = None
+        # campi degli item in ordine di prima comparsa (insieme ordinato)
+        self._fields: Optional[Dict[str, None]] = None
+        if isinstance(backend, WalBackend):
+            backend.on_compacted = self._refresh_signature
+
+    def _install(
+        self,
+        items: List[Item],
+        bump: bool = True,
+        changed: Optional[List[Item]] = None,
+    ) -> None:
+        if bump:
+            self.version += 1
+        base_ok = self._cache is not None and self._cache_version == self.version - 1
+        self._cache = items
+        self._cache_version = self.version
+        self._cache_sig = self.backend.signature()
+        if self._fields is not None and changed is not None and base_ok:
+            # il merge non rimuove mai campi: bastano quelli del delta
+            for it in changed:
+                for k in it:
+                    self._fields.setdefault(k)
+        else:
+            self._fields = None
+        if self._index is None:
+            return
+        if changed is None or not base_ok:
+            self._index = None  # ricostruito alla prossima interrogazione
+            return
+        self._index.apply(changed)
+        if self._index.size != len(items):
+            self._index = None
+
+    def _refresh_signature(self) -> None:
+        with self._lock:
+            if self._cache_version == self.version:
+                # contenuto invariato: cambia solo la forma su disco
+                self._cache_sig = self.backend.signature()
+
+    def read(self) -> List[Item]:
+        """
+        Catalogo dalla cache. La lista è condivisa: chi deve modificarla
+        ne fa una copia e poi la passa a commit().
+        """
+        with self._lock:
+            if (
+                self._cache is not None
+                and self._cache_version == self.version
+                and self._cache_sig == self.backend.signature()
+            ):
+                self.hits += 1
+                return self._cache
+            self.misses += 1
+            items = self.backend.load()
+            self._index = None
+            self._install(items, bump=False)
+            return items
+
+    def index(self) -> CatalogIndex:
+        """
+        Indici secondari allineati alla versione corrente della cache.
+        Lettura e costruzione sotto lo stesso lock: un commit non può
+        arrivare nel mezzo e restare fuori dall'indice installato.
+        """
+        with self._lock:
+            items = self.read()
+            if self._index is None:
+                self._index = CatalogIndex.build(items)
+            return self._index
+
+    def fields(self) -> List[str]:
+        """
+        Campi presenti negli item, in ordine di prima comparsa. Calcolati
+        una volta per caricamento della cache, poi aggiornati col delta.
+        """
+        with self._lock:
+            items = self.read()
+            if self._fields is None:
+                self._fields = dict.fromkeys(k for it in items for k in it)
+            return list(self._fields)
+
+    def query(self, **kwargs: Any) -> Tuple[List[Item], Optional[str]]:
+        if self.backend.supports_paging:
+            return self.backend.fetch_page(**kwargs)
+        return self.index().query(**kwargs)
+
+    def search(self, q: str, limit: int = 20) -> Tuple[List[Tuple[Item, int]], bool]:
+        """Ricerca per frammenti su codice/descrizione (indice a trigrammi)."""
+        return self.index().search(q, limit)
+
+    def prezzo_stats(self) -> Optional[Dict[str, Dict[str, int]]]:
+        """
+        Aggregati prezzo per gruppo (count, min/max/sum in centesimi):
+        dal backend se li mantiene, altrimenti dagli indici in memoria se
+        già costruiti (aggiornati col delta dei merge). Indici non ancora
+        costruiti → None: chi monitora non carica mai il catalogo.
+        """
+        stats = self.backend.prezzo_stats()
+        if stats is not None:
+            return stats
+        with self._lock:
+            index = self._index
+        return None if index is None else index.prezzo_stats()
+
+    def items_range(self, offset: int, limit: int) -> List[Item]:
+        """Item in ordine di inserimento, posizioni [offset, offset + limit)."""
+        if self.backend.supports_paging:
+            return self.backend.fetch_range(offset, limit)
+        return self.read()[offset : offset + limit]
+
+    def count(self) -> int:
+        """Numero di item: dal backend (O(1)), altrimenti dagli indici."""
+        n = self.backend.count()
+        return n if n is not None else self.index().size
+
+    def revision(self) -> int:
+        return self.backend.revision()
+
+    def commit(self, items: List[Item], changed: Optional[List[Item]] = None) -> None:
+        """
+        Persiste un merge; senza `changed` riscrive tutto.
+        Delta vuoto (merge senza modifiche): nessuna scrittura, la
+        revisione non cambia.
+        """
+        if changed is not None and not changed:
+            return
+        with self._lock:
+            self.backend.write(items, changed)
+            self._install(items, changed=changed)
+
+    def cache_stats(self) -> dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": self.backend.name,
+                "version": self.version,
+                "revision": self.backend.revision(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
+
+
+_stores: Dict[Tuple[Path, str], CatalogStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(items_path: Path, mode: Optional[str] = None) -> CatalogStore:
+    """CatalogStore condiviso per (file, backend): un compattatore per catalogo."""
+    mode = mode or storage_mode()
+    key = (items_path.resolve(), mode)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = CatalogStore(_BACKENDS[mode](items_path))
+        return store
@@ -2,21 +2,26 @@
 # AELIS — FastAPI main (robusto per dev/prod)
 #
 # - Config da ENV (LOG_LEVEL, ENV, CORS, rate limit, ecc.)
-# - Correlation-ID + security headers (HSTS solo in prod)
+# - Correlation-ID + security headers (HSTS solo in prod) + rate limit in
+#   un unico middleware ASGI puro (EdgeMiddleware)
 # - HTTPS redirect & TrustedHost SOLO in prod
 # - CORS:
 #     * dev  → allow_origins=["*"], no credenziali
 #     * prod → lista esplicita da ENV
-# - Rate limit per-IP (burst/finestra da ENV) in-memory
+# - Rate limit per-IP (burst/finestra da ENV), app/ratelimit.py:
+#     * memory → token bucket O(1) per processo (default)
+#     * sqlite / redis → budget condiviso tra worker (RATE_BACKEND)
+#     * regole per route (RATE_RULES): probe esenti, budget read / write,
+#       costo pesato (export, byte di upload), header RateLimit-*
 # - Handler eccezioni uniformi (con X-Request-ID / X-Correlation-ID)
 # - Registrazione router tollerante a moduli mancanti
 # - Probes: /health, /healthz (UTC), /version
+# - Metriche Prometheus: /metrics (app/metrics.py)
 # - Endpoint /debug/routes in dev
 # ============================================================
 
 from __future__ import annotations
 
-import asyncio
 import importlib
 import logging
 import os
@@ -24,15 +29,24 @@ import time
 import uuid
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Any, AsyncIterator, Dict, List
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.middleware.httpsredirect import HTTPSRedirectMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import metrics
+from app.ratelimit import (
+    WRITE_METHODS,
+    RateLimiter,
+    RateLimitPolicy,
+    Rule,
+    build_limiter,
+)
 
 
 # --------------------------------------------------
@@ -72,6 +86,21 @@ ALLOWED_HOSTS = [h.strip() for h in _raw_hosts.split(",") if h.strip()] or (
 # Rate limit
 RATE_BURST = _getenv_int("RATE_BURST", 5)
 RATE_WINDOW = _getenv_int("RATE_WINDOW", 60)
+RATE_MAX_KEYS = _getenv_int("RATE_MAX_KEYS", 100_000)
+# memory (per processo) | sqlite (worker della stessa macchina) | redis
+RATE_BACKEND = _getenv("RATE_BACKEND", "memory").lower()
+RATE_SQLITE_PATH = _getenv("RATE_SQLITE_PATH", "data/ratelimit.sqlite3")
+RATE_REDIS_URL = _getenv("RATE_REDIS_URL", "redis://127.0.0.1:6379/0")
+RATE_SYNC_MS = _getenv_int("RATE_SYNC_MS", 50)
+# budget separati letture / scritture (default: RATE_BURST / RATE_WINDOW)
+RATE_READ_BURST = _getenv_int("RATE_READ_BURST", RATE_BURST)
+RATE_READ_WINDOW = _getenv_int("RATE_READ_WINDOW", RATE_WINDOW)
+RATE_WRITE_BURST = _getenv_int("RATE_WRITE_BURST", RATE_BURST)
+RATE_WRITE_WINDOW = _getenv_int("RATE_WRITE_WINDOW", RATE_WINDOW)
+# costo scritture: 1 + 1 unità ogni RATE_UPLOAD_UNIT byte di upload
+RATE_UPLOAD_UNIT = _getenv_int("RATE_UPLOAD_UNIT", 10 * 1024 * 1024)
+# costo di export / report rispetto a una lettura semplice
+RATE_EXPORT_WEIGHT = _getenv_int("RATE_EXPORT_WEIGHT", 2)
 
 # CORS
 if ENV == "prod":
@@ -94,91 +123,180 @@ log = logging.getLogger("tpi.app")
 # --------------------------------------------------
 # Middleware custom (inline)
 # --------------------------------------------------
-class CorrelationIdMiddleware(BaseHTTPMiddleware):
-    """
-    Genera / propaga un X-Request-ID su ogni richiesta.
-
-    - Legge da header esistenti (x-request-id, x-correlation-id)
-    - Se assente, genera un UUID4
-    - Espone request.state.request_id
-    """
-
-    def __init__(self, app: ASGIApp, header_name: str = "x-request-id") -> None:
-        super().__init__(app)
-        self.header_name = header_name
-
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        req_id = (
-            request.headers.get(self.header_name)
-            or request.headers.get("x-correlation-id")
-            or str(uuid.uuid4())
-        )
-        request.state.request_id = req_id
-        response = await call_next(request)
-        response.headers.setdefault(self.header_name, req_id)
-        response.headers.setdefault("x-correlation-id", req_id)
-        return response
-
-
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+class EdgeMiddleware:
     """
-    Aggiunge header di sicurezza base.
-    HSTS abilitato solo se enable_hsts=True (prod).
+    Middleware ASGI unico per correlation-id, header di sicurezza e rate
+    limit. Niente BaseHTTPMiddleware: nessun task in più per richiesta,
+    la risposta non viene riavvolta e lo streaming resta streaming.
+
+    - Rate limit per-IP prima di chiamare l'app, secondo la policy per
+      route (app/ratelimit.py): oltre il limite 429 con Retry-After;
+      header RateLimit-* su ogni risposta non esente
+    - X-Request-ID letto da x-request-id / x-correlation-id o generato
+      (UUID4), esposto in request.state.request_id
+    - Header di sicurezza + correlation-id aggiunti in `send`, sul
+      messaggio http.response.start, senza sovrascrivere quelli presenti
+      (HSTS solo se enable_hsts=True, prod)
+    - Metriche (app/metrics.py): latenza per route, richieste in corso,
+      risposte per classe di status, 429 per budget, 5xx
     """
 
-    def __init__(self, app: ASGIApp, enable_hsts: bool = False) -> None:
-        super().__init__(app)
-        self.enable_hsts = enable_hsts
-
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        response = await call_next(request)
-        headers = response.headers
-
-        headers.setdefault("X-Content-Type-Options", "nosniff")
-        headers.setdefault("X-Frame-Options", "DENY")
-        headers.setdefault("X-XSS-Protection", "1; mode=block")
-        headers.setdefault("Referrer-Policy", "strict-origin-when-cross-origin")
-        headers.setdefault(
-            "Permissions-Policy",
-            "geolocation=(), microphone=(), camera=()",
+    def __init__(
+        self,
+        app: ASGIApp,
+        policy: RateLimitPolicy,
+        enable_hsts: bool = False,
+        header_name: str = "x-request-id",
+    ) -> None:
+        self.app = app
+        self.policy = policy
+        self.header_name = header_name.lower().encode("latin-1")
+        headers = [
+            (b"x-content-type-options", b"nosniff"),
+            (b"x-frame-options", b"DENY"),
+            (b"x-xss-protection", b"1; mode=block"),
+            (b"referrer-policy", b"strict-origin-when-cross-origin"),
+            (b"permissions-policy", b"geolocation=(), microphone=(), camera=()"),
+        ]
+        if enable_hsts:
+            headers.append(
+                (
+                    b"strict-transport-security",
+                    b"max-age=63072000; includeSubDomains; preload",
+                )
+            )
+        self.security_headers = tuple(headers)
+
+    @staticmethod
+    def _response_headers(
+        headers: Iterable[Tuple[bytes, bytes]], extra: List[Tuple[bytes, bytes]]
+    ) -> List[Tuple[bytes, bytes]]:
+        out = list(headers)
+        present = {name.lower() for name, _ in out}
+        out.extend(item for item in extra if item[0] not in present)
+        return out
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        req_id = corr_id = None
+        content_length = 0
+        for name, value in scope["headers"]:
+            if name == self.header_name:
+                req_id = value
+            elif name == b"x-correlation-id":
+                corr_id = value
+            elif name == b"content-length" and value.isdigit():
+                content_length = int(value)
+        req_id = req_id or corr_id or str(uuid.uuid4()).encode("latin-1")
+        scope.setdefault("state", {})["request_id"] = req_id.decode("latin-1")
+        extra = [
+            *self.security_headers,
+            (self.header_name, req_id),
+            (b"x-correlation-id", req_id),
+        ]
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        verdict = self.policy.check(
+            scope["method"], scope["path"], client_ip, content_length
         )
-
-        if self.enable_hsts:
-            headers.setdefault(
-                "Strict-Transport-Security",
-                "max-age=63072000; includeSubDomains; preload",
+        if verdict is not None:
+            allowed, wait, rate_headers, budget = verdict
+            extra += rate_headers
+        if verdict is not None and not allowed:
+            log.warning("Rate limit superato per %s", client_ip)
+            metrics.inc(metrics.HTTP_RATE_LIMITED, (budget,))
+            body = b'{"detail":"Too Many Requests"}'
+            headers = [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", self.policy.retry_after(wait).encode("latin-1")),
+            ]
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": self._response_headers(headers, extra),
+                }
             )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        status = 0
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = self._response_headers(
+                    message.get("headers") or (), extra
+                )
+            await send(message)
+
+        metrics.inc(metrics.HTTP_IN_FLIGHT)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_headers)
+        except Exception:
+            status = 500  # eccezione non gestita: la risposta la dà Starlette
+            raise
+        finally:
+            metrics.inc(metrics.HTTP_IN_FLIGHT, value=-1)
+            if status:  # 0 = client disconnesso prima della risposta
+                self._record(scope, status, time.perf_counter() - start)
+
+    @staticmethod
+    def _record(scope: Scope, status: int, elapsed: float) -> None:
+        # label = template della route ("/imports/{ref}"), mai il path grezzo
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        method = scope["method"]
+        metrics.observe(metrics.HTTP_LATENCY, elapsed, (route, method))
+        metrics.inc(metrics.HTTP_RESPONSES, (route, method, f"{status // 100}xx"))
+        if status >= 500:
+            metrics.inc(metrics.HTTP_SERVER_ERRORS, (route,))
+
+
+def _budget(burst: int, window: int) -> RateLimiter:
+    return build_limiter(
+        RATE_BACKEND,
+        burst,
+        window,
+        max_keys=RATE_MAX_KEYS,
+        sync_ms=RATE_SYNC_MS,
+        sqlite_path=Path(RATE_SQLITE_PATH),
+        redis_url=RATE_REDIS_URL,
+    )
 
-        return response
-
-
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """
-    Rate limit grezzo per-IP (in-memory, single-process).
-    Adatto per dev / piccole installazioni on-prem.
-    """
-
-    def __init__(self, app: ASGIApp, burst: int, window_sec: int) -> None:
-        super().__init__(app)
-        self.burst = max(burst, 1)
-        self.window = float(max(window_sec, 1))
-        self._hits: dict[str, list[float]] = {}
-        self._lock = asyncio.Lock()
-
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        client_ip = request.client.host if request.client else "unknown"
-        now = time.time()
 
-        async with self._lock:
-            hits = self._hits.get(client_ip, [])
-            hits = [ts for ts in hits if now - ts <= self.window]
-            if len(hits) >= self.burst:
-                log.warning("Rate limit superato per %s", client_ip)
-                raise HTTPException(status_code=429, detail="Too Many Requests")
-            hits.append(now)
-            self._hits[client_ip] = hits
+# Regole in ordine, vince la prima che corrisponde (pattern esatto o "prefisso*")
+RATE_RULES = (
+    # probe del load balancer e preflight CORS: mai limitati
+    Rule("/health", budget=None),
+    Rule("/healthz", budget=None),
+    Rule("/version", budget=None),
+    Rule("/metrics", budget=None),
+    Rule("*", methods=("OPTIONS",), budget=None),
+    # letture costose: export in streaming e report
+    Rule("/api/dpi/csv/export", weight=RATE_EXPORT_WEIGHT),
+    Rule("/api/dpi/csv/report.html", weight=RATE_EXPORT_WEIGHT),
+    Rule("/api/cataloghi/export", weight=RATE_EXPORT_WEIGHT),
+    Rule("/api/schede/export", weight=RATE_EXPORT_WEIGHT),
+    Rule("/api/percorsi/export", weight=RATE_EXPORT_WEIGHT),
+    # scritture: budget proprio, upload pesati per dimensione
+    Rule("*", methods=WRITE_METHODS, budget="write", bytes_per_unit=RATE_UPLOAD_UNIT),
+    Rule("*"),
+)
 
-        return await call_next(request)
+rate_policy = RateLimitPolicy(
+    RATE_RULES,
+    {
+        "read": _budget(RATE_READ_BURST, RATE_READ_WINDOW),
+        "write": _budget(RATE_WRITE_BURST, RATE_WRITE_WINDOW),
+    },
+)
 
 
 # --------------------------------------------------
@@ -197,6 +315,7 @@ async def lifespan(_: FastAPI) -> AsyncIterator[None]:
         yield
     finally:
         log.info("TPI_evoluto arresto in corso…")
+        rate_policy.close()
 
 
 # --------------------------------------------------
@@ -297,12 +416,24 @@ _include_optional_router(
     "Export filtrato (GET /api/dpi/csv/export?gruppo=...)",
 )
 
+# Cataloghi / schede / percorsi CSV → /api/{cataloghi,schede,percorsi}/*
+_include_optional_router(
+    "app.csv_routes:router",
+    "Import/export CSV cataloghi, schede, percorsi",
+)
+
 # Router ops: /healthz, /version, eventuali metriche
 _include_optional_router(
     "routers.ops:router",
     "Ops /healthz /version",
 )
 
+# Metriche Prometheus (/metrics, formato testo)
+_include_optional_router(
+    "app.metrics:router",
+    "Metriche Prometheus (GET /metrics)",
+)
+
 # Router NFC (landing / log accessi / deep link app)
 _include_optional_router(
     "routers.nfc_routes:router",
@@ -313,16 +444,7 @@ _include_optional_router(
 # --------------------------------------------------
 # Middleware (ordine importante)
 # --------------------------------------------------
-# 1) Correlation-ID per audit
-app.add_middleware(CorrelationIdMiddleware)
-
-# 2) Security headers (HSTS solo in prod)
-app.add_middleware(
-    SecurityHeadersMiddleware,
-    enable_hsts=(ENV == "prod"),
-)
-
-# 3) HTTPS redirect + Trusted hosts SOLO in prod
+# 1) HTTPS redirect + Trusted hosts SOLO in prod
 if ENV == "prod":
     app.add_middleware(HTTPSRedirectMiddleware)
     if not ALLOWED_HOSTS:
@@ -333,7 +455,7 @@ app.add_middleware(
     allowed_hosts=ALLOWED_HOSTS or ["*"],
 )
 
-# 4) CORS
+# 2) CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
@@ -342,12 +464,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 5) Rate limit per-IP
-app.add_middleware(
-    RateLimitMiddleware,
-    burst=RATE_BURST,
-    window_sec=RATE_WINDOW,
-)
+# 3) Esterno: rate limit per-IP + correlation-ID + security headers
+#    (anche su 429, redirect e rifiuti di TrustedHost / CORS)
+app.add_middleware(EdgeMiddleware, policy=rate_policy, enable_hsts=(ENV == "prod"))
 
 
 # --------------------------------------------------
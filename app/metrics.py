@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+# ============================================================
+# Metriche in formato Prometheus (GET /metrics)
+# - Serie dichiarate una volta (counter / gauge / histogram, nomi label)
+# - Registrazione senza lock: ogni thread scrive nelle proprie celle
+#   (thread-local); lo scrape le somma. Lock solo alla prima
+#   registrazione di un thread e alla sua fine, quando le celle
+#   confluiscono in un accumulatore unico (threadpool che ricicla i thread)
+# - Collector: funzioni chiamate allo scrape per i valori letti da altre
+#   strutture (dimensione catalogo, cache), nessun costo per richiesta
+# ============================================================
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Labels, float]
+
+# secondi: da probe (ms) a import/export pesanti
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Metric:
+    __slots__ = ("name", "kind", "help", "labels", "buckets")
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        labels: Labels,
+        buckets: Tuple[float, ...] = (),
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+
+
+class _Cells:
+    """Valori scritti da un solo thread."""
+
+    __slots__ = ("values", "hists")
+
+    def __init__(self) -> None:
+        # (serie, label) → valore
+        self.values: Dict[Tuple[str, Labels], float] = {}
+        # (serie, label) → [conteggio per bucket..., +Inf, somma]
+        self.hists: Dict[Tuple[str, Labels], List[float]] = {}
+
+
+class _Owner:
+    """Tenuto solo dal thread-local: raccolto quando il thread termina."""
+
+    __slots__ = ("__weakref__",)
+
+
+_metrics: Dict[str, _Metric] = {}
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+_all_cells: List[_Cells] = []
+# celle dei thread terminati, sommate
+_retired = _Cells()
+_cells_lock = threading.Lock()
+_local = threading.local()
+
+
+def _define(
+    name: str, kind: str, help: str, labels: Labels, buckets: Tuple[float, ...] = ()
+) -> str:
+    metric = _metrics.get(name)
+    if metric is not None:
+        if (metric.kind, metric.labels) != (kind, labels):
+            raise ValueError(f"metrica {name} già definita come {metric.kind}")
+        return name
+    _metrics[name] = _Metric(name, kind, help, labels, buckets)
+    return name
+
+
+def counter(name: str, help: str, labels: Labels = ()) -> str:
+    return _define(name, "counter", help, labels)
+
+
+def gauge(name: str, help: str, labels: Labels = ()) -> str:
+    return _define(name, "gauge", help, labels)
+
+
+def histogram(
+    name: str,
+    help: str,
+    labels: Labels = (),
+    buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+) -> str:
+    return _define(name, "histogram", help, labels, tuple(sorted(buckets)))
+
+
+def register_collector(fn: Callable[[], Iterable[Sample]]) -> None:
+    """`fn` viene chiamata ad ogni scrape e ritorna (serie, label, valore)."""
+    if fn not in _collectors:
+        _collectors.append(fn)
+
+
+# ---------- registrazione (hot path) ----------
+
+
+def _merge_cells(dst: _Cells, src: _Cells) -> None:
+    for key, value in list(src.values.items()):
+        dst.values[key] = dst.values.get(key, 0.0) + value
+    for key, counts in list(src.hists.items()):
+        total = dst.hists.get(key)
+        if total is None:
+            dst.hists[key] = list(counts)
+        else:
+            for i, c in enumerate(counts):
+                total[i] += c
+
+
+def _retire(cells: _Cells) -> None:
+    # thread terminato: nessuno scrive più in `cells`
+    with _cells_lock:
+        _merge_cells(_retired, cells)
+        _all_cells.remove(cells)
+
+
+def _cells() -> _Cells:
+    cells = getattr(_local, "cells", None)
+    if cells is None:
+        cells = _local.cells = _Cells()
+        owner = _local.owner = _Owner()
+        with _cells_lock:
+            _all_cells.append(cells)
+        weakref.finalize(owner, _retire, cells)
+    return cells
+
+
+def inc(name: str, labels: Labels = (), value: float = 1.0) -> None:
+    """Counter += value (o gauge += value, anche negativo)."""
+    values = _cells().values
+    key = (name, labels)
+    values[key] = values.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, labels: Labels = ()) -> None:
+    hists = _cells().hists
+    key = (name, labels)
+    cells = hists.get(key)
+    if cells is None:
+        cells = hists[key] = [0.0] * (len(_metrics[name].buckets) + 2)
+    cells[bisect.bisect_left(_metrics[name].buckets, value)] += 1
+    cells[-1] += value
+
+
+# ---------- esposizione ----------
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Labels, values: Labels, extra: Optional[str] = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def _snapshot() -> (
+    Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], List[float]]]
+):
+    """
+    Somma delle celle dei thread vivi e di quelle dei thread terminati.
+    list(dict.items()) è una copia fatta in C senza rilasciare il GIL:
+    nessun lock sulle celle anche se i thread continuano a scrivere.
+    Elenco e accumulatore si copiano insieme sotto lock, così una cella
+    ritirata durante lo scrape non viene contata due volte.
+    """
+    total = _Cells()
+    with _cells_lock:
+        all_cells = list(_all_cells)
+        _merge_cells(total, _retired)
+    for cells in all_cells:
+        _merge_cells(total, cells)
+    return total.values, total.hists
+
+
+def _derive_hit_ratios(values: Dict[Tuple[str, Labels], float]) -> None:
+    """tpi_cache_hit_ratio da tpi_cache_requests_total (hit / letture)."""
+    reads: Dict[Labels, List[float]] = {}
+    for (name, labels), value in values.items():
+        if name == CACHE_REQUESTS:
+            cache, tenant, result = labels
+            counts = reads.setdefault((cache, tenant), [0.0, 0.0])
+            counts[0 if result == "hit" else 1] += value
+    for labels, (hits, misses) in reads.items():
+        if hits + misses:
+            values[(CACHE_HIT_RATIO, labels)] = hits / (hits + misses)
+
+
+def render() -> str:
+    """Tutte le serie nel formato testuale Prometheus 0.0.4."""
+    values, hists = _snapshot()
+    for collect in list(_collectors):
+        for name, labels, value in collect():
+            values[(name, labels)] = value
+    _derive_hit_ratios(values)
+
+    by_metric: Dict[str, List[Tuple[Labels, Any]]] = {}
+    for (name, labels), value in values.items():
+        by_metric.setdefault(name, []).append((labels, value))
+    for (name, labels), counts in hists.items():
+        by_metric.setdefault(name, []).append((labels, counts))
+
+    lines: List[str] = []
+    for name in sorted(_metrics):
+        metric = _metrics[name]
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, data in sorted(by_metric.get(name, ()), key=lambda s: s[0]):
+            if metric.kind != "histogram":
+                suffix = _fmt_labels(metric.labels, labels)
+                lines.append(f"{name}{suffix} {_fmt_value(data)}")
+                continue
+            bucket_counts: List[float] = data
+            cumulative = 0.0
+            for bound, count in zip(metric.buckets + (math.inf,), bucket_counts):
+                cumulative += count
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(
+                    f"{name}_bucket{_fmt_labels(metric.labels, labels, le)} "
+                    f"{_fmt_value(cumulative)}"
+                )
+            suffix = _fmt_labels(metric.labels, labels)
+            lines.append(f"{name}_sum{suffix} {_fmt_value(bucket_counts[-1])}")
+            lines.append(f"{name}_count{suffix} {_fmt_value(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- serie comuni ----------
+
+HTTP_LATENCY = histogram(
+    "tpi_http_request_duration_seconds",
+    "Latenza delle richieste HTTP per route (template) e metodo",
+    ("route", "method"),
+)
+HTTP_RESPONSES = counter(
+    "tpi_http_responses_total",
+    "Risposte HTTP per route, metodo e classe di status",
+    ("route", "method", "status"),
+)
+HTTP_IN_FLIGHT = gauge("tpi_http_requests_in_flight", "Richieste HTTP in corso")
+HTTP_RATE_LIMITED = counter(
+    "tpi_http_rate_limited_total",
+    "Richieste rifiutate con 429 dal rate limit, per budget",
+    ("budget",),
+)
+HTTP_SERVER_ERRORS = counter(
+    "tpi_http_server_errors_total",
+    "Risposte 5xx (incluse le eccezioni non gestite) per route",
+    ("route",),
+)
+IMPORT_ROWS = counter(
+    "tpi_import_rows_total", "Righe importate per pipeline", ("pipeline",)
+)
+IMPORT_BYTES = counter(
+    "tpi_import_bytes_total", "Byte di CSV importati per pipeline", ("pipeline",)
+)
+CACHE_REQUESTS = counter(
+    "tpi_cache_requests_total",
+    "Letture delle cache per esito (hit / miss)",
+    ("cache", "tenant", "result"),
+)
+CACHE_HIT_RATIO = gauge(
+    "tpi_cache_hit_ratio",
+    "Quota di hit sulle letture della cache",
+    ("cache", "tenant"),
+)
+
+
+def record_import(pipeline: str, rows: int, nbytes: int) -> None:
+    inc(IMPORT_ROWS, (pipeline,), rows)
+    inc(IMPORT_BYTES, (pipeline,), nbytes)
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
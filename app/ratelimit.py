@@ -0,0 +1,674 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+# ============================================================
+# Rate limit
+# - memory: token bucket per processo, stato O(1) per chiave
+# - sqlite / redis: contatori a finestra condivisi tra i worker (stesso
+#   file SQLite o stesso server Redis / compatibile RESP)
+# - Lock a strisce: le chiavi sono ripartite su SHARDS dizionari, ognuno
+#   col proprio lock (sezioni critiche di pochi microsecondi, mai await)
+# - Backend condivisi: la decisione usa la vista locale; gli incrementi
+#   vanno al backend a batch, da un thread, ogni RATE_SYNC_MS
+# - Eviction: LRU con tetto di chiavi + chiavi inattive rimosse strada
+#   facendo (stato scaduto ≡ chiave assente)
+# - Policy per route: regole dichiarative → budget con nome (es. read /
+#   write), costo pesato (peso fisso, byte di upload), route esenti
+# ============================================================
+
+log = logging.getLogger("tpi.ratelimit")
+
+SHARDS = 64
+# chiavi inattive rimosse ad ogni accesso (costo ammortizzato costante)
+EVICT_PER_CALL = 2
+
+
+# (chiave, finestra) → costo ammesso
+Counts = Dict[Tuple[str, int], float]
+# (ammessa, secondi da attendere se rifiutata, unità rimaste, secondi
+# al ripristino completo del budget)
+Decision = Tuple[bool, float, float, float]
+
+
+class _Shard:
+    __slots__ = ("lock", "buckets", "pending")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # chiave → stato; ordine = ultimo accesso (LRU)
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        # solo backend condivisi: incrementi non ancora inviati
+        self.pending: Counts = {}
+
+
+class RateLimiter:
+    """
+    Base comune: stato per chiave in SHARDS OrderedDict (ordine LRU).
+    Lo stato è una lista con l'ultimo accesso in posizione 1; dopo
+    `idle_sec` senza accessi vale quanto una chiave mai vista.
+    """
+
+    backend = "memory"
+    burst: float
+
+    def __init__(self, window_sec: float, max_keys: int, idle_sec: float) -> None:
+        self.window = float(max(window_sec, 1))
+        self.idle_sec = idle_sec
+        self._shards = [_Shard() for _ in range(SHARDS)]
+        self._shard_cap = max(max_keys // SHARDS, 1)
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % SHARDS]
+
+    def _touch(
+        self, buckets: "OrderedDict[str, List[float]]", key: str, fresh: List[float]
+    ) -> Tuple[List[float], bool]:
+        """Stato della chiave (creato se assente) spostato in coda LRU."""
+        state = buckets.get(key)
+        created = state is None
+        if state is None:
+            state = buckets[key] = fresh
+            if len(buckets) > self._shard_cap:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return state, created
+
+    def _evict_idle(self, buckets: "OrderedDict[str, List[float]]", now: float) -> None:
+        for _ in range(EVICT_PER_CALL):
+            if not buckets:
+                return
+            key, state = next(iter(buckets.items()))
+            if now - state[1] < self.idle_sec:
+                return  # la più vecchia è ancora attiva: lo sono tutte
+            del buckets[key]
+
+    def acquire(
+        self, key: str, cost: float = 1.0, now: Optional[float] = None
+    ) -> Decision:  # pragma: no cover - interfaccia
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "keys": sum(len(s.buckets) for s in self._shards),
+        }
+
+    def close(self) -> None:
+        pass
+
+
+class TokenBucketLimiter(RateLimiter):
+    """
+    Token bucket per chiave (es. IP client).
+    - burst: token massimi = richieste consecutive ammesse
+    - window: secondi per ricaricare il bucket da vuoto a pieno
+      (ritmo sostenuto: burst richieste ogni window secondi)
+    - max_keys: tetto di chiavi in memoria; oltre, si scartano le meno
+      recenti (una chiave scartata riparte con il bucket pieno)
+    """
+
+    def __init__(self, burst: int, window_sec: float, max_keys: int = 100_000) -> None:
+        # bucket pieno dopo `window` secondi: da lì in poi è come assente
+        super().__init__(window_sec, max_keys, idle_sec=float(max(window_sec, 1)))
+        self.burst = float(max(burst, 1))
+        self.rate = self.burst / self.window  # token al secondo
+
+    def acquire(
+        self, key: str, cost: float = 1.0, now: Optional[float] = None
+    ) -> Decision:
+        """Consuma `cost` token se disponibili."""
+        now = time.monotonic() if now is None else now
+        shard = self._shard(key)
+        with shard.lock:
+            buckets = shard.buckets
+            state, created = self._touch(buckets, key, [self.burst, now])
+            if not created:
+                state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+                state[1] = now
+            self._evict_idle(buckets, now)
+            allowed = state[0] >= cost
+            if allowed:
+                state[0] -= cost
+            tokens = state[0]
+        reset = (self.burst - tokens) / self.rate
+        if allowed:
+            return True, 0.0, tokens, reset
+        return False, (cost - tokens) / self.rate, tokens, reset
+
+
+# ---------- backend condivisi ----------
+
+
+class _SharedWindowLimiter(RateLimiter):
+    """
+    Contatore a finestra scorrevole condiviso tra worker. Per chiave e
+    finestra fissa (window secondi, orologio di sistema) il backend tiene
+    la somma dei costi ammessi da tutti i processi; uso stimato:
+        prev * (1 - frazione trascorsa della finestra) + cur
+    ammessa se uso + costo <= burst (burst richieste per finestra).
+    La decisione usa la vista locale: totali dell'ultimo sync + costi
+    ammessi qui nel frattempo + quanto gli altri worker hanno ammesso da
+    allora, proiettato col loro ritmo all'ultimo sync. Un thread invia gli
+    incrementi a batch ogni sync_sec e aggiorna la vista; il superamento
+    possibile è limitato a una frazione di un intervallo di sync.
+    Backend irraggiungibile: si prosegue con la sola vista locale.
+    """
+
+    def __init__(
+        self, burst: int, window_sec: float, max_keys: int, sync_sec: float
+    ) -> None:
+        # stato: [finestra, ultimo accesso, cur, prev, cur al sync, istante
+        # del sync, ritmo degli altri worker]; dopo 2 finestre è vuoto
+        super().__init__(window_sec, max_keys, idle_sec=2 * float(max(window_sec, 1)))
+        self.burst = float(max(burst, 1))
+        self.sync_sec = max(sync_sec, 0.001)
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failing = False
+        self._stats: Dict[str, Any] = {"syncs": 0, "errors": 0, "last_sync_ms": 0.0}
+
+    # ---------- decisione (thread della richiesta) ----------
+
+    def acquire(
+        self, key: str, cost: float = 1.0, now: Optional[float] = None
+    ) -> Decision:
+        if self._pid != os.getpid():
+            self._start()
+        now = time.time() if now is None else now
+        slot = int(now // self.window)
+        elapsed = now / self.window - slot  # frazione di finestra trascorsa
+        shard = self._shard(key)
+        with shard.lock:
+            state, _ = self._touch(
+                shard.buckets, key, [slot, now, 0.0, 0.0, 0.0, now, 0.0]
+            )
+            self._roll(state, slot)
+            state[1] = now
+            self._evict_idle(shard.buckets, now)
+            pkey = (key, slot)
+            cur = state[2] + min(self.burst, state[6] * (now - state[5]))
+            prev = state[3]
+            used = prev * (1.0 - elapsed) + cur
+            allowed = used + cost <= self.burst
+            if allowed:
+                state[2] += cost
+                cur += cost
+                used += cost
+                shard.pending[pkey] = shard.pending.get(pkey, 0.0) + cost
+            else:
+                # nessun incremento, ma al prossimo sync si rilegge
+                shard.pending.setdefault(pkey, 0.0)
+        remaining = max(self.burst - used, 0.0)
+        # cur pesa fino alla fine della finestra successiva, prev fino a questa
+        reset = ((2.0 if cur else 1.0 if prev else 0.0) - elapsed) * self.window
+        if allowed:
+            return True, 0.0, remaining, max(reset, 0.0)
+        return False, self._wait(cur, prev, elapsed, cost), remaining, max(reset, 0.0)
+
+    @staticmethod
+    def _roll(state: List[float], slot: int) -> None:
+        if slot != state[0]:
+            state[3] = state[2] if slot == state[0] + 1 else 0.0
+            state[2] = state[4] = 0.0
+            state[0] = slot
+
+    def _wait(self, cur: float, prev: float, elapsed: float, cost: float) -> float:
+        """Secondi finché la stima scende abbastanza da ammettere `cost`."""
+        room = self.burst - cost
+        if room < 0:
+            return self.window
+        if cur <= room:  # basta che decada la finestra precedente (prev > 0)
+            return max(0.0, 1.0 - (room - cur) / prev - elapsed) * self.window
+        return (1.0 - elapsed + max(0.0, 1.0 - room / cur)) * self.window
+
+    # ---------- sync (thread dedicato) ----------
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # primo uso o processo figlio dopo un fork: thread e connessioni
+            # del padre qui non esistono, i suoi incrementi li invia lui
+            self._pid = os.getpid()
+            self._reset_connection()
+            for shard in self._shards:
+                shard.pending = {}
+            self._thread = threading.Thread(
+                target=self._sync_loop,
+                name=f"ratelimit-sync:{self.backend}",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _sync_loop(self) -> None:
+        while not self._closed.wait(self.sync_sec):
+            self.sync()
+
+    def sync(self) -> None:
+        """Invia gli incrementi accumulati e aggiorna la vista locale."""
+        batch: Counts = {}
+        for shard in self._shards:
+            if shard.pending:
+                with shard.lock:
+                    pending, shard.pending = shard.pending, {}
+                batch.update(pending)
+        if not batch:
+            return
+        t0 = time.perf_counter()
+        try:
+            totals = self._push(batch)
+        except Exception as exc:
+            self._stats["errors"] += 1
+            self._reset_connection()
+            if not self._failing:
+                log.warning("Rate limit %s non raggiungibile: %s", self.backend, exc)
+                self._failing = True
+            return
+        if self._failing:
+            log.info("Rate limit %s di nuovo raggiungibile", self.backend)
+            self._failing = False
+        self._stats["syncs"] += 1
+        self._stats["last_sync_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+        self._apply(batch, totals)
+
+    def _apply(
+        self, batch: Counts, totals: Dict[Tuple[str, int], Tuple[float, float]]
+    ) -> None:
+        now = time.time()
+        for (key, slot), (cur, prev) in totals.items():
+            shard = self._shard(key)
+            with shard.lock:
+                state = shard.buckets.get(key)
+                if state is None:
+                    continue
+                # costi ammessi dopo lo snapshot: non ancora nel backend
+                late = shard.pending.get((key, slot), 0.0)
+                if state[0] == slot:
+                    others = cur - state[4] - batch[(key, slot)]
+                    span = now - state[5]
+                    if span > 0:
+                        state[6] = max(others, 0.0) / span
+                    state[2:6] = [cur + late, prev, cur, now]
+                elif state[0] == slot + 1:
+                    state[3] = cur + late
+
+    def _push(self, batch: Counts) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        """Somma `batch` nel backend; ritorna (cur, prev) per ogni voce."""
+        raise NotImplementedError  # pragma: no cover
+
+    def _reset_connection(self) -> None:
+        raise NotImplementedError  # pragma: no cover
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), **self._stats}
+
+    def close(self) -> None:
+        """Ultimo sync e chiusura della connessione (shutdown)."""
+        self._closed.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=max(1.0, 2 * self.sync_sec))
+            self.sync()
+        self._reset_connection()
+
+
+class SqliteLimiter(_SharedWindowLimiter):
+    """
+    Contatori in un file SQLite (WAL) condiviso dai worker della stessa
+    macchina. Un sync = una transazione: upsert degli incrementi, lettura
+    dei totali, pulizia delle finestre passate al cambio di finestra.
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        burst: int,
+        window_sec: float,
+        path: Path,
+        max_keys: int = 100_000,
+        sync_sec: float = 0.05,
+    ) -> None:
+        super().__init__(burst, window_sec, max_keys, sync_sec)
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._purged = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False: l'ultimo sync di close() gira altrove,
+        # a thread di sync già fermo
+        conn = sqlite3.connect(
+            self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # contatori effimeri: la durabilità non serve
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS ratelimit ("
+            "key TEXT NOT NULL, slot INTEGER NOT NULL, cost REAL NOT NULL, "
+            "PRIMARY KEY (key, slot)) WITHOUT ROWID"
+        )
+        return conn
+
+    def _reset_connection(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _push(self, batch: Counts) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        if self._conn is None:
+            self._conn = self._connect()
+        conn = self._conn
+        rows = [(key, slot, cost) for (key, slot), cost in batch.items()]
+        totals: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO ratelimit(key, slot, cost) VALUES (?, ?, ?) "
+                "ON CONFLICT(key, slot) DO UPDATE SET cost = cost + excluded.cost",
+                rows,
+            )
+            for key, slot, _ in rows:
+                got = dict(
+                    conn.execute(
+                        "SELECT slot, cost FROM ratelimit "
+                        "WHERE key = ? AND slot IN (?, ?)",
+                        (key, slot, slot - 1),
+                    )
+                )
+                totals[(key, slot)] = (got.get(slot, 0.0), got.get(slot - 1, 0.0))
+            newest = max(slot for _, slot, _ in rows)
+            if newest > self._purged:
+                conn.execute("DELETE FROM ratelimit WHERE slot < ?", (newest - 1,))
+                self._purged = newest
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return totals
+
+
+class RespError(Exception):
+    """Risposta di errore (-ERR ...) dal server RESP."""
+
+
+class RespClient:
+    """
+    Client RESP2 minimale con pipeline: quanto serve al rate limit su
+    Redis o su un server compatibile. Non thread-safe (lo usa solo il
+    thread di sync). URL: redis://[:password@]host[:port][/db]
+    """
+
+    def __init__(self, url: str, timeout: float = 1.0) -> None:
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int((parsed.path or "/").strip("/") or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file: Any = None
+
+    def _connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock, self._file = sock, sock.makefile("rb")
+        setup: List[Tuple[Any, ...]] = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self.pipeline(setup)
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self) -> Any:
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connessione RESP chiusa")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            return RespError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            return None if size < 0 else self._file.read(size + 2)[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise ConnectionError(f"risposta RESP non valida: {line[:32]!r}")
+
+    def pipeline(self, commands: List[Tuple[Any, ...]]) -> List[Any]:
+        """Invia i comandi in un'unica scrittura e legge tutte le risposte."""
+        if self._sock is None:
+            self._connect()
+        assert self._sock is not None
+        self._sock.sendall(b"".join(self._encode(c) for c in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def close(self) -> None:
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                self._file.close()
+                sock.close()
+            except OSError:
+                pass
+
+
+class RedisLimiter(_SharedWindowLimiter):
+    """
+    Contatori su Redis (o server compatibile RESP): una chiave per
+    (client, finestra) con scadenza, INCRBYFLOAT + PEXPIRE + GET della
+    finestra precedente, tutto in una pipeline per sync.
+    """
+
+    backend = "redis"
+    PREFIX = "tpi:rl:"
+    PIPELINE_KEYS = 1000
+
+    def __init__(
+        self,
+        burst: int,
+        window_sec: float,
+        url: str,
+        max_keys: int = 100_000,
+        sync_sec: float = 0.05,
+    ) -> None:
+        super().__init__(burst, window_sec, max_keys, sync_sec)
+        self.url = url
+        self._client: Optional[RespClient] = None
+
+    def _reset_connection(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    def _push(self, batch: Counts) -> Dict[Tuple[str, int], Tuple[float, float]]:
+        if self._client is None:
+            self._client = RespClient(self.url)
+        ttl_ms = int(self.window * 2000) + 1000
+        items = list(batch.items())
+        totals: Dict[Tuple[str, int], Tuple[float, float]] = {}
+        for start in range(0, len(items), self.PIPELINE_KEYS):
+            chunk = items[start : start + self.PIPELINE_KEYS]
+            commands: List[Tuple[Any, ...]] = []
+            for (key, slot), cost in chunk:
+                name = f"{self.PREFIX}{key}:{slot}"
+                commands.append(("INCRBYFLOAT", name, repr(float(cost))))
+                commands.append(("PEXPIRE", name, ttl_ms))
+                commands.append(("GET", f"{self.PREFIX}{key}:{slot - 1}"))
+            replies = self._client.pipeline(commands)
+            for i, (pkey, _) in enumerate(chunk):
+                prev = replies[3 * i + 2]
+                totals[pkey] = (float(replies[3 * i]), float(prev) if prev else 0.0)
+        return totals
+
+
+def build_limiter(
+    backend: str,
+    burst: int,
+    window_sec: float,
+    *,
+    max_keys: int = 100_000,
+    sync_ms: int = 50,
+    sqlite_path: Optional[Path] = None,
+    redis_url: Optional[str] = None,
+) -> RateLimiter:
+    """Limiter per RATE_BACKEND: memory (default), sqlite, redis."""
+    kind = (backend or "memory").strip().lower()
+    sync_sec = max(sync_ms, 1) / 1000.0
+    if kind == "sqlite":
+        path = sqlite_path or Path("data") / "ratelimit.sqlite3"
+        return SqliteLimiter(burst, window_sec, path, max_keys, sync_sec)
+    if kind == "redis":
+        url = redis_url or "redis://127.0.0.1:6379/0"
+        return RedisLimiter(burst, window_sec, url, max_keys, sync_sec)
+    if kind != "memory":
+        log.warning("RATE_BACKEND sconosciuto (%s): uso memory", backend)
+    return TokenBucketLimiter(burst, window_sec, max_keys=max_keys)
+
+
+# ---------- policy per route ----------
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+Header = Tuple[bytes, bytes]
+
+
+class Rule:
+    """
+    Regola dichiarativa di rate limit.
+    - pattern: path esatto ("/healthz") o prefisso ("/api/dpi/csv/*", "*")
+    - methods: metodi HTTP a cui si applica (vuoto = tutti)
+    - budget: nome del budget da cui scalare il costo (None = esente)
+    - weight: costo fisso della richiesta
+    - bytes_per_unit: se > 0, +1 unità di costo ogni tanti byte di
+      Content-Length (upload pesati per dimensione)
+    """
+
+    __slots__ = ("pattern", "methods", "budget", "weight", "bytes_per_unit")
+
+    def __init__(
+        self,
+        pattern: str,
+        methods: Iterable[str] = (),
+        budget: Optional[str] = "read",
+        weight: float = 1.0,
+        bytes_per_unit: int = 0,
+    ) -> None:
+        self.pattern = pattern
+        self.methods = frozenset(m.upper() for m in methods)
+        self.budget = budget
+        self.weight = float(weight)
+        self.bytes_per_unit = bytes_per_unit
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.methods and method not in self.methods:
+            return False
+        if self.pattern.endswith("*"):
+            return path.startswith(self.pattern[:-1])
+        return path == self.pattern
+
+    def cost(self, content_length: int) -> float:
+        if self.bytes_per_unit > 0 and content_length > 0:
+            return self.weight + content_length / self.bytes_per_unit
+        return self.weight
+
+    def __repr__(self) -> str:
+        methods = ",".join(sorted(self.methods)) or "*"
+        return f"Rule({methods} {self.pattern} → {self.budget}, w={self.weight:g})"
+
+
+class RateLimitPolicy:
+    """
+    Regole valutate in ordine (vince la prima che corrisponde) e budget
+    con nome, ognuno col proprio limiter (chiave: "<budget>:<ip>").
+    check() ritorna None per le richieste esenti, altrimenti
+    (ammessa, secondi da attendere, header RateLimit-*, budget).
+    Un costo oltre la capienza del budget viene ridotto alla capienza:
+    la richiesta svuota il budget invece di essere sempre rifiutata.
+    """
+
+    def __init__(self, rules: Iterable[Rule], budgets: Dict[str, RateLimiter]) -> None:
+        self.rules = tuple(rules)
+        self.budgets = dict(budgets)
+        for rule in self.rules:
+            if rule.budget is not None and rule.budget not in self.budgets:
+                raise ValueError(f"{rule!r}: budget '{rule.budget}' non definito")
+        self._policy_header = {
+            name: (
+                f'{limiter.burst:g};w={limiter.window:g};name="{name}"'.encode(
+                    "latin-1"
+                )
+            )
+            for name, limiter in self.budgets.items()
+        }
+
+    def rule_for(self, method: str, path: str) -> Optional[Rule]:
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return None
+
+    def check(
+        self, method: str, path: str, client_ip: str, content_length: int = 0
+    ) -> Optional[Tuple[bool, float, List[Header], str]]:
+        rule = self.rule_for(method, path)
+        if rule is None or rule.budget is None:
+            return None
+        limiter = self.budgets[rule.budget]
+        cost = min(rule.cost(content_length), limiter.burst)
+        allowed, wait, remaining, reset = limiter.acquire(
+            f"{rule.budget}:{client_ip}", cost
+        )
+        headers = [
+            (b"ratelimit-limit", b"%d" % limiter.burst),
+            (b"ratelimit-remaining", b"%d" % math.floor(remaining)),
+            (b"ratelimit-reset", b"%d" % math.ceil(reset)),
+            (b"ratelimit-policy", self._policy_header[rule.budget]),
+        ]
+        return allowed, wait, headers, rule.budget
+
+    def retry_after(self, wait: float) -> str:
+        """Valore per l'header Retry-After (secondi interi, almeno 1)."""
+        return str(max(1, math.ceil(wait)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: limiter.stats() for name, limiter in self.budgets.items()}
+
+    def close(self) -> None:
+        for limiter in self.budgets.values():
+            limiter.close()
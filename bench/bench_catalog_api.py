@@ -0,0 +1,315 @@
+"""
+Benchmark API Catalogo DPI, in-process (TestClient / ASGI, nessun server).
+
+    python bench/bench_catalog_api.py [--sizes 1000,10000,100000,1000000]
+        [--storage json|wal|sqlite] [--app csv|main] [--requests 50]
+        [--json out.json | --json -] [--baseline prev.json --tolerance 1.25]
+
+Per ogni dimensione: catalogo sintetico caricato con /save, delta con
+/import-file (metà aggiornamenti, metà codici nuovi), poi /catalogo,
+/search, /export, /metrics e /report.html ripetuti. Per endpoint: p50,
+p99, throughput; per dimensione: picco di RSS.
+
+Ogni dimensione gira in un processo separato con una directory dati
+temporanea, così il picco di RSS è quello della singola dimensione.
+Con --baseline il comando esce con codice 1 se un p50 peggiora oltre
+la tolleranza: da lanciare prima di un rilascio.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import synth  # noqa: E402
+
+PREFIX = "/api/dpi/csv"
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# variazioni sotto questa soglia sono rumore, anche se in proporzione grandi
+NOISE_FLOOR_MS = 1.0
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: KiB su Linux, byte su macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    # nearest-rank
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _summary(samples: List[float], rows: int = 0, nbytes: int = 0) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    total = sum(ordered)
+    out: Dict[str, Any] = {
+        "n": len(ordered),
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(total / len(ordered) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "req_per_s": round(len(ordered) / total, 1),
+    }
+    if rows:
+        out["rows_per_s"] = round(rows / total)
+    if nbytes:
+        out["mb_per_s"] = round(nbytes / total / 1e6, 1)
+    return out
+
+
+def _load_app(name: str) -> Any:
+    if name == "main":
+        from app.main import app
+    else:
+        from app.dpi_csv import app
+    return app
+
+
+# ---------- singola dimensione (processo figlio) ----------
+
+
+def run_size(size: int, requests: int, app_name: str) -> Dict[str, Any]:
+    from fastapi.testclient import TestClient
+
+    rss_start = _peak_rss_mb()
+    app = _load_app(app_name)
+    samples: Dict[str, List[float]] = {}
+    rows: Dict[str, int] = {}
+    nbytes: Dict[str, int] = {}
+
+    with TestClient(app) as client:
+
+        def call(name: str, method: str, url: str, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            r = client.request(method, PREFIX + url, **kwargs)
+            elapsed = time.perf_counter() - t0
+            if r.status_code >= 400:
+                raise SystemExit(f"{name}: HTTP {r.status_code} {r.text[:200]}")
+            samples.setdefault(name, []).append(elapsed)
+            nbytes[name] = nbytes.get(name, 0) + len(r.content)
+            return r
+
+        body = synth.csv_bytes(size)
+        call(
+            "save", "POST", "/save", content=body, headers={"content-type": "text/csv"}
+        )
+        rows["save"] = size
+
+        delta = max(size // 10, 1)
+        for i in range(max(1, min(5, requests // 10))):
+            # seed diverso ad ogni giro: contenuto nuovo, niente "duplicate"
+            upload = synth.csv_bytes(
+                delta, seed=100 + i, start=size - delta // 2 + i * delta
+            )
+            call(
+                "import_file",
+                "POST",
+                "/import-file",
+                files={"file": (f"delta{i}.csv", upload, "text/csv")},
+            )
+            rows["import_file"] = rows.get("import_file", 0) + delta
+
+        total_items = call("metrics", "GET", "/metrics").json()["total_items"]
+        samples["metrics"].clear()
+
+        after = ""
+        for _ in range(requests):
+            page = call(
+                "catalogo", "GET", "/catalogo", params={"limit": 100, "after": after}
+            )
+            after = page.json().get("next_after") or ""
+        for _ in range(requests):
+            call(
+                "catalogo_gruppo",
+                "GET",
+                "/catalogo",
+                params={"gruppo": "GUANTI", "limit": 100},
+            )
+        for i in range(requests):
+            call(
+                "search",
+                "GET",
+                "/search",
+                params={"q": synth.PAROLE[i % len(synth.PAROLE)]},
+            )
+        for _ in range(requests):
+            call("metrics", "GET", "/metrics")
+        pages = max(1, math.ceil(total_items / 50))
+        for i in range(requests):
+            call("report", "GET", "/report.html", params={"page": i % pages + 1})
+        exports = max(3, requests // 10)
+        for _ in range(exports):
+            call("export", "GET", "/export")
+        rows["export"] = total_items * exports
+
+    endpoints = {
+        name: _summary(
+            times,
+            rows=rows.get(name, 0),
+            nbytes=nbytes[name] if name == "export" else 0,
+        )
+        for name, times in samples.items()
+    }
+    return {
+        "size": size,
+        "total_items": total_items,
+        "peak_rss_start_mb": rss_start,
+        "peak_rss_mb": _peak_rss_mb(),
+        "endpoints": endpoints,
+    }
+
+
+# ---------- orchestrazione ----------
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _run_child(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench-dpi-") as base:
+        env = {
+            **os.environ,
+            "CATALOGHI_BASE_DIR": base,
+            "CATALOGHI_STORAGE": args.storage,
+            # il rate limit di app.main falserebbe le misure
+            "RATE_BURST": "1000000000",
+        }
+        cmd = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--child",
+            str(size),
+            "--requests",
+            str(args.requests),
+            "--app",
+            args.app,
+        ]
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"benchmark fallito per size={size}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    out = sys.stderr
+    out.write(
+        f"\n{result['size']:,} item  (catalogo finale {result['total_items']:,}, "
+        f"RSS picco {result['peak_rss_mb']} MB)\n"
+    )
+    out.write(
+        f"  {'endpoint':<16}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}{'righe/s':>12}\n"
+    )
+    for name, s in result["endpoints"].items():
+        per_row = f"{s['rows_per_s']:,}" if "rows_per_s" in s else ""
+        out.write(
+            f"  {name:<16}{s['p50_ms']:>10}{s['p99_ms']:>10}"
+            f"{s['req_per_s']:>10}{per_row:>12}\n"
+        )
+
+
+def compare(
+    report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """p50 peggiorati oltre `tolerance` (rapporto) rispetto al baseline."""
+    before = {r["size"]: r["endpoints"] for r in baseline.get("results", [])}
+    regressions = []
+    for result in report["results"]:
+        old = before.get(result["size"], {})
+        for name, s in result["endpoints"].items():
+            if name not in old:
+                continue
+            was, now = old[name]["p50_ms"], s["p50_ms"]
+            if now > was * tolerance and now - was > NOISE_FLOOR_MS:
+                regressions.append(
+                    f"size={result['size']} {name}: p50 {was} → {now} ms "
+                    f"(x{now / was:.2f})"
+                )
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="dimensioni del catalogo, separate da virgola (es. 1000,1000000)",
+    )
+    ap.add_argument("--storage", default="json", choices=("json", "wal", "sqlite"))
+    ap.add_argument("--app", default="csv", choices=("csv", "main"))
+    ap.add_argument("--requests", type=int, default=50, help="richieste per endpoint")
+    ap.add_argument("--json", dest="json_path", help="risultato JSON (- = stdout)")
+    ap.add_argument("--baseline", help="JSON di un run precedente da confrontare")
+    ap.add_argument("--tolerance", type=float, default=1.25)
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args.requests, args.app)))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = []
+    for size in sizes:
+        result = _run_child(size, args)
+        _print_result(result)
+        results.append(result)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "storage": args.storage,
+            "app": args.app,
+            "requests": args.requests,
+        },
+        "results": results,
+    }
+    if args.json_path == "-":
+        print(json.dumps(report, indent=2))
+    elif args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            sys.stderr.write(f"REGRESSIONE {line}\n")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Benchmark overhead dei middleware di app.main, per richiesta.
+
+    python bench/bench_middleware.py [--requests 20000] [--json out.json]
+
+Stessa app minima (/healthz JSON e /stream a 64 chunk) chiamata come
+ASGI, senza server né client HTTP, in tre configurazioni:
+- none: nessun middleware (riferimento)
+- base_http: correlation-id, security headers e rate limit come tre
+  BaseHTTPMiddleware (la catena precedente, copiata qui per il confronto)
+- asgi: EdgeMiddleware di app.main (metriche Prometheus incluse)
+Per configurazione: p50 e media per richiesta, e overhead rispetto a none.
+Il limiter è lo stesso (memory, burst enorme): si misura la catena, non
+il rate limit.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.middleware.base import (  # noqa: E402
+    BaseHTTPMiddleware,
+    RequestResponseEndpoint,
+)
+from starlette.types import ASGIApp  # noqa: E402
+
+from app.main import EdgeMiddleware  # noqa: E402
+from app.ratelimit import (  # noqa: E402
+    RateLimiter,
+    RateLimitPolicy,
+    Rule,
+    TokenBucketLimiter,
+)
+
+STREAM_CHUNKS = 64
+
+
+# ---------- catena precedente (BaseHTTPMiddleware) ----------
+
+
+class _CorrelationId(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        req_id = (
+            request.headers.get("x-request-id")
+            or request.headers.get("x-correlation-id")
+            or str(uuid.uuid4())
+        )
+        request.state.request_id = req_id
+        response = await call_next(request)
+        response.headers.setdefault("x-request-id", req_id)
+        response.headers.setdefault("x-correlation-id", req_id)
+        return response
+
+
+class _SecurityHeaders(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        response = await call_next(request)
+        headers = response.headers
+        headers.setdefault("X-Content-Type-Options", "nosniff")
+        headers.setdefault("X-Frame-Options", "DENY")
+        headers.setdefault("X-XSS-Protection", "1; mode=block")
+        headers.setdefault("Referrer-Policy", "strict-origin-when-cross-origin")
+        headers.setdefault(
+            "Permissions-Policy", "geolocation=(), microphone=(), camera=()"
+        )
+        return response
+
+
+class _RateLimit(BaseHTTPMiddleware):
+    def __init__(self, app: ASGIApp, limiter: RateLimiter) -> None:
+        super().__init__(app)
+        self.limiter = limiter
+
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+        client_ip = request.client.host if request.client else "unknown"
+        allowed = self.limiter.acquire(client_ip)[0]
+        if not allowed:
+            return JSONResponse(
+                status_code=429, content={"detail": "Too Many Requests"}
+            )
+        return await call_next(request)
+
+
+# ---------- app e configurazioni ----------
+
+
+def _build(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/healthz")
+    def healthz() -> Dict[str, Any]:
+        return {"status": "ok"}
+
+    @app.get("/stream")
+    def stream() -> StreamingResponse:
+        return StreamingResponse(
+            iter([b"x" * 1024] * STREAM_CHUNKS), media_type="text/plain"
+        )
+
+    limiter = TokenBucketLimiter(10**9, 60)
+    if stack == "base_http":
+        app.add_middleware(_CorrelationId)
+        app.add_middleware(_SecurityHeaders)
+        app.add_middleware(_RateLimit, limiter=limiter)
+    elif stack == "asgi":
+        policy = RateLimitPolicy([Rule("*")], {"read": limiter})
+        app.add_middleware(EdgeMiddleware, policy=policy)
+    return app
+
+
+STACKS: Dict[str, Callable[[], FastAPI]] = {
+    name: functools.partial(_build, name) for name in ("none", "base_http", "asgi")
+}
+
+
+async def _drive(app: Any, path: str, n: int) -> List[float]:
+    scope_base = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"user-agent", b"bench")],
+        "client": ("10.0.0.1", 40000),
+        "server": ("bench", 80),
+    }
+    samples: List[float] = []
+    statuses: List[int] = []
+
+    async def send(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    for _ in range(n):
+        sent = False
+
+        async def receive() -> Dict[str, Any]:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await asyncio.Event().wait()  # client connesso fino alla fine
+            return {"type": "http.disconnect"}  # pragma: no cover
+
+        t0 = time.perf_counter()
+        await app(dict(scope_base), receive, send)
+        samples.append(time.perf_counter() - t0)
+    if any(status != 200 for status in statuses):
+        raise SystemExit(f"{path}: risposte non 200")
+    return samples
+
+
+def _us(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "p50_us": round(ordered[len(ordered) // 2] * 1e6, 1),
+        "mean_us": round(sum(ordered) / len(ordered) * 1e6, 1),
+    }
+
+
+def run(requests: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for path in ("/healthz", "/stream"):
+        per_stack: Dict[str, Dict[str, float]] = {}
+        for name, build in STACKS.items():
+            app = build()
+            asyncio.run(_drive(app, path, min(requests, 500)))  # warm-up
+            per_stack[name] = _us(asyncio.run(_drive(app, path, requests)))
+        base = per_stack["none"]
+        for name, s in per_stack.items():
+            s["overhead_p50_us"] = round(s["p50_us"] - base["p50_us"], 1)
+            s["overhead_mean_us"] = round(s["mean_us"] - base["mean_us"], 1)
+        results[path] = per_stack
+    return results
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--requests", type=int, default=20_000)
+    ap.add_argument("--json", dest="json_path", help="risultato JSON (- = stdout)")
+    args = ap.parse_args()
+    logging.getLogger("tpi").setLevel(logging.WARNING)
+
+    results = run(args.requests)
+    out = sys.stderr
+    for path, per_stack in results.items():
+        out.write(f"\n{path}  ({args.requests:,} richieste)\n")
+        out.write(
+            f"  {'stack':<12}{'p50 µs':>10}{'media µs':>10}"
+            f"{'overhead p50':>14}{'overhead media':>16}\n"
+        )
+        for name, s in per_stack.items():
+            out.write(
+                f"  {name:<12}{s['p50_us']:>10}{s['mean_us']:>10}"
+                f"{s['overhead_p50_us']:>14}{s['overhead_mean_us']:>16}\n"
+            )
+    if args.json_path == "-":
+        print(json.dumps(results, indent=2))
+    elif args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
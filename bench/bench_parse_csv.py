@@ -0,0 +1,90 @@
+"""
+Benchmark parser CSV del Catalogo DPI: csv.DictReader (riga per riga)
+contro parser colonnare (pandas), sullo stesso file generato.
+
+    python bench/bench_parse_csv.py --rows 500000 [--repeat 3] [--json out.json]
+
+Verifica anche che i due parser producano righe identiche.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import dpi_csv  # noqa: E402
+from synth import write_csv  # noqa: E402
+
+
+def _collect(batches: Any) -> List[dict[str, Any]]:
+    return [row for batch in batches for row in batch]
+
+
+def _timed(fn: Callable[[], List[dict[str, Any]]], repeat: int) -> Dict[str, Any]:
+    best = float("inf")
+    rows: List[dict[str, Any]] = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = fn()
+        best = min(best, time.perf_counter() - t0)
+    return {
+        "seconds": round(best, 4),
+        "rows_per_s": round(len(rows) / best),
+        "rows": rows,
+    }
+
+
+def run(rows: int, repeat: int) -> Dict[str, Any]:
+    if dpi_csv._pandas() is None:
+        raise SystemExit("pandas non installato: parser colonnare non disponibile")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.csv"
+        write_csv(path, rows)
+        open_source = lambda: path.open("rb")  # noqa: E731
+        size = path.stat().st_size
+        if not dpi_csv._bulk_compatible(open_source):
+            raise SystemExit("file generato non compatibile col parser colonnare")
+        row_by_row = _timed(
+            lambda: _collect(dpi_csv._iter_stream_batches(open_source)), repeat
+        )
+        bulk = _timed(lambda: _collect(dpi_csv._iter_bulk_batches(open_source)), repeat)
+    identical = row_by_row.pop("rows") == bulk.pop("rows")
+    return {
+        "rows": rows,
+        "bytes": size,
+        "csv": row_by_row,
+        "bulk": bulk,
+        "speedup": round(row_by_row["seconds"] / bulk["seconds"], 2),
+        "identical": identical,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=500_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", dest="json_path", help="scrive il risultato in JSON")
+    args = ap.parse_args()
+
+    result = run(args.rows, args.repeat)
+    print(
+        f"{result['rows']} righe ({result['bytes'] / 1e6:.1f} MB)\n"
+        f"  csv.DictReader : {result['csv']['rows_per_s']:>10,} righe/s\n"
+        f"  colonnare      : {result['bulk']['rows_per_s']:>10,} righe/s\n"
+        f"  speedup        : {result['speedup']}x  identiche: {result['identical']}"
+    )
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(result, indent=2))
+    if not result["identical"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
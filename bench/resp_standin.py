@@ -0,0 +1,121 @@
+"""
+Server compatibile RESP minimale, in memoria: sostituto locale di Redis
+per provare RATE_BACKEND=redis senza un server vero.
+
+    python bench/resp_standin.py [--host 127.0.0.1] [--port 6390]
+    RATE_BACKEND=redis RATE_REDIS_URL=redis://127.0.0.1:6390/0 uvicorn ...
+
+Comandi: PING, AUTH, SELECT, GET, SET, DEL, INCRBYFLOAT, PEXPIRE, FLUSHALL
+(quelli usati da app/ratelimit.py, più qualcuno per ispezionare).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+Store = Dict[bytes, Tuple[bytes, Optional[float]]]  # valore, scadenza
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _get(store: Store, key: bytes) -> Optional[bytes]:
+    item = store.get(key)
+    if item is None:
+        return None
+    if item[1] is not None and item[1] <= time.monotonic():
+        del store[key]
+        return None
+    return item[0]
+
+
+def execute(store: Store, args: List[bytes]) -> bytes:
+    cmd = args[0].upper() if args else b""
+    if cmd == b"PING":
+        return b"+PONG\r\n"
+    if cmd in (b"AUTH", b"SELECT", b"FLUSHALL"):
+        if cmd == b"FLUSHALL":
+            store.clear()
+        return b"+OK\r\n"
+    if cmd == b"GET" and len(args) == 2:
+        return _bulk(_get(store, args[1]))
+    if cmd == b"SET" and len(args) == 3:
+        store[args[1]] = (args[2], None)
+        return b"+OK\r\n"
+    if cmd == b"DEL" and len(args) >= 2:
+        removed = sum(store.pop(k, None) is not None for k in args[1:])
+        return b":%d\r\n" % removed
+    if cmd == b"INCRBYFLOAT" and len(args) == 3:
+        old = _get(store, args[1])
+        try:
+            value = float(old or b"0") + float(args[2])
+        except ValueError:
+            return b"-ERR value is not a valid float\r\n"
+        data = repr(value).encode()
+        expires = store[args[1]][1] if args[1] in store else None
+        store[args[1]] = (data, expires)
+        return _bulk(data)
+    if cmd == b"PEXPIRE" and len(args) == 3:
+        if _get(store, args[1]) is None:
+            return b":0\r\n"
+        store[args[1]] = (store[args[1]][0], time.monotonic() + int(args[2]) / 1000)
+        return b":1\r\n"
+    return b"-ERR unknown command or wrong number of arguments\r\n"
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):  # inline (es. da telnet)
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        size = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def serve(host: str, port: int) -> Any:
+    store: Store = {}
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    break
+                writer.write(execute(store, args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return asyncio.start_server(handle, host, port)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6390)
+    args = ap.parse_args()
+
+    async def run() -> None:
+        server = await serve(args.host, args.port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Dati sintetici per i benchmark del Catalogo DPI: righe CSV deterministiche
+(stesso seed → stesso file) con le colonne del template.
+"""
+
+from __future__ import annotations
+
+import random
+from pathlib import Path
+from typing import Iterator
+
+HEADER = "codice,descrizione,prezzo,gruppo\n"
+GRUPPI = ("GUANTI", "CALZATURE", "ELMETTI", "OCCHIALI", "INDUMENTI")
+PAROLE = ("guanto", "nitrile", "taglia", "antitaglio", "scarpa", "S3", "casco")
+
+
+def iter_lines(rows: int, seed: int = 42, start: int = 0) -> Iterator[str]:
+    """
+    Righe CSV con codici DPI<start>..DPI<start+rows-1>: spazi attorno ai
+    campi, prezzi con virgola decimale, ~5% di descrizioni quotate.
+    """
+    rnd = random.Random(seed)
+    for i in range(start, start + rows):
+        desc = " ".join(rnd.choices(PAROLE, k=rnd.randint(2, 6)))
+        if rnd.random() < 0.05:
+            desc = f'"{desc}, ""{i}"""'
+        prezzo = f"{rnd.randint(0, 999)},{rnd.randint(0, 99):02d}"
+        yield f' DPI{i:07d} ,{desc},"{prezzo}", {rnd.choice(GRUPPI)} \n'
+
+
+def csv_bytes(rows: int, seed: int = 42, start: int = 0) -> bytes:
+    return (HEADER + "".join(iter_lines(rows, seed, start))).encode("utf-8")
+
+
+def write_csv(path: Path, rows: int, seed: int = 42, start: int = 0) -> None:
+    with path.open("w", encoding="utf-8", newline="") as fh:
+        fh.write(HEADER)
+        fh.writelines(iter_lines(rows, seed, start))
@@ -0,0 +1,103 @@
+import codecs
+import io
+from pathlib import Path
+
+import pytest
+
+from app import csv_store
+from app.csv_store import RecordStore, iter_csv_records, iter_export_bytes
+
+
+def _records(text: str) -> list:
+    return list(iter_csv_records(io.BytesIO(text.encode("utf-8"))))
+
+
+def _export(store: RecordStore, collection: str) -> bytes:
+    return b"".join(iter_export_bytes(store, collection))
+
+
+def test_upsert_per_id_mantiene_posizione(tmp_path: Path) -> None:
+    store = RecordStore(tmp_path / "store.sqlite3")
+    assert store.upsert("cataloghi", _records("id,nome\n1,Uno\n2,Due\n,Senza\n")) == (
+        2,
+        1,
+    )
+    assert store.upsert("cataloghi", _records("id,nome,note\n1,Primo,x\n3,Tre,\n")) == (
+        2,
+        0,
+    )
+
+    assert store.count("cataloghi") == 3
+    assert store.columns("cataloghi") == ["id", "nome", "note"]
+    rows = [r for batch in store.iter_batches("cataloghi") for r in batch]
+    assert [(r["id"], r["nome"]) for r in rows] == [
+        ("1", "Primo"),
+        ("2", "Due"),
+        ("3", "Tre"),
+    ]
+    # le collezioni non si mescolano
+    assert store.count("schede") == 0
+    assert store.columns("schede") == ["id", "catalogo_id", "titolo"]
+
+
+def test_export_bom_header_e_batch(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(csv_store, "BATCH_ROWS", 2)
+    store = RecordStore(tmp_path / "store.sqlite3")
+    assert _export(store, "percorsi") == codecs.BOM_UTF8 + b"id,nome,stato\r\n"
+
+    body = "".join(f"p{i},Percorso {i},attivo\n" for i in range(5))
+    store.upsert("percorsi", _records("id,nome,stato\n" + body))
+    chunks = list(iter_export_bytes(store, "percorsi"))
+    assert chunks[0] == codecs.BOM_UTF8
+    text = b"".join(chunks[1:]).decode("utf-8")
+    assert text.splitlines() == ["id,nome,stato"] + body.splitlines()
+
+
+def test_file_non_valido_non_applica_nulla(tmp_path: Path) -> None:
+    store = RecordStore(tmp_path / "store.sqlite3")
+    store.upsert("schede", _records("id,titolo\ns1,Prima\n"))
+    bad = b"id,titolo\ns1,Cambiata\ns2,\xff\n"
+    with pytest.raises(UnicodeDecodeError):
+        store.upsert("schede", iter_csv_records(io.BytesIO(bad)))
+    rows = [r for batch in store.iter_batches("schede") for r in batch]
+    assert rows == [{"id": "s1", "titolo": "Prima"}]
+
+
+def test_righe_lette_a_chunk(monkeypatch: pytest.MonkeyPatch) -> None:
+    # chunk minuscoli: righe e caratteri multibyte spezzati tra due letture
+    monkeypatch.setattr(csv_store, "READ_CHUNK_BYTES", 3)
+    data = codecs.BOM_UTF8 + 'id,nome\n1,Città\n2,"a\nb"\n3,ultimo'.encode()
+    assert list(iter_csv_records(io.BytesIO(data))) == [
+        {"id": "1", "nome": "Città"},
+        {"id": "2", "nome": "a\nb"},
+        {"id": "3", "nome": "ultimo"},
+    ]
+
+
+def test_route_import_export(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from httpx import Response
+
+    from app.csv_routes import router
+
+    monkeypatch.setenv("CSV_STORE_DB", str(tmp_path / "store.sqlite3"))
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    def upload(body: bytes) -> Response:
+        return client.post(
+            "/api/cataloghi/import", files={"file": ("c.csv", body, "text/csv")}
+        )
+
+    ok = upload(b"id,nome\n1,Uno\n,Vuoto\n")
+    assert ok.status_code == 200
+    assert ok.json() == {"imported": 1, "skipped": 1}
+    assert upload(b"id,nome\n2,\xff\n").status_code == 400
+
+    export = client.get("/api/cataloghi/export")
+    assert export.status_code == 200
+    assert export.content == codecs.BOM_UTF8 + b"id,nome\r\n1,Uno\r\n"
@@ -0,0 +1,302 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import dpi_csv, dpi_manifest, dpi_store
+from app.dpi_csv import app
+
+HEADER = "codice,descrizione,prezzo,gruppo\n"
+BASE = "/api/dpi/csv"
+
+
+@pytest.fixture
+def base_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    # radice dati isolata per test: store, manifest e writer sono per percorso
+    monkeypatch.setenv("CATALOGHI_BASE_DIR", str(tmp_path))
+    monkeypatch.delenv("CATALOGHI_STORAGE", raising=False)
+    monkeypatch.delenv("CATALOGHI_TENANTS", raising=False)
+    return tmp_path
+
+
+def _save(client: TestClient, body: str, **params: str) -> dict:
+    r = client.post(
+        f"{BASE}/save",
+        content=body.encode("utf-8"),
+        headers={"content-type": "text/csv"},
+        params=params,
+    )
+    assert r.status_code in (200, 202), r.text
+    return r.json()
+
+
+def test_save_concorrenti_senza_aggiornamenti_persi(base_dir: Path) -> None:
+    bodies = [f"{HEADER}C{i:03d},Articolo {i},{i},g{i % 3}\n" for i in range(24)]
+    with TestClient(app) as client:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda b: _save(client, b), bodies))
+        catalogo = client.get(f"{BASE}/catalogo").json()
+
+    assert all(r["status"] == "ok" for r in results)
+    expected = {f"C{i:03d}" for i in range(24)}
+    assert {it["codice"] for it in catalogo["items"]} == expected
+    # anche su disco: nessun merge ha sovrascritto quello di un altro
+    saved = json.loads((base_dir / "clean" / "dpi_items.json").read_text("utf-8"))
+    assert {it["codice"] for it in saved} == expected
+
+
+def test_import_duplicato_senza_merge(base_dir: Path) -> None:
+    body = HEADER + "A1,Casco,12.50,testa\nA2,Guanti,3,mani\n"
+    with TestClient(app) as client:
+        first = _save(client, body)
+        second = _save(client, body)
+        upload = client.post(
+            f"{BASE}/import-file", files={"file": ("dpi.csv", body.encode())}
+        ).json()
+        metrics = client.get(f"{BASE}/metrics").json()
+
+    assert first["status"] == "ok" and first["rows_parsed"] == 2
+    assert second["status"] == "duplicate"
+    assert second["rows_parsed"] == 0 and second["total_items"] == 2
+    assert second["sha256"] == first["sha256"]
+    assert upload["status"] == "duplicate"
+    assert metrics["imports_count"] == 1
+
+
+def test_import_annullato_non_risulta_duplicato(
+    base_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    body = HEADER + "A1,Casco,12.50,testa\n"
+    # il job resta nella finestra di coalescenza finché l'app si ferma
+    monkeypatch.setattr(dpi_csv, "COALESCE_WINDOW_SEC", 5.0)
+    with TestClient(app) as client:
+        job_id = _save(client, body, job="true")["job_id"]
+    job = dpi_csv._jobs[job_id]
+    assert job.status == "cancelled"
+    leftovers = [p.name for p in (base_dir / "imports").iterdir()]
+    assert not [n for n in leftovers if n.endswith((".csv", ".part"))]
+
+    monkeypatch.setattr(dpi_csv, "COALESCE_WINDOW_SEC", 0.0)
+    with TestClient(app) as client:
+        again = _save(client, body)
+    assert again["status"] == "ok"
+    assert again["rows_parsed"] == 1 and again["total_items"] == 1
+
+
+def test_wal_ricaricato_dopo_compattazione(
+    base_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("CATALOGHI_STORAGE", "wal")
+    # niente compattazione periodica durante il test
+    monkeypatch.setenv("CATALOGHI_WAL_COMPACT_SEC", "3600")
+    items_path = base_dir / "clean" / "dpi_items.json"
+    with TestClient(app) as client:
+        _save(client, HEADER + "A1,Casco,10,testa\nA2,Guanti,2,mani\n")
+        backend = dpi_store.get_store(items_path).backend
+        assert isinstance(backend, dpi_store.WalBackend)
+        assert backend.compact()
+        _save(client, HEADER + "A1,Casco rinforzato,,\nA3,Cordino,5,anticaduta\n")
+
+    # dopo la compattazione il delta successivo è solo nel log
+    assert list((base_dir / "clean" / "wal").glob("segment-*.log"))
+    snapshot = json.loads(items_path.read_text("utf-8"))
+    assert [it["codice"] for it in snapshot] == ["A1", "A2"]
+
+    # nuovo backend (riavvio): snapshot + replay del log
+    reloaded = dpi_store.WalBackend(items_path).load()
+    by_codice = {it["codice"]: it for it in reloaded}
+    assert list(by_codice) == ["A1", "A2", "A3"]
+    assert by_codice["A1"]["descrizione"] == "Casco rinforzato"
+    assert by_codice["A1"]["prezzo"] == "10"
+
+    restarted = dpi_store.WalBackend(items_path)
+    assert restarted.compact()
+    assert restarted.load() == reloaded
+
+
+@pytest.mark.parametrize("storage", ["json", "wal", "sqlite"])
+def test_search_frammenti_corti_e_lunghi(
+    base_dir: Path, monkeypatch: pytest.MonkeyPatch, storage: str
+) -> None:
+    monkeypatch.setenv("CATALOGHI_STORAGE", storage)
+    body = (
+        HEADER
+        + "IMB-01,Imbracatura anticaduta,120,anticaduta\n"
+        + "COR-2M,Cordino 2m con assorbitore,45,anticaduta\n"
+        + "GUA-10,Guanti nitrile,3,mani\n"
+    )
+
+    def codici(q: str) -> list:
+        r = client.get(f"{BASE}/search", params={"q": q})
+        assert r.status_code == 200, r.text
+        return [it["codice"] for it in r.json()["items"]]
+
+    with TestClient(app) as client:
+        _save(client, body)
+        # 1 carattere: inizio di parola, non una lettera isolata
+        assert set(codici("c")) == {"COR-2M"}
+        assert set(codici("a")) == {"IMB-01", "COR-2M"}
+        # 2 caratteri: inizio di parola ("2m"), non a metà ("rd" di Cordino)
+        assert codici("2m") == ["COR-2M"]
+        assert codici("rd") == []
+        # 3+ caratteri: sottostringa ovunque
+        assert codici("itril") == ["GUA-10"]
+        assert codici("cordino ass") == ["COR-2M"]
+        # codice esatto sempre primo
+        assert codici("GUA-10")[0] == "GUA-10"
+
+
+def test_wal_firma_con_segmento_rimosso(
+    base_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("CATALOGHI_WAL_COMPACT_SEC", "3600")
+    items_path = base_dir / "clean" / "dpi_items.json"
+    backend = dpi_store.WalBackend(items_path)
+    backend.write([{"codice": "A1"}], [{"codice": "A1"}])
+    segments = backend._segments()
+    assert segments
+    # il compattatore rimuove il segmento tra il glob e lo stat()
+    monkeypatch.setattr(backend, "_segments", lambda: segments)
+    segments[0].unlink()
+    assert backend.signature()[2:] == ()
+
+
+def test_export_full_colonne_dal_delta(base_dir: Path) -> None:
+    with TestClient(app) as client:
+        _save(client, HEADER + "A1,Casco,10,testa\n")
+        _save(client, "codice,descrizione,stato\nA2,Guanti,attivo\n")
+        store = dpi_store.get_store(base_dir / "clean" / "dpi_items.json")
+        # campi aggiornati col delta del merge, senza ricaricare la cache
+        misses = store.misses
+        r = client.get(f"{BASE}/export", params={"columns": "full"})
+        assert store.misses == misses
+
+    header = r.text.splitlines()[0]
+    assert header == "codice,descrizione,prezzo,gruppo,stato"
+
+
+def test_metrics_non_carica_il_catalogo(base_dir: Path) -> None:
+    with TestClient(app) as client:
+        _save(client, HEADER + 'A1,Casco,10,testa\nA2,Elmetto,"1.234",testa\n')
+        store = dpi_store.get_store(base_dir / "clean" / "dpi_items.json")
+        reads = (store.hits, store.misses)
+        cold = client.get(f"{BASE}/metrics").json()
+        assert (store.hits, store.misses) == reads
+        assert cold["prezzi_per_gruppo"] is None
+
+        client.get(f"{BASE}/catalogo", params={"gruppo": "testa"})
+        _save(client, HEADER + "A3,Visiera,5,testa\n")
+        warm = client.get(f"{BASE}/metrics").json()
+
+    assert warm["prezzi_per_gruppo"] == {
+        "testa": {
+            "count": 3,
+            "min_cents": 500,
+            "max_cents": 123400,
+            "sum_cents": 124900,
+        }
+    }
+
+
+def test_report_etag_cambia_dopo_retention(base_dir: Path) -> None:
+    with TestClient(app) as client:
+        _save(client, HEADER + "A1,Casco,10,testa\n")
+        first = client.get(f"{BASE}/report.html")
+        etag = first.headers["etag"]
+
+        manifest = dpi_manifest.get_manifest(base_dir / "imports")
+        manifest.retention_days = 1
+        assert manifest.sweep(now=time.time() + 3 * 86400)["expired"] == 1
+        # stesso contenuto di catalogo, file diverso: nessun merge effettivo
+        _save(client, HEADER + "A1,Casco,10,testa\r\n")
+        assert manifest.summary()["count"] == 1
+
+        again = client.get(f"{BASE}/report.html", headers={"If-None-Match": etag})
+    assert again.status_code == 200
+    assert again.headers["etag"] != etag
+
+
+def test_tenant_non_valido_o_non_abilitato(base_dir: Path) -> None:
+    with TestClient(app) as client:
+        for bad in ("../x", "-a", "a/b", "x" * 65):
+            r = client.get(f"{BASE}/catalogo", headers={"X-Tenant-Id": bad})
+            assert r.status_code == 400, bad
+        r = client.get(f"{BASE}/catalogo", headers={"X-Tenant-Id": "intruso"})
+        assert r.status_code == 403
+        r = client.post(
+            f"{BASE}/save",
+            content=(HEADER + "A1,Casco,1,testa\n").encode(),
+            headers={"content-type": "text/csv", "X-Tenant-Id": "intruso"},
+        )
+        assert r.status_code == 403
+    # un id inventato dal client non crea nulla su disco
+    assert not (base_dir / "tenants").exists()
+
+
+def test_tenant_lista_ammessi(base_dir: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CATALOGHI_TENANTS", "acme, beta")
+    with TestClient(app) as client:
+        ok = client.get(f"{BASE}/catalogo", headers={"X-Tenant-Id": "acme"})
+        denied = client.get(f"{BASE}/catalogo", headers={"X-Tenant-Id": "gamma"})
+        default = client.get(f"{BASE}/catalogo")
+    assert ok.status_code == 200
+    assert denied.status_code == 403
+    assert default.status_code == 200
+    assert not (base_dir / "tenants" / "gamma").exists()
+
+
+def test_tenant_isolati(base_dir: Path) -> None:
+    # senza CATALOGHI_TENANTS basta l'albero predisposto
+    (base_dir / "tenants" / "acme").mkdir(parents=True)
+    acme = {"X-Tenant-Id": "acme"}
+    with TestClient(app) as client:
+        r = client.post(
+            f"{BASE}/save",
+            content=(HEADER + "A1,Casco,1,testa\n").encode(),
+            headers={"content-type": "text/csv", **acme},
+            params={"job": "true"},
+        )
+        assert r.status_code == 202, r.text
+        job_url = r.json()["status_url"]
+        for _ in range(200):
+            job = client.get(job_url, headers=acme).json()
+            if job["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.01)
+        assert job["status"] == "done", job
+        _save(client, HEADER + "D1,Occhiali,2,occhi\n")
+
+        own = client.get(f"{BASE}/catalogo", headers=acme).json()
+        other = client.get(f"{BASE}/catalogo").json()
+        # i job di un altro tenant non esistono
+        assert client.get(job_url).status_code == 404
+
+    assert [it["codice"] for it in own["items"]] == ["A1"]
+    assert [it["codice"] for it in other["items"]] == ["D1"]
+    assert (base_dir / "tenants" / "acme" / "clean" / "dpi_items.json").exists()
+
+
+@pytest.mark.parametrize("storage", ["json", "wal", "sqlite"])
+def test_filtro_prezzo(
+    base_dir: Path, monkeypatch: pytest.MonkeyPatch, storage: str
+) -> None:
+    monkeypatch.setenv("CATALOGHI_STORAGE", storage)
+    body = HEADER + (
+        'A1,Casco,"12,50",testa\n'
+        "A2,Guanti,1.234,mani\n"
+        "A3,Occhiali,99,occhi\n"
+        "A4,Tappi,n/d,orecchie\n"
+    )
+    with TestClient(app) as client:
+        _save(client, body)
+        r = client.get(
+            f"{BASE}/catalogo", params={"prezzo_min": "12,50", "prezzo_max": "99"}
+        )
+        bad = client.get(f"{BASE}/catalogo", params={"prezzo_min": "dodici"})
+    assert r.status_code == 200
+    # estremi inclusi; "1.234" sono migliaia, "n/d" è escluso
+    assert [it["codice"] for it in r.json()["items"]] == ["A1", "A3"]
+    assert bad.status_code == 422
@@ -0,0 +1,36 @@
+from typing import Any, Optional
+
+import pytest
+
+from app.dpi_index import parse_prezzo_cents
+
+
+@pytest.mark.parametrize(
+    "value, cents",
+    [
+        ("12,50", 1250),
+        ("12.50", 1250),
+        ("12.5", 1250),
+        ("3", 300),
+        ("€ 3", 300),
+        ("-1,5", -150),
+        ("1.234", 123400),
+        ("3.000.000", 300000000),
+        ("1.234,56", 123456),
+        ("1,234.56", 123456),
+        ("1,234", 123),
+        ("0,005", 1),
+        ("0,004", 0),
+        (12.5, 1250),
+        (7, 700),
+    ],
+)
+def test_parse_prezzo_cents(value: Any, cents: int) -> None:
+    assert parse_prezzo_cents(value) == cents
+
+
+@pytest.mark.parametrize(
+    "value", [None, "", "  ", "abc", "1e3", "1_000", "1.234.5", "1,2,3", "12,50 x"]
+)
+def test_parse_prezzo_cents_non_numerico(value: Optional[str]) -> None:
+    assert parse_prezzo_cents(value) is None
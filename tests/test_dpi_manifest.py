@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+import pytest
+
+from app.dpi_manifest import DAY_SEC, ImportsManifest, open_archived
+
+
+@pytest.fixture
+def manifest(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> ImportsManifest:
+    monkeypatch.setenv("CATALOGHI_IMPORTS_COMPRESS_DAYS", "2")
+    monkeypatch.setenv("CATALOGHI_IMPORTS_RETENTION_DAYS", "10")
+    # il thread di pulizia condiviso non deve intervenire durante il test
+    monkeypatch.setenv("CATALOGHI_IMPORTS_SWEEP_SEC", "3600")
+    return ImportsManifest(tmp_path)
+
+
+def _archive(manifest: ImportsManifest, body: bytes, imported_at: float) -> str:
+    sha = hashlib.sha256(body).hexdigest()
+    path = manifest.imports_dir / f"{sha}.csv"
+    path.write_bytes(body)
+    manifest.record(
+        path, sha256=sha, filename="in.csv", rows=1, imported_at=imported_at
+    )
+    return sha
+
+
+def test_sweep_comprime_e_scade(manifest: ImportsManifest) -> None:
+    now = 100 * DAY_SEC
+    old = _archive(manifest, b"codice\nA1\n", now - 20 * DAY_SEC)
+    mid = _archive(manifest, b"codice\nB1\n", now - 5 * DAY_SEC)
+    new = _archive(manifest, b"codice\nC1\n", now - 60)
+    before = manifest.summary()
+    assert before["count"] == 3 and before["revision"] == 3
+    assert all(manifest.has(sha) for sha in (old, mid, new))
+
+    assert manifest.sweep(now=now) == {"compressed": 1, "expired": 1}
+
+    d = manifest.imports_dir
+    assert not (d / f"{old}.csv").exists()
+    assert not (d / f"{mid}.csv").exists()
+    with open_archived(d / f"{mid}.csv.gz") as fh:
+        assert fh.read() == b"codice\nB1\n"
+    assert (d / f"{new}.csv").exists()
+
+    after = manifest.summary()
+    assert after["count"] == 2
+    assert after["compressed"] == 1
+    assert after["revision"] == before["revision"] + 1
+    # l'ultimo import resta quello registrato, anche se altri scadono
+    assert after["last_import_at"] == before["last_import_at"]
+    # contenuto scaduto: reimportabile
+    assert not manifest.has(old)
+    assert manifest.has(mid) and manifest.has(new)
+
+    entries = [
+        json.loads(line) for line in manifest.log_path.read_text("utf-8").splitlines()
+    ]
+    assert [e["file"] for e in entries] == [f"{mid}.csv.gz", f"{new}.csv"]
+    assert entries[0]["raw_bytes"] == len(b"codice\nB1\n")
+
+    # una seconda pulizia senza nulla da fare non tocca il manifest
+    assert manifest.sweep(now=now) == {"compressed": 0, "expired": 0}
+    assert manifest.summary()["revision"] == after["revision"]
+
+
+def test_totali_riletti_dal_log(manifest: ImportsManifest) -> None:
+    _archive(manifest, b"codice\nA1\n", 1000.0)
+    _archive(manifest, b"codice\nB1\n", 2000.0)
+    expected = manifest.summary()
+    # manifest.json non allineato al log (crash tra le due scritture)
+    manifest.summary_path.write_text(json.dumps({"count": 99}), encoding="utf-8")
+    reloaded = ImportsManifest(manifest.imports_dir)
+    assert reloaded.summary()["count"] == expected["count"]
+    assert reloaded.summary()["bytes"] == expected["bytes"]
+    assert reloaded.summary()["last_import_at"] == 2000.0
+
+
+def test_archivio_senza_manifest(tmp_path: Path) -> None:
+    sha = hashlib.sha256(b"x").hexdigest()
+    (tmp_path / f"{sha}.csv").write_bytes(b"x")
+    with gzip.open(tmp_path / f"{'0' * 64}.csv.gz", "wb") as fh:
+        fh.write(b"y")
+    manifest = ImportsManifest(tmp_path)
+    summary = manifest.summary()
+    assert summary["count"] == 2 and summary["compressed"] == 1
+    assert summary["revision"] == 1
+    # sha256 ricavato dal nome del file archiviato
+    assert manifest.has(sha)
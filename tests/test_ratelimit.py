@@ -0,0 +1,213 @@
+import asyncio
+import importlib.util
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.ratelimit import (
+    SHARDS,
+    RateLimitPolicy,
+    RedisLimiter,
+    Rule,
+    SqliteLimiter,
+    TokenBucketLimiter,
+)
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _load_resp_standin() -> Any:
+    # script di bench/ (non un package): caricato dal percorso
+    spec = importlib.util.spec_from_file_location(
+        "resp_standin", ROOT / "bench" / "resp_standin.py"
+    )
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_token_bucket_burst_e_ricarica() -> None:
+    limiter = TokenBucketLimiter(burst=3, window_sec=60)
+    # 3 richieste consecutive ammesse, la quarta attende 1/3 di finestra
+    assert [limiter.acquire("ip", now=0.0)[0] for _ in range(3)] == [True] * 3
+    allowed, wait, remaining, reset = limiter.acquire("ip", now=0.0)
+    assert not allowed and remaining == 0.0
+    assert wait == pytest.approx(20.0)
+    assert reset == pytest.approx(60.0)
+    # dopo 20 s un token è tornato
+    assert limiter.acquire("ip", now=20.0)[0]
+    assert not limiter.acquire("ip", now=20.0)[0]
+
+
+def test_token_bucket_chiavi_indipendenti_e_costo() -> None:
+    limiter = TokenBucketLimiter(burst=4, window_sec=60)
+    assert limiter.acquire("a", cost=4, now=0.0)[0]
+    assert not limiter.acquire("a", now=0.0)[0]
+    assert limiter.acquire("b", now=0.0)[0]
+    # costo oltre i token rimasti: rifiutata senza consumare
+    assert limiter.acquire("c", cost=3, now=0.0)[0]
+    allowed, wait, remaining, _ = limiter.acquire("c", cost=3, now=0.0)
+    assert not allowed and remaining == pytest.approx(1.0)
+    assert wait == pytest.approx(30.0)
+
+
+def test_token_bucket_tetto_chiavi() -> None:
+    limiter = TokenBucketLimiter(burst=1, window_sec=60, max_keys=SHARDS)
+    for i in range(50 * SHARDS):
+        limiter.acquire(f"ip{i}", now=0.0)
+    # al più una chiave per shard (LRU), memoria limitata
+    assert limiter.stats()["keys"] <= SHARDS
+    # chiave inattiva oltre la finestra: come mai vista
+    limiter.acquire("x", now=0.0)
+    assert limiter.acquire("x", now=61.0)[0]
+
+
+def _shared_limiters(make: Callable[[], Union[SqliteLimiter, RedisLimiter]]) -> None:
+    a, b = make(), make()
+    try:
+        assert all(a.acquire("ip")[0] for _ in range(3))
+        a.sync()
+        # b non ha ancora letto il backend: decide con la vista locale
+        assert b.acquire("ip")[0]
+        b.sync()
+        # dopo il sync vede anche quanto ammesso da a
+        assert not b.acquire("ip")[0]
+        a.sync()
+        assert not a.acquire("ip")[0]
+        # altra chiave: budget pieno
+        assert b.acquire("altro")[0]
+    finally:
+        a.close()
+        b.close()
+
+
+def test_sqlite_limiter_budget_condiviso(tmp_path: Path) -> None:
+    path = tmp_path / "ratelimit.sqlite3"
+    # sync solo esplicito: il thread di sync non scatta durante il test
+    _shared_limiters(lambda: SqliteLimiter(3, 3600, path, sync_sec=3600))
+
+
+@pytest.fixture
+def resp_url() -> Iterator[str]:
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(_load_resp_standin().serve("127.0.0.1", 0))
+    port = server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"redis://127.0.0.1:{port}/0"
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        server.close()
+        loop.close()
+
+
+def test_redis_limiter_budget_condiviso(resp_url: str) -> None:
+    _shared_limiters(lambda: RedisLimiter(3, 3600, resp_url, sync_sec=3600))
+
+
+def test_backend_irraggiungibile_usa_vista_locale() -> None:
+    limiter = RedisLimiter(2, 3600, "redis://127.0.0.1:1/0", sync_sec=3600)
+    try:
+        assert limiter.acquire("ip")[0]
+        limiter.sync()
+        assert limiter.stats()["errors"] == 1
+        assert limiter.acquire("ip")[0]
+        assert not limiter.acquire("ip")[0]
+    finally:
+        limiter.close()
+
+
+def test_regole_di_main_in_ordine() -> None:
+    from app.main import RATE_EXPORT_WEIGHT, RATE_RULES
+
+    policy = RateLimitPolicy(
+        RATE_RULES,
+        {"read": TokenBucketLimiter(5, 60), "write": TokenBucketLimiter(5, 60)},
+    )
+
+    def budget(method: str, path: str) -> Optional[str]:
+        rule = policy.rule_for(method, path)
+        assert rule is not None
+        return rule.budget
+
+    for probe in ("/health", "/healthz", "/version", "/metrics"):
+        assert budget("GET", probe) is None
+    assert budget("OPTIONS", "/api/dpi/csv/save") is None
+    assert budget("POST", "/api/dpi/csv/save") == "write"
+    assert budget("DELETE", "/api/cataloghi/1") == "write"
+    assert budget("GET", "/api/dpi/csv/catalogo") == "read"
+    # solo il path esatto è una probe
+    assert budget("GET", "/healthz/x") == "read"
+    export = policy.rule_for("GET", "/api/dpi/csv/export")
+    assert export is not None and export.weight == RATE_EXPORT_WEIGHT
+
+
+def test_policy_costo_pesato_e_limitato_alla_capienza() -> None:
+    policy = RateLimitPolicy(
+        [
+            Rule("/probe", budget=None),
+            Rule("*", methods=("POST",), budget="write", bytes_per_unit=100),
+            Rule("*"),
+        ],
+        {"read": TokenBucketLimiter(10, 60), "write": TokenBucketLimiter(4, 60)},
+    )
+    assert policy.check("GET", "/probe", "1.2.3.4") is None
+    # 1 + 250/100 = 3.5 unità
+    verdict = policy.check("POST", "/up", "1.2.3.4", content_length=250)
+    assert verdict is not None
+    allowed, _, headers, budget = verdict
+    assert allowed and budget == "write"
+    assert dict(headers)[b"ratelimit-remaining"] == b"0"
+    # upload enorme: costo ridotto alla capienza, svuota il budget
+    verdict = policy.check("POST", "/up", "5.6.7.8", content_length=10**9)
+    assert verdict is not None and verdict[0]
+    verdict = policy.check("POST", "/up", "5.6.7.8")
+    assert verdict is not None and not verdict[0]
+    # budget separati per nome: le letture restano ammesse
+    verdict = policy.check("GET", "/x", "5.6.7.8")
+    assert verdict is not None and verdict[0]
+
+
+def test_policy_budget_non_definito() -> None:
+    with pytest.raises(ValueError):
+        RateLimitPolicy(
+            [Rule("*", budget="write")], {"read": TokenBucketLimiter(1, 60)}
+        )
+
+
+def test_middleware_429_con_retry_after() -> None:
+    from app.main import EdgeMiddleware
+
+    app = FastAPI()
+
+    @app.get("/healthz")
+    def healthz() -> Dict[str, str]:
+        return {"status": "ok"}
+
+    @app.get("/dati")
+    def dati() -> Dict[str, str]:
+        return {"ok": "1"}
+
+    policy = RateLimitPolicy(
+        [Rule("/healthz", budget=None), Rule("*")],
+        {"read": TokenBucketLimiter(2, 60)},
+    )
+    app.add_middleware(EdgeMiddleware, policy=policy)
+    client = TestClient(app)
+
+    assert [client.get("/dati").status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.get("/dati")
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) >= 1
+    assert limited.headers["ratelimit-remaining"] == "0"
+    # probe esente anche a budget esaurito, senza header RateLimit
+    probe = client.get("/healthz")
+    assert probe.status_code == 200
+    assert "ratelimit-limit" not in probe.headers